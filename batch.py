@@ -0,0 +1,128 @@
+"""
+# batch.py
+#
+# Evaluate lots of independent expression strings across a pool of worker processes.
+#
+#    In [1]: list(evaluate_many(["1 + 2", "3 *", "2 ^ 10"], workers=2))
+#    Out[1]:
+#    [BatchResult(index=0, source='1 + 2', value=3, error=None),
+#     BatchResult(index=1, source='3 *', value=None, error=ValueError('Not enough operands for *')),
+#     BatchResult(index=2, source='2 ^ 10', value=1024, error=None)]
+#
+# Expressions are shipped to workers in chunks, and only a bounded number of chunks are
+# in flight at once, so huge (or endless) inputs stream through in constant memory.
+# Each worker process keeps its own compile cache (compiler.cache), so repeated
+# formulas are only parsed once per worker.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Iterable, Iterator, Mapping, NamedTuple
+
+import compiler
+
+
+DEFAULT_CHUNKSIZE = 256
+# how many chunks each worker may have queued up; bounds memory use on huge inputs
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+
+class BatchResult(NamedTuple):
+    index: int  # position in the input
+    source: str
+    value: int | float | None
+    error: Exception | None  # set instead of value when this expression failed
+
+
+def evaluate_chunk(
+    start: int, sources: list[str], variables: Mapping | None = None
+) -> list[BatchResult]:
+    """Evaluate one chunk of expressions, capturing errors per expression"""
+    results = []
+    for index, source in enumerate(sources, start):
+        try:
+            value = compiler.compile(source).evaluate(variables)
+        except Exception as e:
+            results.append(BatchResult(index, source, None, e))
+        else:
+            results.append(BatchResult(index, source, value, None))
+    return results
+
+
+def _init_worker(cache_size: int | None):
+    if cache_size is not None:
+        compiler.cache.resize(cache_size)
+
+
+def _chunks(sources: Iterable[str], chunksize: int) -> Iterator[tuple[int, list[str]]]:
+    iterator = iter(sources)
+    start = 0
+    while chunk := list(islice(iterator, chunksize)):
+        yield start, chunk
+        start += len(chunk)
+
+
+def evaluate_many(
+    sources: Iterable[str],
+    workers: int | None = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    variables: Mapping | None = None,
+    ordered: bool = True,
+    cache_size: int | None = None,
+) -> Iterator[BatchResult]:
+    """
+    Evaluate every expression in `sources`, yielding a BatchResult per expression.
+
+    workers:    number of worker processes (default: os.cpu_count()).
+                0 evaluates everything in this process, which is handy for debugging.
+    chunksize:  how many expressions get sent to a worker at a time
+    variables:  bindings shared by every expression
+    ordered:    yield results in input order (the default), or as soon as each chunk is done
+    cache_size: size of each worker's compile cache (default: compiler.DEFAULT_CACHE_SIZE)
+
+    A failing expression doesn't abort the batch: its BatchResult has `error` set instead.
+    """
+    if chunksize < 1:
+        raise ValueError(f"chunksize must be >= 1, got {chunksize}")
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    chunks = _chunks(sources, chunksize)
+    if workers == 0:
+        for start, chunk in chunks:
+            yield from evaluate_chunk(start, chunk, variables)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(cache_size,)) as pool:
+        yield from _stream(pool, chunks, variables, workers * CHUNKS_IN_FLIGHT_PER_WORKER, ordered)
+
+
+def _stream(
+    pool: Executor,
+    chunks: Iterator[tuple[int, list[str]]],
+    variables: Mapping | None,
+    max_in_flight: int,
+    ordered: bool,
+) -> Iterator[BatchResult]:
+    """Keep up to `max_in_flight` chunks submitted, yielding results as chunks come back"""
+    in_flight = deque()
+    for start, chunk in chunks:
+        in_flight.append(pool.submit(evaluate_chunk, start, chunk, variables))
+        if len(in_flight) >= max_in_flight:
+            yield from _drain(in_flight, ordered)
+
+    while in_flight:
+        yield from _drain(in_flight, ordered)
+
+
+def _drain(in_flight: deque, ordered: bool) -> Iterator[BatchResult]:
+    if ordered:
+        # head-of-line: wait for the oldest chunk, so results come out in input order
+        yield from in_flight.popleft().result()
+        return
+    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+    for future in done:
+        in_flight.remove(future)
+        yield from future.result()
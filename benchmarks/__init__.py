@@ -0,0 +1,7 @@
+"""
+# benchmarks
+#
+# The bench_*.py scripts each time one part of the pipeline against an alternative.
+# The suite (python -m benchmarks.suite) times every stage over a generated corpus
+# (see corpus.py), and can compare its results against an earlier run.
+"""
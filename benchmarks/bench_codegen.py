@@ -0,0 +1,42 @@
+"""
+# bench_codegen.py
+#
+# Compare evaluating compiled expressions with the stack interpreter (eval_rpn)
+# against the generated python functions from codegen.py.
+#
+#    python benchmarks/bench_codegen.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from compiler import compile_uncached  # noqa: E402
+
+
+EXPRESSIONS = [
+    "3 + 4",
+    "2 * x + y / 3 ^ z",
+    "sqrt(x * x + y * y) - abs(z - 1) * 0.5",
+    " + ".join(f"{n} * x ^ {n % 4}" for n in range(1, 50)),
+]
+VARIABLES = {"x": 1.5, "y": 2.5, "z": 3}
+
+
+def main(number=20_000):
+    for source in EXPRESSIONS:
+        label = source if len(source) < 50 else source[:47] + "..."
+        print(label)
+        timings = {}
+        for backend in ("stack", "python"):
+            expr = compile_uncached(source, backend=backend)
+            seconds = min(timeit.repeat(lambda: expr(VARIABLES), number=number, repeat=3))
+            timings[backend] = seconds / number
+            print(f"  {backend:<8} {timings[backend] * 1e6:9.2f} µs/eval")
+        print(f"  {'speedup':<8} {timings['stack'] / timings['python']:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+# bench_columnar.py
+#
+# Thousands of expressions in a handful of shapes, differing only in their numbers:
+# compiling and evaluating each one vs evaluate_grouped's one parse and one vectorized
+# pass per shape.
+#
+#    python benchmarks/bench_columnar.py
+"""
+
+import random
+import string
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from columnar import evaluate_grouped, group_expressions  # noqa: E402
+from compiler import compile_uncached  # noqa: E402
+
+SHAPES = [
+    "a * {:.4f} ^ n - c",
+    "x * {:.2f} + y * {:.2f} - {:.2f}",
+    "max({:d}, y, {:d}) % 7",
+    "sqrt({:.3f} * x) / ({:d} + y)",
+    "(x - {:.2f}) * (x - {:.2f}) * (x - {:.2f})",
+    "2 ^ {:d} + {:d} * n",
+]
+VARIABLES = {"a": 1000.0, "n": 12, "c": 50, "x": 2.5, "y": 7}
+
+
+def generate(count, seed=0):
+    rng = random.Random(seed)
+    sources = []
+    for _ in range(count):
+        shape = rng.choice(SHAPES)
+        numbers = [
+            rng.randint(0, 40) if spec == "d" else rng.uniform(0, 10)
+            for _, _, spec, _ in string.Formatter().parse(shape)
+            if spec is not None
+        ]
+        sources.append(shape.format(*numbers))
+    return sources
+
+
+def per_expression(sources, variables):
+    results = []
+    for source in sources:
+        try:
+            results.append(compile_uncached(source).evaluate(variables))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def bench(label, fn, count, number=1):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"  {label:<24} {seconds * 1000:9.2f} ms {count / seconds:12,.0f} expressions/s")
+    return seconds
+
+
+def main():
+    for count in (1_000, 10_000, 100_000):
+        sources = generate(count)
+        groups, _ = group_expressions(sources)
+        print(f"{count} expressions, {len(groups)} skeletons")
+        scalar = bench("one at a time", lambda: per_expression(sources, VARIABLES), count)
+        grouped = bench("evaluate_grouped", lambda: evaluate_grouped(sources, VARIABLES), count)
+        print(f"  {scalar / grouped:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+# bench_csv.py
+#
+# Formulas over a large generated CSV file, a chunk at a time: throughput, and peak memory
+# (which should depend on the chunk size, not the file size).
+#
+#    python benchmarks/bench_csv.py [rows]
+"""
+
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from csv_columns import evaluate_csv  # noqa: E402
+
+FORMULAS = {
+    "total": "price * qty * (1 + tax)",
+    "discounted": "max(price - 2.5, 0) * qty",
+    "score": "sqrt(qty) * log(price + 1)",
+}
+
+
+def write_csv(path, rows, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w") as file:
+        file.write("id,price,qty,region\n")
+        for start in range(0, rows, 10_000):
+            file.write(
+                "".join(
+                    f"{i},{rng.uniform(1, 100):.2f},{rng.randint(1, 20)},{rng.choice('abcd')}\n"
+                    for i in range(start, min(start + 10_000, rows))
+                )
+            )
+
+
+def peak_rss_mib():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(rows=2_000_000):
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "input.csv")
+        write_csv(source, rows)
+        size = os.path.getsize(source) / (1 << 20)
+        print(f"{rows} rows, {size:.0f} MiB; peak RSS before: {peak_rss_mib():.0f} MiB")
+        for chunk_bytes in (1 << 20, 4 << 20, 16 << 20):
+            with open(os.devnull, "w") as out:
+                start = time.perf_counter()
+                evaluate_csv(source, FORMULAS, out, {"tax": 0.2}, chunk_bytes=chunk_bytes)
+                seconds = time.perf_counter() - start
+            print(
+                f"  chunks of {chunk_bytes >> 20:2} MiB: {seconds:6.2f} s, "
+                f"{size / seconds:6.1f} MiB/s, {rows / seconds:10,.0f} rows/s, "
+                f"peak RSS {peak_rss_mib():.0f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,46 @@
+"""
+# bench_document.py
+#
+# A config file of formulas, one per line: splitting it into lines and compiling each
+# one on its own, vs compile_document's one scan over the whole file.
+#
+#    python benchmarks/bench_document.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.corpus import PROFILES, generate_corpus  # noqa: E402
+from compiler import compile_document, compile_uncached  # noqa: E402
+from tokenizer import scan, scan_document  # noqa: E402
+
+
+def bench(label, fn, count, number=3):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"  {label:<28} {seconds * 1000:9.2f} ms {count / seconds:12,.0f} formulas/s")
+    return seconds
+
+
+def per_line(document):
+    return [compile_uncached(line) for line in document.splitlines() if line.strip()]
+
+
+def main(count=2000):
+    for profile in ("short", "functions"):
+        document = "\n".join(generate_corpus(PROFILES[profile], count, seed=0)) + "\n"
+        print(f"{profile}: {count} formulas, {len(document) / 1024:.0f} KiB")
+        bench(
+            "scan per line",
+            lambda: [list(scan(line)) for line in document.splitlines()],
+            count,
+        )
+        bench("scan_document", lambda: list(scan_document(document)), count)
+        bench("compile_uncached per line", lambda: per_line(document), count)
+        bench("compile_document", lambda: list(compile_document(document)), count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+# bench_fingerprint.py
+#
+# A stream of formulas where a few are popular, and each one arrives written a different
+# way by different producers (see corpus.rewrite): CompileCache keyed on the source string,
+# vs CompileCache(canonical=True), which also looks formulas up by their fingerprint.
+#
+#    python benchmarks/bench_fingerprint.py
+"""
+
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.corpus import PROFILES, generate_corpus, rewrite  # noqa: E402
+from compiler import CompileCache  # noqa: E402
+
+
+def stream(formulas, count, spellings, seed=0):
+    # formula i is picked with weight 1 / (i + 1), written one of `spellings` ways
+    rng = random.Random(seed)
+    written = [
+        [formula] + [rewrite(formula, rng) for _ in range(spellings - 1)] for formula in formulas
+    ]
+    weights = [1 / (i + 1) for i in range(len(formulas))]
+    picks = rng.choices(range(len(formulas)), weights, k=count)
+    return [rng.choice(written[pick]) for pick in picks]
+
+
+def run(sources, maxsize, canonical, **options):
+    cache = CompileCache(maxsize=maxsize, canonical=canonical, **options)
+    start = time.perf_counter()
+    for source in sources:
+        cache.get(source)
+    seconds = time.perf_counter() - start
+    stats = cache.stats()
+    hits = stats["hits"] + stats.get("canonical_hits", 0)
+    programs = len({id(compiled) for compiled in cache._entries.values()})
+    label = "canonical" if canonical else "by source"
+    print(
+        f"    {label:<10} hit rate {hits / len(sources):6.1%}  "
+        f"{programs:4} distinct programs kept  {seconds * 1000:8.1f} ms"
+    )
+
+
+def main(formulas=1000, count=20_000, maxsize=256):
+    for profile in ("short", "functions"):
+        corpus = generate_corpus(PROFILES[profile], formulas, seed=0)
+        for spellings in (1, 4, 16):
+            sources = stream(corpus, count, spellings)
+            print(
+                f"{profile}: {count} lookups, {len(set(sources))} distinct strings "
+                f"({spellings} spellings per formula), maxsize={maxsize}"
+            )
+            for options in ({}, {"optimize": True, "backend": "python"}):
+                print(f"  {options or 'defaults'}")
+                run(sources, maxsize, canonical=False, **options)
+                run(sources, maxsize, canonical=True, **options)
+
+
+if __name__ == "__main__":
+    main()
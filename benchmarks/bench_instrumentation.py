@@ -0,0 +1,61 @@
+"""
+# bench_instrumentation.py
+#
+# What instrumentation costs: compiling and evaluating with it disabled (which should be
+# indistinguishable from calling the pipeline directly), and with it enabled.
+#
+#    python benchmarks/bench_instrumentation.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import instrumentation  # noqa: E402
+from benchmarks.corpus import PROFILES, VARIABLES, generate_corpus  # noqa: E402
+from compiler import CompiledExpression, _compile_tokens, compile_uncached  # noqa: E402
+from tokenizer import scan  # noqa: E402
+
+
+def compile_directly(source: str) -> CompiledExpression:
+    """compile_uncached, minus its check for instrumentation"""
+    return _compile_tokens(source, tuple(scan(source)), 0, False, "stack", False)
+
+
+def evaluate_all(expressions):
+    for expression in expressions:
+        try:
+            expression(VARIABLES)
+        except (ArithmeticError, ValueError):
+            pass
+
+
+def bench(label, fn, baseline=None, number=5):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    overhead = f"{seconds / baseline - 1:+7.1%}" if baseline else ""
+    print(f"  {label:<24} {seconds * 1000:9.2f} ms {overhead}")
+    return seconds
+
+
+def main(count=2000):
+    sources = generate_corpus(PROFILES["functions"], count, seed=0)
+    print(f"{count} expressions")
+
+    print("compile")
+    direct = bench("pipeline, directly", lambda: [compile_directly(s) for s in sources])
+    bench("disabled", lambda: [compile_uncached(s) for s in sources], direct)
+    with instrumentation.instrumented():
+        bench("enabled", lambda: [compile_uncached(s) for s in sources], direct)
+
+    print("evaluate")
+    expressions = [compile_uncached(s) for s in sources]
+    direct = bench("disabled", lambda: evaluate_all(expressions))
+    with instrumentation.instrumented():
+        expressions = [compile_uncached(s) for s in sources]
+        bench("enabled", lambda: evaluate_all(expressions), direct)
+
+
+if __name__ == "__main__":
+    main()
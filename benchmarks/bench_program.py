@@ -0,0 +1,67 @@
+"""
+# bench_program.py
+#
+# Memory held by lots of cached formulas, as RPN tuples vs compact Programs,
+# and evaluation speed of eval_rpn vs eval_program.
+#
+#    python benchmarks/bench_program.py
+"""
+
+import random
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from compiler import compile_uncached  # noqa: E402
+from program import Program  # noqa: E402
+from shunting_yard import get_rpn_tokens  # noqa: E402
+from tokenizer import scan, enrich  # noqa: E402
+
+
+def make_formula(rng: random.Random) -> str:
+    terms = [f"{rng.randint(1, 1000)} * x ^ {rng.randint(0, 3)}" for _ in range(rng.randint(2, 8))]
+    return " + ".join(terms) + f" - sqrt(y) / {rng.random():.3f}"
+
+
+def parse(source: str) -> tuple:
+    return tuple(get_rpn_tokens(enrich(scan(source))))
+
+
+def measure(build) -> int:
+    tracemalloc.start()
+    built = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del built
+    return size
+
+
+def main(count=20_000):
+    rng = random.Random(0)
+    sources = [make_formula(rng) for _ in range(count)]
+    print(f"{count} formulas, {sum(len(s) for s in sources) / count:.0f} chars on average")
+    for label, build in [
+        ("RPN tuples", lambda: [parse(source) for source in sources]),
+        ("Programs", lambda: [Program.from_rpn(parse(source)) for source in sources]),
+        ("CompiledExpression (stack)", lambda: [compile_uncached(s) for s in sources]),
+        (
+            "CompiledExpression (program)",
+            lambda: [compile_uncached(s, backend="program") for s in sources],
+        ),
+    ]:
+        print(f"  {label:<30} {measure(build) / count:8.0f} bytes/formula")
+
+    variables = {"x": 1.5, "y": 2.0}
+    for source in sources[:3]:
+        print(source)
+        for backend in ("stack", "program"):
+            expr = compile_uncached(source, backend=backend)
+            seconds = min(timeit.repeat(lambda: expr(variables), number=10_000, repeat=3))
+            print(f"  {backend:<8} {seconds / 10_000 * 1e6:8.2f} µs/eval")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+# bench_program_cache.py
+#
+# Worker startup: compiling a formula set from scratch, vs looking every formula up
+# in a program cache file written ahead of time.
+#
+#    python benchmarks/bench_program_cache.py
+"""
+
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.corpus import PROFILES, generate_corpus  # noqa: E402
+from compiler import compile_uncached  # noqa: E402
+from program_cache import ProgramCache, write_cache  # noqa: E402
+
+
+def bench(label, fn, number=3):
+    seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print(f"  {label:<28} {seconds * 1000:9.2f} ms")
+    return seconds
+
+
+def main(count=5000):
+    sources = generate_corpus(PROFILES["functions"], count, seed=0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "formulas.sypc"
+        written = write_cache(path, sources)
+        print(f"{written} formulas, {path.stat().st_size / 1024:.0f} KiB cache file")
+
+        def from_cache():
+            with ProgramCache(path) as cache:
+                return [cache.compile(source) for source in sources]
+
+        bench(
+            "compile_uncached", lambda: [compile_uncached(s, backend="program") for s in sources]
+        )
+        bench("ProgramCache.compile", from_cache)
+        bench("open only", lambda: ProgramCache(path).close())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+# bench_shunting.py
+#
+# get_rpn_tokens and eval_rpn over ~100k-token inputs, with the enrichment done up front
+# so that only the shunting yard (or the evaluation) is being timed.
+#
+#    python benchmarks/bench_shunting.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from shunting_yard import get_rpn_tokens, eval_rpn  # noqa: E402
+from tokenizer import scan, enrich  # noqa: E402
+
+
+INPUTS = {
+    # flat: a long sum of products
+    "sum of products": " + ".join(["3 * 4 - 2 / 7"] * 12_500),
+    # lots of parens and unary minus
+    "nested parens": " + ".join(["(2 * (3 - -4)) ^ 2"] * 7_500),
+    # right-associative chains pile up on the operator stack
+    "power towers": " + ".join(["(2 ^ 1 ^ 2 ^ 1 ^ 3)"] * 8_500),
+}
+
+
+def bench(label, fn, number=3):
+    seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print(f"  {label:<16} {seconds * 1000:9.2f} ms")
+
+
+def main():
+    for name, source in INPUTS.items():
+        tokens = list(enrich(scan(source)))
+        rpn = list(get_rpn_tokens(tokens))
+        print(f"{name}: {len(tokens)} tokens")
+        bench("get_rpn_tokens", lambda: list(get_rpn_tokens(tokens)))
+        bench("eval_rpn", lambda: eval_rpn(rpn))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+# bench_tokenizer.py
+#
+# Compare the scanner against the old stdlib tokenize round-trip, on long inputs.
+#
+#    python benchmarks/bench_tokenizer.py
+"""
+
+import sys
+import timeit
+from io import BytesIO
+from pathlib import Path
+from token import ENCODING, NEWLINE, ENDMARKER
+from tokenize import tokenize as builtin_tokenize
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tokenizer import scan, enrich  # noqa: E402
+
+
+def stdlib_tokenize(input: str):
+    """The tokenizer we used to have, kept here as a reference point"""
+    for token in builtin_tokenize(BytesIO(input.encode("utf-8")).readline):
+        if token.type in {ENCODING, NEWLINE, ENDMARKER}:
+            continue
+        yield token.string
+
+
+def make_input(terms: int) -> str:
+    chunk = "3.5 * sin(π) - -4 ÷ 2e3 + abs(7 - 2)"
+    return " + ".join([chunk] * terms)
+
+
+def bench(label, fn, number=5):
+    seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print(f"  {label:<28} {seconds * 1000:9.2f} ms")
+    return seconds
+
+
+def main():
+    for terms in (100, 1_000, 10_000):
+        source = make_input(terms)
+        print(f"{terms} terms ({len(source)} chars)")
+        old = bench("stdlib tokenize", lambda: list(stdlib_tokenize(source)))
+        new = bench("scan", lambda: list(scan(source)))
+        print(f"  {'speedup':<28} {old / new:9.1f}x")
+        # end to end: plain strings have to be re-classified before enrich can use them
+        old = bench("enrich(stdlib tokenize)", lambda: list(enrich(stdlib_tokenize(source))))
+        new = bench("enrich(scan)", lambda: list(enrich(scan(source))))
+        print(f"  {'speedup':<28} {old / new:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
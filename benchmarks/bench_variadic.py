@@ -0,0 +1,51 @@
+"""
+# bench_variadic.py
+#
+# Aggregates over many operands: one variadic call, max(x0, ..., x499), vs the nested
+# binary calls it used to take, max(max(max(x0, x1), x2), ...).
+#
+#    python benchmarks/bench_variadic.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from compiler import compile_uncached  # noqa: E402
+
+
+def bench(label, fn, number=20):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"  {label:<32} {seconds * 1e6:10.1f} µs")
+    return seconds
+
+
+def variadic(name, count):
+    return f"{name}({', '.join(f'x{i}' for i in range(count))})"
+
+
+def nested(name, count):
+    source = "x0"
+    for i in range(1, count):
+        source = f"{name}({source}, x{i})"
+    return source
+
+
+def main(count=500):
+    variables = {f"x{i}": (i * 7919) % 1009 / 10 for i in range(count)}
+    for name in ("max", "hypot"):
+        print(f"{name} of {count} operands:")
+        for shape, source in (
+            ("variadic", variadic(name, count)),
+            ("nested", nested(name, count)),
+        ):
+            bench(f"{shape} compile", lambda: compile_uncached(source))
+            for backend in ("stack", "python", "program"):
+                expression = compile_uncached(source, backend=backend)
+                bench(f"{shape} evaluate ({backend})", lambda: expression(variables))
+
+
+if __name__ == "__main__":
+    main()
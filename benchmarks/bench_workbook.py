@@ -0,0 +1,51 @@
+"""
+# bench_workbook.py
+#
+# Updating one input of a Workbook should cost time proportional to the number of
+# cells downstream of it, not to the size of the whole workbook.
+#
+#    python benchmarks/bench_workbook.py
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workbook import Workbook  # noqa: E402
+
+
+def build(groups: int, cells_per_group: int) -> Workbook:
+    """`groups` independent chains, each hanging off of its own input"""
+    book = Workbook()
+    for group in range(groups):
+        book.set_input(f"in{group}", group)
+        previous = f"in{group}"
+        for cell in range(cells_per_group):
+            name = f"g{group}c{cell}"
+            book.define(name, f"{previous} * 1.01 + {cell}")
+            previous = name
+    return book
+
+
+def time_update(book: Workbook, name: str, repeat=20) -> tuple[float, int]:
+    start = time.perf_counter()
+    for value in range(repeat):
+        recomputed = book.set_input(name, value)
+    return (time.perf_counter() - start) / repeat, len(recomputed)
+
+
+def main():
+    print(f"{'cells':>8} {'affected':>9} {'update':>10} {'per cell':>10}")
+    for groups, cells_per_group in [(10, 100), (100, 100), (1000, 100), (100, 10), (100, 1000)]:
+        book = build(groups, cells_per_group)
+        seconds, affected = time_update(book, "in0")
+        total = len(book.formulas)
+        print(
+            f"{total:>8} {affected:>9} {seconds * 1000:>8.3f}ms {seconds / affected * 1e6:>8.2f}µs"
+        )
+
+
+if __name__ == "__main__":
+    main()
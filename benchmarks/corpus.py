@@ -0,0 +1,153 @@
+"""
+# corpus.py
+#
+# Seeded generator of random (but always well-formed) expressions, for benchmarking.
+# A Profile controls the shape: how many terms, how deeply parenthesised, which operators,
+# how often operands are function calls, and how long unary minus chains get.
+#
+#    In [1]: generate_corpus(PROFILES["short"], count=2, seed=1)
+#    Out[1]: ['(5 / -4 % 1) / -10.25 * (7 - 9 + sqrt(abs(9 + 5))) * 4', '9 / 7 + ---6 - 7']
+#
+# The same (profile, count, seed) always gives the same corpus.
+#
+# rewrite() writes an expression a different way, like different producers of the same
+# formula would: operands of + and * swapped, parens added, × and ÷ for * and /.
+#
+#    In [2]: rewrite("2 * x + 1 / y", random.Random(1))
+#    Out[2]: '(1 / y) + (x * 2)'
+"""
+
+import operator
+import random
+from dataclasses import dataclass, field
+
+from entities import Callable, Operator, render, unwrap
+from shunting_yard import get_rpn_tokens
+from tokenizer import enrich, scan
+
+
+UNARY_FUNCTIONS = ("abs", "sqrt", "sin", "cos")
+BINARY_FUNCTIONS = ("atan2", "hypot")
+
+DEFAULT_OPERATORS = {"+": 4, "-": 4, "*": 3, "/": 2, "%": 1, "^": 1}
+
+
+@dataclass(frozen=True)
+class Profile:
+    terms: int = 8  # operands at the top level
+    max_depth: int = 2  # how deeply parenthesised subexpressions can nest
+    nesting: float = 0.2  # chance an operand is a parenthesised subexpression
+    nested_terms: int = 3  # operands per parenthesised subexpression
+    operators: dict[str, int] = field(default_factory=lambda: dict(DEFAULT_OPERATORS))
+    functions: float = 0.1  # chance an operand is a function call
+    unary_minus: float = 0.1  # chance an operand is negated
+    max_minus_chain: int = 3  # how many minuses a negated operand gets, at most
+    variables: tuple[str, ...] = ()  # names to use as operands, as well as literals
+
+
+PROFILES = {
+    "short": Profile(terms=4, max_depth=1),
+    "long": Profile(terms=400, max_depth=1, nesting=0.05),
+    # on average one nested operand per level, so these get deep without getting huge
+    "deep": Profile(terms=2, max_depth=40, nesting=0.5, nested_terms=2),
+    "arithmetic": Profile(terms=16, operators={"+": 1, "-": 1, "*": 1, "/": 1}, functions=0),
+    "functions": Profile(terms=12, functions=0.6, variables=("x", "y")),
+    "unary chains": Profile(terms=12, unary_minus=0.6, max_minus_chain=8),
+}
+
+# bindings for the variables in generated expressions
+VARIABLES = {"x": 1.5, "y": 4}
+
+
+def generate_expression(rng: random.Random, profile: Profile, depth: int = 0) -> str:
+    operators = list(profile.operators)
+    weights = list(profile.operators.values())
+
+    terms = profile.nested_terms if depth else profile.terms
+    parts = [_operand(rng, profile, depth)]
+    for _ in range(terms - 1):
+        operator = rng.choices(operators, weights)[0]
+        if operator == "^" and parts[-2:-1] == ["^"]:
+            # ^ is right associative, so 3 ^ 3 ^ 3 ^ 3 would be a bignum
+            operator = "*"
+        parts.append(operator)
+        if operator == "^":
+            # keep powers small too
+            parts.append(str(rng.randint(0, 3)))
+        else:
+            parts.append(_operand(rng, profile, depth))
+    return " ".join(parts)
+
+
+def _operand(rng: random.Random, profile: Profile, depth: int) -> str:
+    roll = rng.random()
+    if roll < profile.nesting and depth < profile.max_depth:
+        operand = f"({generate_expression(rng, profile, depth + 1)})"
+    elif profile.nesting <= roll < profile.nesting + profile.functions:
+        operand = _call(rng, profile, depth)
+    elif profile.variables and rng.random() < 0.5:
+        operand = rng.choice(profile.variables)
+    elif rng.random() < 0.25:
+        operand = str(rng.randint(1, 99) / 4)
+    else:
+        operand = str(rng.randint(1, 9))
+
+    if rng.random() < profile.unary_minus:
+        operand = "-" * rng.randint(1, profile.max_minus_chain) + operand
+    return operand
+
+
+def _call(rng: random.Random, profile: Profile, depth: int) -> str:
+    # function arguments are short, so that a high function density doesn't blow up the size
+    inner = Profile(terms=2, max_depth=0, nesting=0, functions=0, variables=profile.variables)
+    if rng.random() < 0.5:
+        name = rng.choice(UNARY_FUNCTIONS)
+        argument = generate_expression(rng, inner)
+        if name == "sqrt":
+            argument = f"abs({argument})"
+        return f"{name}({argument})"
+    name = rng.choice(BINARY_FUNCTIONS)
+    first = generate_expression(rng, inner)
+    second = generate_expression(rng, inner)
+    return f"{name}({first}, {second})"
+
+
+def generate_corpus(profile: Profile, count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [generate_expression(rng, profile) for _ in range(count)]
+
+
+# =========================
+# Rewriting
+# =========================
+
+ALIASES = {"*": "×", "/": "÷"}
+COMMUTATIVE = (operator.add, operator.mul)
+
+
+def rewrite(source: str, rng: random.Random) -> str:
+    """The same formula, written another way (and fully parenthesised)"""
+    stack = []
+    for token in get_rpn_tokens(enrich(scan(source))):
+        if not isinstance(token, Callable):
+            stack.append(repr(token) if type(token) is float else render(token))
+            continue
+        args = stack[len(stack) - token.arity :]
+        del stack[len(stack) - token.arity :]
+        name = render(token)
+        if type(token) is Operator and token.arity == 1:
+            # parenthesised, or -x ^ 2 would be -(x ^ 2)
+            written = f"(-{args[0]})" if rng.random() < 0.5 else f"(-({args[0]}))"
+        elif type(token) is Operator:
+            if unwrap(token.function) in COMMUTATIVE and rng.random() < 0.5:
+                args.reverse()
+            if name in ALIASES and rng.random() < 0.5:
+                name = ALIASES[name]
+            written = f"({args[0]} {name} {args[1]})"
+        else:
+            written = f"{name}({', '.join(args)})"
+        stack.append(written)
+    (written,) = stack
+    if written.startswith("(") and rng.random() < 0.5:
+        written = written[1:-1]
+    return written
@@ -0,0 +1,238 @@
+"""
+# suite.py
+#
+# Time each stage of the pipeline (scan, enrich, get_rpn_tokens, eval_rpn), and all of them
+# end to end, over generated corpora (see corpus.py). Results can be saved as JSON,
+# and compared against an earlier run: any timing that got slower by more than its
+# threshold counts as a regression, and makes the exit status 1.
+#
+#    python -m benchmarks.suite --output baseline.json
+#    ... make changes ...
+#    python -m benchmarks.suite --baseline baseline.json --threshold 0.1 \
+#        --threshold-for 'deep/*=0.25'
+"""
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from pathlib import Path
+
+from benchmarks.corpus import PROFILES, VARIABLES, generate_corpus
+from shunting_yard import get_rpn_tokens, eval_rpn
+from tokenizer import scan, enrich
+
+
+FORMAT_VERSION = 1
+DEFAULT_THRESHOLD = 0.10  # 10% slower than the baseline is a regression
+
+# what a generated expression can legitimately fail with, e.g. 1 / (2 - 2)
+EVALUATION_ERRORS = (ArithmeticError, ValueError)
+
+
+def _evaluate_all(rpns: list) -> int:
+    errors = 0
+    for rpn in rpns:
+        try:
+            eval_rpn(rpn, VARIABLES)
+        except EVALUATION_ERRORS:
+            errors += 1
+    return errors
+
+
+def _end_to_end(sources: list[str]) -> int:
+    errors = 0
+    for source in sources:
+        try:
+            eval_rpn(get_rpn_tokens(enrich(scan(source))), VARIABLES)
+        except EVALUATION_ERRORS:
+            errors += 1
+    return errors
+
+
+def bench_profile(name: str, count: int, seed: int, repeat: int) -> dict[str, dict]:
+    """Time every stage over one corpus. Each stage gets its input prepared up front."""
+    sources = generate_corpus(PROFILES[name], count, seed)
+    scanned = [list(scan(source)) for source in sources]
+    enriched = [list(enrich(tokens)) for tokens in scanned]
+    rpns = [list(get_rpn_tokens(tokens)) for tokens in enriched]
+
+    stages = {
+        "scan": lambda: [list(scan(source)) for source in sources],
+        "enrich": lambda: [list(enrich(tokens)) for tokens in scanned],
+        "get_rpn_tokens": lambda: [list(get_rpn_tokens(tokens)) for tokens in enriched],
+        "eval_rpn": lambda: _evaluate_all(rpns),
+        "end_to_end": lambda: _end_to_end(sources),
+    }
+    tokens = sum(len(tokens) for tokens in scanned)
+    results = {}
+    for stage, run in stages.items():
+        seconds = min(timeit.repeat(run, number=1, repeat=repeat))
+        results[f"{name}/{stage}"] = {
+            "seconds": seconds,
+            "expressions": count,
+            "tokens": tokens,
+            "ns_per_token": seconds / tokens * 1e9,
+        }
+    results[f"{name}/eval_rpn"]["errors"] = _evaluate_all(rpns)
+    return results
+
+
+def run_suite(profiles: list[str], count: int = 1000, seed: int = 0, repeat: int = 5) -> dict:
+    results = {}
+    for name in profiles:
+        results.update(bench_profile(name, count, seed, repeat))
+    return {
+        "version": FORMAT_VERSION,
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+        },
+        "config": {"profiles": profiles, "count": count, "seed": seed, "repeat": repeat},
+        "results": results,
+    }
+
+
+# =========================
+# Comparing against a baseline
+# =========================
+
+
+@dataclass
+class Comparison:
+    name: str
+    baseline: float  # seconds
+    current: float
+    threshold: float  # largest allowed slowdown, as a fraction
+
+    @property
+    def change(self) -> float:
+        """Relative change in time: 0.25 is 25% slower, -0.5 twice as fast"""
+        return self.current / self.baseline - 1
+
+    @property
+    def regressed(self) -> bool:
+        return self.change > self.threshold
+
+
+def threshold_for(
+    name: str, default: float, overrides: list[tuple[str, float]] | None = None
+) -> float:
+    """The threshold for one result; the last override whose pattern matches wins"""
+    threshold = default
+    for pattern, value in overrides or ():
+        if fnmatch(name, pattern):
+            threshold = value
+    return threshold
+
+
+def compare(
+    current: dict,
+    baseline: dict,
+    threshold: float = DEFAULT_THRESHOLD,
+    overrides: list[tuple[str, float]] | None = None,
+) -> list[Comparison]:
+    """Compare the results both runs have in common"""
+    if baseline.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported baseline format: {baseline.get('version')!r}")
+    comparisons = []
+    for name, result in current["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        comparisons.append(
+            Comparison(
+                name,
+                previous["seconds"],
+                result["seconds"],
+                threshold_for(name, threshold, overrides),
+            )
+        )
+    return comparisons
+
+
+# =========================
+# Command line
+# =========================
+
+
+def parse_threshold(definition: str) -> tuple[str, float]:
+    """PATTERN=FRACTION -> (pattern, fraction)"""
+    pattern, separator, value = definition.rpartition("=")
+    if not separator or not pattern:
+        raise argparse.ArgumentTypeError(f"expected PATTERN=FRACTION, got {definition!r}")
+    try:
+        return pattern, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number: {value!r}") from None
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=list(PROFILES),
+        help="corpus profile to run; may be repeated (default: all of them)",
+    )
+    parser.add_argument("--count", type=int, default=1000, help="expressions per corpus")
+    parser.add_argument("--seed", type=int, default=0, help="corpus generator seed")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs; the fastest counts")
+    parser.add_argument("--output", type=Path, help="write the results here, as JSON")
+    parser.add_argument("--baseline", type=Path, help="compare against results from this file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="largest allowed slowdown against the baseline, as a fraction (default: 0.1)",
+    )
+    parser.add_argument(
+        "--threshold-for",
+        action="append",
+        default=[],
+        type=parse_threshold,
+        metavar="PATTERN=FRACTION",
+        help="threshold for the results matching a glob, e.g. 'deep/*=0.25'; may be repeated",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    report = run_suite(args.profile or list(PROFILES), args.count, args.seed, args.repeat)
+
+    for name, result in report["results"].items():
+        milliseconds = result["seconds"] * 1000
+        print(f"  {name:<28} {milliseconds:9.2f} ms {result['ns_per_token']:8.1f} ns/token")
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+
+    if not args.baseline:
+        return 0
+    baseline = json.loads(args.baseline.read_text())
+    for key in ("count", "seed"):
+        # with a different corpus, the timings aren't comparable
+        if baseline["config"][key] != report["config"][key]:
+            print(f"warning: baseline {key} differs: {baseline['config'][key]}", file=sys.stderr)
+
+    regressions = 0
+    print(f"\nagainst {args.baseline}:")
+    for comparison in compare(report, baseline, args.threshold, args.threshold_for):
+        flag = ""
+        if comparison.regressed:
+            regressions += 1
+            flag = f"  REGRESSION (> {comparison.threshold:+.0%})"
+        print(f"  {comparison.name:<28} {comparison.change:+8.1%}{flag}")
+    if regressions:
+        print(f"{regressions} regression(s)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""
+# budget.py
+#
+# Keep pathological expressions from pinning a core. `^` is exact integer pow and
+# factorial is math.factorial, so "9 ^ 9 ^ 9" or "factorial(10 ^ 6)" can run for minutes,
+# and build numbers hundreds of megabytes long.
+#
+# Before evaluation, estimate_cost bounds the size of every intermediate result,
+# by propagating log2 magnitudes through the RPN:
+#
+#    In [1]: rpn = get_rpn_tokens(enrich(scan("9 ^ 9 ^ 9")))
+#    In [2]: estimate_cost(rpn)
+#    Out[2]: Cost(operations=2, max_bits=1228093895)
+#    In [3]: Budget(max_bits=1 << 16).check(estimate_cost(rpn))
+#    BudgetExceeded: integers of ~1228093895 bits, over the budget of 65536
+#
+# During evaluation, eval_rpn(rpn, variables, budget) counts operations, watches the
+# clock, and checks each integer operation's result size *before* doing the work:
+#
+#    In [4]: eval_rpn(rpn, budget=Budget(max_bits=1 << 16))
+#    BudgetExceeded: ^ would give a ~1228093895-bit integer, over the budget of 65536
+#    In [5]: eval_rpn(rpn, budget=Budget(max_bits=1 << 16, downgrade=True))
+#    OverflowError: (34, 'Numerical result out of range')  # quickly, computed as floats
+#
+# With downgrade=True, an integer operation that would go over max_bits is computed in
+# floating point instead, which is quick: it gives an approximate result, or OverflowError.
+# Wall time is checked between operations, so it can't interrupt one slow operation;
+# max_bits is what keeps each operation cheap.
+"""
+
+import math
+import operator
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Iterable, Mapping
+
+from entities import (
+    Callable,
+    Entity,
+    Load,
+    Store,
+    Variable,
+    _max,
+    _min,
+    _neg,
+    _prod,
+    div,
+    render,
+    unwrap,
+)
+
+
+# log2 of the largest float: anything bigger is inf, or OverflowError
+FLOAT_MAX_LOG2 = 1024.0
+# what estimate_cost assumes about variables it isn't given values for
+UNKNOWN_BITS = 64
+
+
+class BudgetExceeded(ValueError):
+    """
+    Evaluating an expression would go over a Budget.
+    `limit` is which one: "operations", "bits" or "seconds".
+    """
+
+    def __init__(self, message: str, limit: str, value: float, maximum: float):
+        super().__init__(message)
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
+
+    def __reduce__(self):
+        # so that it survives being sent back from a worker process
+        return type(self), (self.args[0], self.limit, self.value, self.maximum)
+
+
+@dataclass(frozen=True)
+class Budget:
+    """Limits on one evaluation; None is no limit"""
+
+    max_operations: int | None = None
+    max_bits: int | None = None  # the largest integer any operation may produce
+    max_seconds: float | None = None
+    downgrade: bool = False  # compute over-budget integer operations as floats, don't raise
+
+    def meter(self) -> "Meter":
+        return Meter(self)
+
+    def check(self, cost: "Cost"):
+        """Raise BudgetExceeded if an estimated Cost (see estimate_cost) is over budget"""
+        if self.max_operations is not None and cost.operations > self.max_operations:
+            raise BudgetExceeded(
+                f"{cost.operations} operations, over the budget of {self.max_operations}",
+                "operations",
+                cost.operations,
+                self.max_operations,
+            )
+        if self.max_bits is not None and cost.max_bits > self.max_bits:
+            raise BudgetExceeded(
+                f"integers of ~{cost.max_bits:.0f} bits, over the budget of {self.max_bits}",
+                "bits",
+                cost.max_bits,
+                self.max_bits,
+            )
+
+
+# for servers and other places evaluating untrusted expressions
+DEFAULT_BUDGET = Budget(max_operations=1_000_000, max_bits=1 << 16, max_seconds=1.0)
+
+
+# =========================
+# Cost rules
+#
+# Each takes upper bounds on log2 |argument|, and returns one on log2 |result|.
+# Magnitudes are never below 0: values smaller than 1 count as 1.
+# =========================
+
+
+def _exp2(magnitude: float) -> float:
+    return 2.0**magnitude if magnitude < FLOAT_MAX_LOG2 else math.inf
+
+
+def _sum_bound(a: float, b: float) -> float:
+    # log2(2^a + 2^b), without overflowing
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + _exp2(low - high))
+
+
+def _pow_bound(base: float, exponent: float) -> float:
+    if base == 0:
+        # |base| <= 1
+        return 0.0
+    return base * _exp2(exponent)
+
+
+def _factorial_bound(n: float) -> float:
+    # n! <= n ^ n
+    return _exp2(n) * n
+
+
+def _comb_bound(n: float, k: float) -> float:
+    # comb(n, k) <= 2 ^ n
+    return _exp2(n)
+
+
+def _perm_bound(n: float, k: float | None = None) -> float:
+    # perm(n, k) <= n ^ k, and perm(n) is perm(n, n)
+    return _pow_bound(n, n if k is None else k)
+
+
+def _prod_bound(*magnitudes: float) -> float:
+    return math.fsum(magnitudes)
+
+
+def _max_bound(*magnitudes: float) -> float:
+    return max(magnitudes)
+
+
+# unwrapped function -> (bound, whether integer arguments give an integer result)
+cost_rules = {
+    operator.add: (_sum_bound, True),
+    operator.sub: (_sum_bound, True),
+    operator.mul: (operator.add, True),
+    operator.pow: (_pow_bound, True),
+    # |a % b| < |b|
+    operator.mod: (lambda a, b: b, True),
+    div: (lambda a, b: FLOAT_MAX_LOG2, False),
+    _neg: (lambda a: a, True),
+    operator.abs: (lambda a: a, True),
+    math.factorial: (_factorial_bound, True),
+    math.comb: (_comb_bound, True),
+    math.perm: (_perm_bound, True),
+    _prod: (_prod_bound, True),
+    _max: (_max_bound, True),
+    _min: (_max_bound, True),
+}
+
+# for downgrade: how to compute an integer-only function in floating point
+float_fallbacks = {
+    math.factorial: lambda n: math.gamma(n + 1),
+    math.comb: lambda n, k: math.exp(
+        math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+    ),
+    math.perm: lambda n, k=None: math.exp(
+        math.lgamma(n + 1) - math.lgamma(n - (n if k is None else k) + 1)
+    ),
+}
+
+
+def magnitude(value: int | float) -> float:
+    """log2 |value|, or 0 when |value| < 1"""
+    value = abs(value)
+    if value <= 1:
+        return 0.0
+    if value == math.inf or value != value:
+        return FLOAT_MAX_LOG2
+    return math.log2(value)
+
+
+def bits(magnitude: float) -> float:
+    """Bit length of an integer with this log2 magnitude (rounding up, past float error)"""
+    if magnitude == math.inf:
+        return math.inf
+    return math.floor(magnitude * (1 + 1e-12) + 1e-9) + 1
+
+
+# =========================
+# Static estimate
+# =========================
+
+
+@dataclass
+class Cost:
+    operations: int  # operators and functions evaluated
+    max_bits: float  # bit length of the largest integer, at most (inf: unbounded)
+
+
+def estimate_cost(
+    rpn_tokens: Iterable[Entity], variables: Mapping[str, int | float] | None = None
+) -> Cost:
+    """
+    Bound the cost of evaluating RPN, without evaluating it.
+    Variables missing from `variables` are assumed to be integers of up to UNKNOWN_BITS bits.
+    Functions without a cost rule are assumed to give floats no bigger than their arguments.
+    Signs aren't tracked, so 2 ^ -n is bounded like 2 ^ n.
+    """
+    operations = 0
+    max_magnitude = 0.0
+    stack: list[tuple[float, bool]] = []  # (log2 magnitude bound, may be an integer)
+    temps = {}
+    for token in rpn_tokens:
+        if isinstance(token, Callable):
+            arity = token.arity
+            if len(stack) < arity:
+                raise ValueError(f"Not enough operands for {render(token)}")
+            args = stack[len(stack) - arity :]
+            del stack[len(stack) - arity :]
+            operations += 1
+            rule, keeps_integers = cost_rules.get(unwrap(token.function), (None, False))
+            exact = keeps_integers and all(is_integer for _, is_integer in args)
+            if rule is None:
+                result = max((bound for bound, _ in args), default=0.0)
+            else:
+                result = rule(*(bound for bound, _ in args))
+            if not exact:
+                result = min(result, FLOAT_MAX_LOG2)
+        elif type(token) is int or type(token) is float:
+            result, exact = magnitude(token), type(token) is int
+        elif type(token) is Variable:
+            if variables is not None and token.name in variables:
+                value = variables[token.name]
+                result, exact = magnitude(value), type(value) is int
+            else:
+                result, exact = float(UNKNOWN_BITS), True
+        elif type(token) is Store:
+            temps[token.slot] = stack[-1]
+            continue
+        elif type(token) is Load:
+            stack.append(temps[token.slot])
+            continue
+        else:
+            raise ValueError(f"Unexpected token in RPN: {token!r}")
+        if exact:
+            max_magnitude = max(max_magnitude, result)
+        stack.append((result, exact))
+    return Cost(operations, bits(max_magnitude))
+
+
+# =========================
+# Runtime enforcement
+# =========================
+
+
+class Meter:
+    """Applies operations for eval_rpn, within a Budget"""
+
+    __slots__ = ("budget", "operations", "deadline")
+
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.operations = 0
+        self.deadline = None
+        if budget.max_seconds is not None:
+            self.deadline = perf_counter() + budget.max_seconds
+
+    def call(self, token: Callable, args: list) -> int | float:
+        budget = self.budget
+        self.operations += 1
+        if budget.max_operations is not None and self.operations > budget.max_operations:
+            raise BudgetExceeded(
+                f"more than {budget.max_operations} operations",
+                "operations",
+                self.operations,
+                budget.max_operations,
+            )
+        if self.deadline is not None and perf_counter() > self.deadline:
+            raise BudgetExceeded(
+                f"took more than {budget.max_seconds}s",
+                "seconds",
+                budget.max_seconds + perf_counter() - self.deadline,
+                budget.max_seconds,
+            )
+
+        function = unwrap(token.function)
+        if budget.max_bits is None or not all(type(arg) is int for arg in args):
+            return token.function(*args)
+        rule, _ = cost_rules.get(function, (None, False))
+        # x ^ -n is a float, so it can't get big
+        if rule is not None and not (function is operator.pow and args[1] < 0):
+            estimate = bits(rule(*map(magnitude, args)))
+            if estimate > budget.max_bits:
+                if budget.downgrade:
+                    return float_fallbacks.get(function, function)(*map(float, args))
+                raise BudgetExceeded(
+                    f"{render(token)} would give a ~{estimate:.0f}-bit integer, "
+                    f"over the budget of {budget.max_bits}",
+                    "bits",
+                    estimate,
+                    budget.max_bits,
+                )
+        result = token.function(*args)
+        # for functions without a rule: too late to save the time, but not the memory
+        if type(result) is int and result.bit_length() > budget.max_bits:
+            if budget.downgrade:
+                return float(result)
+            raise BudgetExceeded(
+                f"{render(token)} gave a {result.bit_length()}-bit integer, "
+                f"over the budget of {budget.max_bits}",
+                "bits",
+                result.bit_length(),
+                budget.max_bits,
+            )
+        return result
@@ -0,0 +1,366 @@
+"""
+# cli.py
+#
+# Evaluate newline-delimited expressions from stdin or files, writing one result per line
+# as we go. Input is read a line at a time, so it can be arbitrarily large (or endless).
+#
+#    $ printf '3 + 4\n2 ^ 10\n' | shunting-yard eval
+#    7
+#    1024
+#    $ echo '2 * (3 + 4)' | shunting-yard eval --rpn
+#    2 3 4 + *
+#    $ shunting-yard eval --json --on-error null --workers 8 formulas.txt
+#    {"line": 1, "expression": "3 + 4", "result": 7}
+#    {"line": 2, "expression": "3 +", "result": null, "error": "Not enough operands for +"}
+#    $ shunting-yard csv orders.csv --formula 'total=price * qty' > totals.csv
+#    $ shunting-yard serve --port 7000  # see server.py
+#    $ shunting-yard load --port 7000 --requests 100000 formulas.txt
+#
+# (Without installing the package: python cli.py eval ...)
+"""
+
+import argparse
+import asyncio
+import fileinput
+import json
+import math
+import sys
+from typing import Iterable, Iterator, TextIO
+
+import compiler
+import csv_columns
+import server
+from budget import DEFAULT_BUDGET, Budget
+from batch import BatchResult, evaluate_many
+
+
+ERROR_POLICIES = ("skip", "fail", "null")
+DEFAULT_PORT = 7000
+
+
+class ExpressionError(Exception):
+    """An input line failed, and the error policy is "fail" """
+
+
+def parse_variable(definition: str) -> tuple[str, int | float]:
+    """NAME=VALUE -> (name, number)"""
+    name, separator, value = definition.partition("=")
+    if not separator or not name.strip():
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {definition!r}")
+    for convert in (int, float):
+        try:
+            return name.strip(), convert(value)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"not a number: {value!r}")
+
+
+def parse_formula(definition: str) -> tuple[str, str]:
+    """NAME=EXPRESSION -> (name, expression)"""
+    name, separator, source = definition.partition("=")
+    if not separator or not name.strip() or not source.strip():
+        raise argparse.ArgumentTypeError(f"expected NAME=EXPRESSION, got {definition!r}")
+    return name.strip(), source
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="shunting-yard")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    evaluate = subcommands.add_parser(
+        "eval", help="evaluate one expression per line, from files or stdin"
+    )
+    evaluate.add_argument("files", nargs="*", help="input files (default, or '-': stdin)")
+    mode = evaluate.add_mutually_exclusive_group()
+    mode.add_argument("--rpn", action="store_true", help="print RPN instead of evaluating")
+    evaluate.add_argument("--json", action="store_true", help="write JSON lines")
+    evaluate.add_argument(
+        "--on-error",
+        choices=ERROR_POLICIES,
+        default="fail",
+        help="what to do with a line that fails: skip it, stop (the default), or emit null",
+    )
+    mode.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="evaluate across this many worker processes (default: 0, in this process)",
+    )
+    evaluate.add_argument("--chunksize", type=int, default=256, help="lines per worker task")
+    evaluate.add_argument(
+        "--var",
+        action="append",
+        default=[],
+        type=parse_variable,
+        metavar="NAME=VALUE",
+        help="bind a variable for every expression; may be repeated",
+    )
+
+    columns = subcommands.add_parser(
+        "csv", help="evaluate formulas for every row of a CSV file (see csv_columns.py)"
+    )
+    columns.add_argument(
+        "file", help="a CSV file with a header line; formulas' variables are its columns"
+    )
+    columns.add_argument(
+        "--formula",
+        action="append",
+        required=True,
+        type=parse_formula,
+        metavar="NAME=EXPRESSION",
+        help="a column of output; may be repeated",
+    )
+    columns.add_argument(
+        "--var",
+        action="append",
+        default=[],
+        type=parse_variable,
+        metavar="NAME=VALUE",
+        help="bind a variable that isn't a column; may be repeated",
+    )
+    columns.add_argument(
+        "--chunk-bytes",
+        type=int,
+        default=csv_columns.DEFAULT_CHUNK_BYTES,
+        help="how much of the file to read and evaluate at a time",
+    )
+    columns.add_argument("--delimiter", default=",")
+
+    serve = subcommands.add_parser("serve", help="run an evaluation server (see server.py)")
+    add_address_arguments(serve)
+    serve.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="evaluate on this many worker processes (default: 0, in the server process)",
+    )
+    serve.add_argument("--max-batch", type=int, default=server.DEFAULT_MAX_BATCH)
+    serve.add_argument(
+        "--queue-size",
+        type=int,
+        default=server.DEFAULT_QUEUE_SIZE,
+        help="requests waiting for evaluation before connections stop being read",
+    )
+    serve.add_argument("--cache-size", type=int, default=compiler.DEFAULT_CACHE_SIZE)
+    limits = serve.add_argument_group(
+        "budget", "limits on each evaluation (see budget.py); 0 is none"
+    )
+    limits.add_argument("--max-operations", type=int, default=DEFAULT_BUDGET.max_operations)
+    limits.add_argument(
+        "--max-bits",
+        type=int,
+        default=DEFAULT_BUDGET.max_bits,
+        help="largest integer any operation may produce, in bits",
+    )
+    limits.add_argument("--max-seconds", type=float, default=DEFAULT_BUDGET.max_seconds)
+    limits.add_argument(
+        "--downgrade",
+        action="store_true",
+        help="compute integers over --max-bits as floats, rather than failing the request",
+    )
+
+    load = subcommands.add_parser(
+        "load", help="send expressions from files or stdin to a server, and report latency"
+    )
+    load.add_argument("files", nargs="*", help="input files (default, or '-': stdin)")
+    add_address_arguments(load)
+    load.add_argument("--connections", type=int, default=8)
+    load.add_argument("--depth", type=int, default=64, help="requests in flight per connection")
+    load.add_argument(
+        "--requests",
+        type=int,
+        help="how many to send, cycling through the input (default: one pass)",
+    )
+    return parser.parse_args(argv)
+
+
+def add_address_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--host", default="127.0.0.1")
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument("--port", type=int, default=DEFAULT_PORT)
+    address.add_argument("--unix", metavar="PATH", help="use a Unix socket instead of TCP")
+
+
+def render_rpn(sources: Iterable[str]) -> Iterator[BatchResult]:
+    """Like batch.evaluate_many, but the "value" is the rendered RPN"""
+    for index, source in enumerate(sources):
+        try:
+            rendered = compiler.compile(source).render()
+        except Exception as e:
+            yield BatchResult(index, source, None, e)
+        else:
+            yield BatchResult(index, source, rendered, None)
+
+
+def format_result(result: BatchResult, as_json: bool, key: str) -> str:
+    """
+    One line of output. Raises ValueError for a value that can't be written, e.g. an int
+    with more digits than str() will print (see sys.get_int_max_str_digits).
+    """
+    if as_json:
+        value = result.value
+        if type(value) is complex or (type(value) is float and not math.isfinite(value)):
+            # JSON has no inf, nan or complex numbers: write them as strings
+            value = str(value)
+        record = {"line": result.index + 1, "expression": result.source, key: value}
+        if result.error is not None:
+            record["error"] = str(result.error)
+        return json.dumps(record, ensure_ascii=False, allow_nan=False)
+    if result.error is not None:
+        return "null"
+    return str(result.value)
+
+
+def run_eval(args: argparse.Namespace, out: TextIO) -> int:
+    variables = dict(args.var)
+    with fileinput.FileInput(args.files, encoding="utf-8") as stream:
+        # strip newlines, but keep blank lines so that line numbers still line up
+        lines = (line.strip() for line in stream)
+        return _write_results(args, lines, variables, out)
+
+
+def _write_results(
+    args: argparse.Namespace, lines: Iterable[str], variables: dict, out: TextIO
+) -> int:
+    if args.rpn:
+        results = render_rpn(lines)
+    else:
+        # in-process, go a line at a time, so that results come out as soon as lines come in
+        chunksize = args.chunksize if args.workers else 1
+        results = evaluate_many(
+            lines, workers=args.workers, chunksize=chunksize, variables=variables
+        )
+
+    key = "rpn" if args.rpn else "result"
+    errors = 0
+    for result in results:
+        if not result.source:
+            continue
+        if result.error is None:
+            try:
+                line = format_result(result, args.json, key)
+            except ValueError as e:
+                # that's an error too, under the same policy
+                result = result._replace(value=None, error=e)
+        if result.error is not None:
+            errors += 1
+            if args.on_error == "skip":
+                continue
+            if args.on_error == "fail":
+                out.flush()
+                raise ExpressionError(
+                    f"line {result.index + 1}: {result.source!r}: {result.error}"
+                )
+            line = format_result(result, args.json, key)
+        out.write(line)
+        out.write("\n")
+
+    if errors:
+        print(f"{errors} expression(s) failed", file=sys.stderr)
+    return 0
+
+
+def run_csv(args: argparse.Namespace, out: TextIO) -> int:
+    try:
+        csv_columns.evaluate_csv(
+            args.file,
+            dict(args.formula),
+            out,
+            dict(args.var),
+            args.chunk_bytes,
+            args.delimiter,
+        )
+    except (NameError, ValueError) as e:
+        out.flush()
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def budget_from_args(args: argparse.Namespace) -> Budget:
+    return Budget(
+        args.max_operations or None,
+        args.max_bits or None,
+        args.max_seconds or None,
+        args.downgrade,
+    )
+
+
+async def serve(args: argparse.Namespace):
+    cache = compiler.CompileCache(args.cache_size)
+    evaluation_server = server.EvaluationServer(
+        cache,
+        args.workers,
+        args.max_batch,
+        args.queue_size,
+        cache_size=args.cache_size,
+        budget=budget_from_args(args),
+    )
+    async with evaluation_server:
+        if args.unix:
+            listening = await evaluation_server.start_unix(args.unix)
+        else:
+            listening = await evaluation_server.start_tcp(args.host, args.port)
+        print(f"listening on {args.unix or f'{args.host}:{args.port}'}", file=sys.stderr)
+        await listening.serve_forever()
+
+
+def run_serve(args: argparse.Namespace) -> int:
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_load(args: argparse.Namespace, out: TextIO) -> int:
+    with fileinput.FileInput(args.files, encoding="utf-8") as stream:
+        sources = [line.strip() for line in stream if line.strip()]
+
+    async def connect():
+        if args.unix:
+            return await server.Client.connect_unix(args.unix)
+        return await server.Client.connect_tcp(args.host, args.port)
+
+    async def load():
+        report = await server.generate_load(
+            connect, sources, args.requests or len(sources), args.connections, args.depth
+        )
+        client = await connect()
+        report["server"] = await client.stats()
+        await client.close()
+        return report
+
+    out.write(json.dumps(asyncio.run(load()), indent=2) + "\n")
+    return 0
+
+
+def main(argv: list[str] | None = None, out: TextIO | None = None) -> int:
+    args = parse_args(argv)
+    if out is None:
+        out = sys.stdout
+        # block-buffer results even on a terminal; they're flushed on exit, or before an error
+        out.reconfigure(line_buffering=False)
+    try:
+        if args.command == "serve":
+            return run_serve(args)
+        if args.command == "load":
+            return run_load(args, out)
+        if args.command == "csv":
+            return run_csv(args, out)
+        return run_eval(args, out)
+    except ExpressionError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # e.g. piped into `head`
+        return 0
+    finally:
+        try:
+            out.flush()
+        except BrokenPipeError:
+            pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+# columnar.py
+#
+# Evaluate many expressions that have the same shape and differ only in their numbers,
+# e.g. "a * 1.07 ^ n - c" with a different rate in each. Expressions are grouped by RPN
+# skeleton (the RPN, with its literals abstracted out), each group's literals are packed
+# into NumPy columns, and the whole group is evaluated with one ufunc call per RPN step.
+#
+#    In [1]: evaluate_grouped(["x * 1.5 ^ 2", "x * 2.5 ^ 3", "sqrt(x)"], {"x": 4})
+#    Out[1]:
+#    [BatchResult(index=0, source='x * 1.5 ^ 2', value=9.0, error=None),
+#     BatchResult(index=1, source='x * 2.5 ^ 3', value=62.5, error=None),
+#     BatchResult(index=2, source='sqrt(x)', value=2.0, error=None)]
+#
+# Expressions are first grouped by their text with the numbers cut out, so each shape is
+# parsed once, rather than once per expression. A skeleton that only one expression has
+# goes through the scalar eval_rpn path, and so does any row that the vectorized pass
+# can't reproduce exactly (see evaluate_group).
+#
+# NumPy is optional: everything else in this package works without it.
+"""
+
+import math
+import operator
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Mapping
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from batch import BatchResult
+from budget import estimate_cost
+from compiler import CompiledExpression, compile_uncached
+from entities import Callable, Entity, Variable, _fsum, _max, _min, unwrap
+from shunting_yard import eval_rpn
+from tokenizer import _number_grammar
+from vectorized import get_vectorized, ufunc_mapping
+
+
+# a numeric literal, where the tokenizer would start a token: not inside a name or a number
+_literal_pattern = re.compile(r"(?<![\w.])(?:" + _number_grammar + ")", re.VERBOSE)
+
+# Integers no bigger than this are exact in int64, and convert to float64 exactly, which
+# python does for int / int, and int + float. Groups that might build bigger ones (per
+# budget.estimate_cost, over each column's largest literal) are evaluated with eval_rpn.
+EXACT_BITS = 53
+
+# ufuncs whose results aren't python's: np.floor gives floats, np.fmod keeps ints where
+# math.fmod gives floats, math.fsum rounds once, not per add, and math.pow raises where
+# np.float_power gives inf or nan
+scalar_only_functions = frozenset((math.floor, math.ceil, math.trunc, math.fmod, math.pow, _fsum))
+# python's max(2, 2.5) is 2.5 but max(3, 2.5) is 3: numpy's is a float either way
+_same_kind_functions = frozenset((max, min, _max, _min))
+
+
+@dataclass
+class Group:
+    """Expressions with the same RPN skeleton"""
+
+    rpn: tuple[Entity, ...]  # the first expression's
+    columns: tuple[tuple[int, type], ...]  # (position in rpn, int or float) of each literal
+    # (index, source, the source split by _literal_pattern): literal k is at parts[3k + 1]
+    # if it's a float, and parts[3k + 2] if it's an int
+    rows: list[tuple[int, str, list]] = field(default_factory=list)
+
+    def column_texts(self, k: int) -> Iterable[str]:
+        """Literal k of every row"""
+        part = 3 * k + (1 if self.columns[k][1] is float else 2)
+        return map(operator.itemgetter(part), map(operator.itemgetter(2), self.rows))
+
+    def rpn_for(self, parts: list) -> list[Entity]:
+        """The RPN of one row: the group's, with that row's literals in it"""
+        rpn = list(self.rpn)
+        for k, (position, kind) in enumerate(self.columns):
+            rpn[position] = kind(parts[3 * k + (1 if kind is float else 2)])
+        return rpn
+
+
+# =========================
+# Grouping
+# =========================
+
+
+def group_expressions(sources: Iterable[str]) -> tuple[list[Group], list[BatchResult]]:
+    """
+    Group expressions by RPN skeleton (in order of each group's first expression), and
+    return a BatchResult for each one that doesn't compile.
+    """
+    by_text: dict[tuple, list[tuple[int, str, list]]] = {}
+    for index, source in enumerate(sources):
+        # split() gives the text around each literal, then its float and int groups: the
+        # key is the text around them, and which ones are ints
+        parts = _literal_pattern.split(source)
+        key = (tuple(parts[::3]), tuple(map(operator.not_, parts[1::3])))
+        by_text.setdefault(key, []).append((index, source, parts))
+
+    groups: dict[tuple, Group] = {}
+    errors = []
+
+    def add(compiled: CompiledExpression, columns: tuple, rows: list):
+        skeleton = list(compiled.rpn)
+        for position, kind in columns:
+            skeleton[position] = kind
+        group = groups.get(tuple(skeleton))
+        if group is None:
+            group = groups[tuple(skeleton)] = Group(compiled.rpn, columns)
+        group.rows.extend(rows)
+
+    for rows in by_text.values():
+        index, source, _ = rows[0]
+        try:
+            compiled = compile_uncached(source)
+        except Exception as e:
+            compiled = e
+        columns = None if isinstance(compiled, Exception) else _literal_columns(compiled, source)
+        if columns is not None:
+            add(compiled, columns, rows)
+            continue
+        # compile each one on its own: for its own error, or since the literals aren't
+        # where the tokenizer found them (which the group's skeleton depends on)
+        for index, source, _ in rows:
+            try:
+                compiled = compile_uncached(source)
+            except Exception as e:
+                errors.append(BatchResult(index, source, None, e))
+            else:
+                add(compiled, (), [(index, source, [])])
+    return list(groups.values()), errors
+
+
+def _literal_columns(compiled: CompiledExpression, source: str) -> tuple | None:
+    # the position of each literal in the RPN, or None unless each one is exactly a number
+    # token, in the same order (RPN keeps the operands' order, so they always should be)
+    literals = {match.span(): k for k, match in enumerate(_literal_pattern.finditer(source))}
+    if compiled.spans is None:
+        return None
+    columns = []
+    for position, (token, span) in enumerate(zip(compiled.rpn, compiled.spans)):
+        if (type(token) is int or type(token) is float) and span in literals:
+            if literals[span] != len(columns):
+                return None
+            columns.append((position, type(token)))
+    if len(columns) != len(literals):
+        return None
+    return tuple(columns)
+
+
+# =========================
+# Evaluation
+# =========================
+
+
+def evaluate_grouped(
+    sources: Iterable[str], variables: Mapping[str, int | float] | None = None
+) -> list[BatchResult]:
+    """
+    Evaluate every expression, with the same variables; results are in the order of
+    `sources`, with errors captured per expression, as in batch.evaluate_many.
+    """
+    if np is None:
+        raise ImportError("evaluate_grouped requires numpy")
+    groups, results = group_expressions(sources)
+    for group in groups:
+        results.extend(evaluate_group(group, variables))
+    results.sort(key=operator.itemgetter(0))
+    return results
+
+
+def evaluate_group(group: Group, variables: Mapping | None = None) -> list[BatchResult]:
+    """
+    Evaluate a group's rows in one vectorized pass, when there's more than one. Rows the
+    pass can't do exactly like eval_rpn are evaluated with eval_rpn instead:
+
+    - rows that produce an inf or nan anywhere, where python might raise instead (1 / 0)
+    - rows with an integer % 0, which numpy makes 0
+    - every row, if the group might produce integers over EXACT_BITS bits, or uses a
+      function without an exact ufunc equivalent (see scalar_only_functions), or a
+      ufunc raises (e.g. integer ^ a negative integer)
+
+    + - * / on floats are exact IEEE in both; float ^, and functions like sin and exp, agree
+    with python's to within numpy's accuracy (an ulp or so).
+    """
+    evaluated = None
+    if len(group.rows) > 1 and _vectorizable(group.rpn):
+        try:
+            evaluated = _evaluate_columns(group, variables)
+        except Exception:  # e.g. integer ^ a negative integer: leave it all to eval_rpn
+            evaluated = None
+    values, ok = evaluated or (None, None)
+
+    results = []
+    for row, (index, source, parts) in enumerate(group.rows):
+        if ok is not None and ok[row]:
+            results.append(BatchResult(index, source, values[row], None))
+            continue
+        try:
+            value = eval_rpn(group.rpn_for(parts), variables)
+        except Exception as e:
+            results.append(BatchResult(index, source, None, e))
+        else:
+            results.append(BatchResult(index, source, value, None))
+    return results
+
+
+def _vectorizable(rpn: tuple[Entity, ...]) -> bool:
+    for token in rpn:
+        if isinstance(token, Callable):
+            function = unwrap(token.function)
+            ufunc = ufunc_mapping.get(function)
+            if ufunc is None or function in scalar_only_functions:
+                return False
+            # math.hypot(a, b, c) isn't quite hypot(hypot(a, b), c), and log(x, base) has
+            # no ufunc
+            if ufunc.nin != token.arity and (ufunc.nin != 2 or function is math.hypot):
+                return False
+        elif not (type(token) is int or type(token) is float or type(token) is Variable):
+            return False
+    return True
+
+
+def _evaluate_columns(group: Group, variables: Mapping | None) -> tuple[list, list[bool]] | None:
+    count = len(group.rows)
+    columns = {}
+    envelope = list(group.rpn)  # the rpn, with each column's largest literal in it
+    for k, (position, kind) in enumerate(group.columns):
+        dtype = np.int64 if kind is int else np.float64
+        column = np.fromiter(map(kind, group.column_texts(k)), dtype=dtype, count=count)
+        columns[position] = column
+        # literals are never negative: - is an operator
+        envelope[position] = kind(column.max())
+    if estimate_cost(envelope, variables).max_bits > EXACT_BITS:
+        return None
+
+    bindings = {name: np.asarray(value) for name, value in (variables or {}).items()}
+    ok = np.ones(count, dtype=bool)
+    stack = []
+    with np.errstate(all="ignore"):
+        for position, token in enumerate(group.rpn):
+            if position in columns:
+                stack.append(columns[position])
+            elif type(token) is Variable:
+                if token.name not in bindings:
+                    raise NameError(f"Unbound variable {token.name!r}")
+                stack.append(bindings[token.name])
+            elif not isinstance(token, Callable):
+                stack.append(np.asarray(token))
+            else:
+                arity = token.arity
+                args = stack[len(stack) - arity :]
+                del stack[len(stack) - arity :]
+                function = unwrap(token.function)
+                if function in _same_kind_functions and len({a.dtype.kind for a in args}) > 1:
+                    return None
+                if function is operator.mod and args[1].dtype.kind == "i":
+                    ok &= args[1] != 0
+                result = np.asarray(get_vectorized(token)(*args))
+                if result.dtype.kind == "f":
+                    ok &= np.isfinite(result)
+                stack.append(result)
+    (result,) = stack
+    return np.broadcast_to(result, (count,)).tolist(), ok.tolist()
@@ -0,0 +1,402 @@
+"""
+# compiler.py
+#
+# Run the scan -> enrich -> get_rpn_tokens pipeline once per source string,
+# and keep the resulting RPN program around so repeated formulas skip parsing.
+#
+#    In [1]: expr = compile("3 + 4 * 2")
+#    In [2]: expr.render()
+#    Out[2]: '3 4 2 * +'
+#    In [3]: expr()
+#    Out[3]: 11
+"""
+
+from collections import OrderedDict
+from functools import partial
+from typing import Iterable, Iterator, Mapping, Sequence
+
+from budget import Budget, Cost, estimate_cost
+from codegen import compile_rpn
+from entities import Entity, Variable, render, render_tokens
+from optimizer import (
+    OptimizationStats,
+    eliminate_common_subexpressions,
+    fingerprint,
+    optimize as optimize_rpn,
+)
+from program import Program, eval_program
+from shunting_yard import get_rpn_tokens, eval_rpn, locate_rpn_tokens
+from tokenizer import Token, scan, scan_chunks, scan_document, enrich
+
+
+DEFAULT_CACHE_SIZE = 4096
+
+# "stack": run the RPN through eval_rpn
+# "python": compile the RPN to a python function once (see codegen.py), and call that
+# "program": keep only a compact array-backed Program (see program.py), and run that
+BACKENDS = ("stack", "python", "program")
+
+# set by instrumentation.enable(); while it's None, compiling costs nothing extra
+instruments = None
+
+
+class CompiledExpression:
+    """
+    A parsed expression: the source string, and the RPN program it compiled to.
+    The RPN is stored as a tuple so that it can be shared between callers.
+
+    `backend` picks how evaluate() runs the program (see BACKENDS). Expressions too deeply
+    nested for python's own compiler quietly stay on the "stack" backend.
+    With the "program" backend only the compact Program is kept, and `rpn` is rebuilt
+    from it on demand.
+
+    `spans` is the (start, end) in `source` that each RPN token came from, when the RPN is
+    straight from the parser (optimizing or CSE rewrites it, and then it's None).
+
+    `fingerprint` is the same for every way of writing the same formula (see
+    optimizer.fingerprint), e.g. to key a cache of results on.
+    """
+
+    __slots__ = (
+        "source",
+        "_rpn",
+        "program",
+        "optimization",
+        "variables",
+        "backend",
+        "_evaluate",
+        "spans",
+        "_fingerprint",
+    )
+
+    def __init__(
+        self,
+        source: str,
+        rpn: tuple[Entity, ...],
+        optimization: OptimizationStats | None = None,
+        backend: str = "stack",
+        spans: tuple[tuple[int, int], ...] | None = None,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        self.source = source
+        self._rpn = rpn
+        self.spans = spans
+        self._fingerprint = None
+        self.program = None
+        self.optimization = optimization  # None unless the optimizer ran
+        # names of the variables this expression needs bound, in order of first use
+        self.variables = tuple(
+            dict.fromkeys(token.name for token in rpn if type(token) is Variable)
+        )
+
+        self.backend = "stack"
+        self._evaluate = partial(eval_rpn, rpn)
+        if backend == "python":
+            try:
+                self._evaluate = compile_rpn(rpn).function
+                self.backend = "python"
+            except (RecursionError, MemoryError):
+                pass
+        elif backend == "program":
+            self.program = Program.from_rpn(rpn)
+            self._rpn = None
+            self._evaluate = partial(eval_program, self.program)
+            self.backend = "program"
+
+    @classmethod
+    def from_program(cls, source: str, program: Program) -> "CompiledExpression":
+        """A "program" backend expression around an existing Program, e.g. from program_cache"""
+        expression = cls.__new__(cls)
+        expression.source = source
+        expression._rpn = None
+        expression.program = program
+        expression.optimization = None
+        expression.spans = None
+        expression._fingerprint = None
+        # Program.from_rpn numbers names in order of first use, like `variables`
+        expression.variables = program.names
+        expression.backend = "program"
+        expression._evaluate = partial(eval_program, program)
+        return expression
+
+    @property
+    def rpn(self) -> tuple[Entity, ...]:
+        if self._rpn is None:
+            return tuple(self.program.to_rpn())
+        return self._rpn
+
+    @property
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            # of the parsed RPN: optimizing and CSE can make equivalent formulas look different
+            self._fingerprint = fingerprint(get_rpn_tokens(enrich(scan(self.source))))
+        return self._fingerprint
+
+    def with_backend(self, backend: str) -> "CompiledExpression":
+        """The same program, evaluated by a different backend"""
+        expression = CompiledExpression(
+            self.source, self.rpn, self.optimization, backend, self.spans
+        )
+        expression._fingerprint = self._fingerprint
+        return expression
+
+    def evaluate(
+        self, variables: Mapping[str, int | float] | None = None, budget: Budget | None = None
+    ) -> int | float:
+        """With a `budget`, this always runs on the "stack" backend, which enforces it"""
+        if budget is not None:
+            return eval_rpn(self.rpn, variables, budget)
+        return self._evaluate(variables)
+
+    __call__ = evaluate
+
+    def cost(self, variables: Mapping[str, int | float] | None = None) -> Cost:
+        """Bound the cost of evaluating this, without evaluating it; see budget.estimate_cost"""
+        return estimate_cost(self.rpn, variables)
+
+    def evaluate_vectorized(self, variables: Mapping):
+        """Evaluate against NumPy arrays of bindings; see vectorized.eval_rpn_vectorized"""
+        from vectorized import eval_rpn_vectorized
+
+        return eval_rpn_vectorized(self.rpn, variables)
+
+    def render(self) -> str:
+        return render_tokens(self.rpn)
+
+    def locate(self) -> list[tuple[str, str]]:
+        """Each RPN token rendered, next to the source text it came from"""
+        if self.spans is None:
+            raise ValueError("No spans: the RPN was rewritten after parsing")
+        return [
+            (render(token), self.source[start:end])
+            for token, (start, end) in zip(self.rpn, self.spans)
+        ]
+
+    def __repr__(self):
+        return f"CompiledExpression({self.source!r}, rpn={self.render()!r})"
+
+
+def compile_uncached(
+    source: str, optimize: bool = False, backend: str = "stack", cse: bool = False
+) -> CompiledExpression:
+    """
+    Run the whole parse pipeline, bypassing the cache.
+    With cse=True, repeated subexpressions are computed once (after optimizing, if asked to).
+    """
+    if instruments is not None:
+        return instruments.compile(source, optimize, backend, cse)
+    return _compile_tokens(source, tuple(scan(source)), 0, optimize, backend, cse)
+
+
+def _compile_tokens(
+    source: str, tokens: Sequence[Token], offset: int, optimize: bool, backend: str, cse: bool
+) -> CompiledExpression:
+    # the rest of compile_uncached, for tokens already scanned out of a string `offset`
+    # characters before `source` starts (ParseError positions stay in that string)
+    rpn, spans = _parse_tokens(tokens, offset)
+    return _build(source, rpn, spans, optimize, backend, cse)
+
+
+def _parse_tokens(
+    tokens: Sequence[Token], offset: int = 0
+) -> tuple[tuple[Entity, ...], tuple[tuple[int, int], ...]]:
+    origins = []
+    rpn = tuple(locate_rpn_tokens(enrich(tokens), tokens, origins))
+    return rpn, _spans(tokens, origins, offset)
+
+
+def _spans(
+    tokens: Sequence[Token], origins: list[int], offset: int
+) -> tuple[tuple[int, int], ...]:
+    # the (start, end) in the source of each RPN token, from locate_rpn_tokens' origins
+    return tuple(
+        (tokens[origin].start - offset, tokens[origin].end - offset) for origin in origins
+    )
+
+
+def _build(
+    source: str,
+    rpn: tuple[Entity, ...],
+    spans: tuple[tuple[int, int], ...],
+    optimize: bool,
+    backend: str,
+    cse: bool,
+) -> CompiledExpression:
+    stats = None
+    if optimize:
+        rpn, stats = optimize_rpn(rpn)
+        spans = None
+    if cse:
+        rpn, _ = eliminate_common_subexpressions(rpn)
+        spans = None
+    return CompiledExpression(source, rpn, stats, backend, spans)
+
+
+def compile_document(
+    document: str, optimize: bool = False, backend: str = "stack", cse: bool = False
+) -> Iterator[tuple[int, CompiledExpression | Exception]]:
+    """
+    Compile every expression in a document, one per line or separated by `;`, e.g. a config
+    file of formulas. The whole document is scanned in one pass, and each expression's tokens
+    go straight on to the parser. Yields (line number, CompiledExpression) for each one, or
+    (line number, the exception) for one that doesn't compile. Each CompiledExpression's
+    source is its own expression, but ParseError positions are offsets into the document.
+    Nothing is cached.
+    """
+    for line, scanned in scan_document(document):
+        if isinstance(scanned, Exception):
+            yield line, scanned
+            continue
+        start = scanned[0].start
+        source = document[start : scanned[-1].end]
+        try:
+            if instruments is not None:
+                compiled = instruments.compile(source, optimize, backend, cse, scanned, start)
+            else:
+                compiled = _compile_tokens(source, scanned, start, optimize, backend, cse)
+        except Exception as e:
+            yield line, e
+        else:
+            yield line, compiled
+
+
+# =========================
+# LRU compile cache
+# =========================
+
+
+class CompileCache:
+    """
+    Bounded LRU mapping of source string -> CompiledExpression.
+
+    OrderedDict keeps recency order for us: a hit moves the entry to the end,
+    and when we're over `maxsize` we evict from the front.
+
+    With optimize=True, every program goes through optimizer.optimize once, on the way in,
+    and with cse=True through optimizer.eliminate_common_subexpressions.
+    `backend` is the evaluation backend for every program this cache compiles.
+
+    With canonical=True, a source string that misses is still parsed, but then looked up by
+    its fingerprint (see optimizer.fingerprint), in a second LRU of up to `maxsize` programs:
+    so "x + 3" can get the CompiledExpression compiled for "3+x" (whose `source` it keeps),
+    and skip optimizing and building it again, or keeping a copy.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_CACHE_SIZE,
+        optimize: bool = False,
+        backend: str = "stack",
+        cse: bool = False,
+        canonical: bool = False,
+    ):
+        if maxsize < 0:
+            raise ValueError(f"maxsize must be >= 0, got {maxsize}")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        self.maxsize = maxsize
+        self.optimize = optimize
+        self.backend = backend
+        self.cse = cse
+        self.canonical = canonical
+        self._entries: OrderedDict[str, CompiledExpression] = OrderedDict()
+        # fingerprint -> CompiledExpression, with canonical=True
+        self._canonical: OrderedDict[str, CompiledExpression] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.canonical_hits = 0  # misses that found an equivalent program by fingerprint
+
+    def get(self, source: str) -> CompiledExpression:
+        compiled = self._entries.get(source)
+        if compiled is not None:
+            self.hits += 1
+            self._entries.move_to_end(source)
+            return compiled
+
+        self.misses += 1
+        # parse errors propagate, and are not cached
+        if self.canonical and instruments is None:
+            compiled = self._get_canonical(source)
+        else:
+            compiled = compile_uncached(source, self.optimize, self.backend, self.cse)
+        if self.maxsize:
+            self._entries[source] = compiled
+            self._evict()
+        return compiled
+
+    def _get_canonical(self, source: str) -> CompiledExpression:
+        rpn, spans = _parse_tokens(tuple(scan(source)))
+        key = fingerprint(rpn)
+        compiled = self._canonical.get(key)
+        if compiled is not None:
+            self.canonical_hits += 1
+            self._canonical.move_to_end(key)
+            return compiled
+        compiled = _build(source, rpn, spans, self.optimize, self.backend, self.cse)
+        compiled._fingerprint = key
+        if self.maxsize:
+            self._canonical[key] = compiled
+            self._evict()
+        return compiled
+
+    def resize(self, maxsize: int):
+        if maxsize < 0:
+            raise ValueError(f"maxsize must be >= 0, got {maxsize}")
+        self.maxsize = maxsize
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        while len(self._canonical) > self.maxsize:
+            self._canonical.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries and reset the counters"""
+        self._entries.clear()
+        self._canonical.clear()
+        self.hits = self.misses = self.evictions = self.canonical_hits = 0
+
+    def stats(self) -> dict[str, int]:
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+        if self.canonical:
+            stats["canonical_hits"] = self.canonical_hits
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, source: str):
+        return source in self._entries
+
+
+# module-level cache used by compile()
+cache = CompileCache()
+
+
+def compile(source: str) -> CompiledExpression:
+    """Get the compiled form of `source`, parsing it only if we haven't seen it recently"""
+    return cache.get(source)
+
+
+def evaluate_stream(
+    chunks: Iterable[str],
+    variables: Mapping[str, int | float] | None = None,
+    budget: Budget | None = None,
+) -> int | float:
+    """
+    Evaluate one expression as it's read, in pieces, e.g. a multi-megabyte generated formula:
+        evaluate_stream(iter(partial(file.read, 1 << 16), ""))
+    Nothing is compiled or cached, and no stage builds a list, so memory is proportional
+    to how deeply the expression nests, not to how long it is.
+    """
+    return eval_rpn(get_rpn_tokens(enrich(scan_chunks(chunks))), variables, budget)
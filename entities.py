@@ -4,10 +4,10 @@
 # - rendering its value (e.g. div -> "/")
 """
 
+import inspect
 import math
 import operator
 from enum import Enum
-from functools import cache
 from typing import Iterable
 
 
@@ -24,37 +24,132 @@ def _neg(a: number) -> number:
     return -1 * a
 
 
+# max(x), math.fsum and math.prod take one iterable; these take the numbers as arguments
+def _max(*args: number) -> number:
+    return max(args)
+
+
+def _min(*args: number) -> number:
+    return min(args)
+
+
+def _fsum(*args: number) -> float:
+    return math.fsum(args)
+
+
+def _prod(*args: number) -> number:
+    return math.prod(args)
+
+
+# Higher binds tighter. Operators look their precedence up here when they're created.
+precedence_table = {
+    operator.add: 1,
+    operator.sub: 1,
+    operator.mul: 2,
+    div: 2,
+    operator.mod: 2,
+    operator.pow: 4,
+}
+# prefix negation binds tighter than * but looser than ^, so -2^2 == -(2^2)
+UNARY_PRECEDENCE = 3
+
+
+# =========================
+# Kind tags
+#
+# get_rpn_tokens and eval_rpn dispatch on these, rather than a chain of type() checks:
+#   token_kinds[type(token)], and special_kinds[token] for Specials
+# =========================
+
+NUMBER = 0
+VARIABLE = 1
+OPERATOR = 2
+FUNCTION = 3
+PAREN_LEFT = 4
+PAREN_RIGHT = 5
+COMMA = 6
+MINUS = 7
+SPECIAL = 8  # look it up in special_kinds
+STORE = 9
+LOAD = 10
+PAUSE = 11
+
+
+class ParseError(ValueError):
+    """
+    Input that doesn't parse. `position` is the offset into the source where it went wrong,
+    when that's known (it isn't for hand-built token lists).
+    """
+
+    def __init__(self, message: str, position: int | None = None):
+        super().__init__(message if position is None else f"{message} at position {position}")
+        self.message = message
+        self.position = position
+
+
 class Special(Enum):
     PAREN_LEFT = "("
     PAREN_RIGHT = ")"
     COMMA = ","
     MINUS = "-"
+    # never parsed from input: get_rpn_tokens passes it straight through once it has output
+    # everything the tokens before it decided (see incremental.py)
+    PAUSE = ""
 
 
 class Callable:
     """base class for Operator and Function"""
 
+    __slots__ = (
+        "function",
+        "associativity",
+        "arity",
+        "rendered",
+        "precedence",
+        "right_associative",
+        "_hash",
+    )
+
     def __init__(
         self,
         function: callable,  # ty: ignore[invalid-type-form]
         associativity="left",
         arity=2,
         rendered: str | None = None,
+        precedence: int = 0,
     ):
+        assert associativity in ("left", "right")
         self.function = function
         self.associativity = associativity
-        self.arity = arity  # consumers should check this before passing args
+        # consumers should check this before passing args. None is variadic: get_rpn_tokens
+        # counts each call's arguments, and emits a Function with that arity (see called_with)
+        self.arity = arity
         self.rendered = rendered  # e.g. negation
+        # precomputed for the shunting yard, so it can compare plain ints
+        self.precedence = precedence
+        self.right_associative = int(associativity == "right")
+        self._hash = None
 
     def __call__(self, *args):
         return self.function(*args)
 
+    def _identity(self) -> tuple:
+        """What makes two Callables behave the same; rendered names don't count"""
+        return (type(self), self.function, self.associativity, self.arity)
+
     def __eq__(self, other):
-        return (
-            self.function == other.function
-            and self.associativity == other.associativity
-            and self.arity == other.arity
-        )
+        # registered entities are interned, so this is usually decided by the first check
+        if self is other:
+            return True
+        if not isinstance(other, Callable):
+            return NotImplemented
+        return self._identity() == other._identity()
+
+    def __hash__(self):
+        # the fields are never changed after __init__, so the hash can't go stale
+        if self._hash is None:
+            self._hash = hash(self._identity())
+        return self._hash
 
     def __repr__(self):
         return f"fn={self.function} assoc={self.associativity} arity={self.arity}"
@@ -74,26 +169,28 @@ class Operator(Callable):
         3 !    # unary right  # TODO: not supported yet
     """
 
+    __slots__ = ("unary",)
+
     def __init__(
         self,
         function: callable,  # ty: ignore[invalid-type-form]
         associativity="left",
         arity=2,
         unary: bool | str = False,
+        precedence: int | None = None,
         **kwargs,
     ):
-        super().__init__(function, associativity, arity, **kwargs)
         assert unary in (False, "left", "right")
+        if precedence is None:
+            if unary:
+                precedence = UNARY_PRECEDENCE
+            else:
+                precedence = precedence_table.get(unwrap(function), 0)
+        super().__init__(function, associativity, arity, precedence=precedence, **kwargs)
         self.unary = unary
 
-    def __eq__(self, other):
-        return (
-            type(self) is type(other)
-            and self.function == other.function
-            and self.associativity == other.associativity
-            and self.arity == other.arity
-            and self.unary == other.unary
-        )
+    def _identity(self) -> tuple:
+        return (Operator, self.function, self.associativity, self.arity, self.unary)
 
 
 class Function(Callable):
@@ -101,19 +198,87 @@ class Function(Callable):
     Wrap a callable, e.g. math.abs or math.gcd
     Syntactically, we expect "{function}({arg}, {arg2})",
     But honestly I don't see how this is different from an Operator other
-    than that Operators are written infix (or prefix), whereas have parens after them and optional comma separated args
+    than that Operators are written infix (or prefix), whereas have parens after them and comma separated args
 
-    min(a b)
-    min(a,b)  # optional comma
+    max(a, b, c)  # variadic (arity None): called once, with however many arguments there are
+    log(x, base)  # arity range(1, 3): variadic, but only with 1 or 2 arguments
     """
 
+    __slots__ = ("_calls", "arities")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # how many arguments a variadic function can be called with (None: any number)
+        self.arities = None
+        if type(self.arity) is range:
+            self.arities, self.arity = self.arity, None
+        # variadic: argument count -> this Function called with that many (see called_with)
+        self._calls = {} if self.arity is None else None
+
+
+class Variable:
+    """
+    A named value that isn't known until evaluation time, e.g. the x in "2 * x".
+    Anything that looks like a name, but isn't in entity_mapping or math, is a Variable.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.name == other.name
+
+    def __hash__(self):
+        return hash((Variable, self.name))
+
+    def __repr__(self):
+        return f"Variable({self.name!r})"
+
+
+class Store:
+    """
+    RPN-only: copy the value on top of the stack into temp slot `slot`, leaving it in place.
+    Emitted by optimizer.eliminate_common_subexpressions, along with Load.
+    """
+
+    __slots__ = ("slot",)
+
+    def __init__(self, slot: int):
+        self.slot = slot
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.slot == other.slot
+
+    def __hash__(self):
+        return hash((Store, self.slot))
+
+    def __repr__(self):
+        return f"Store({self.slot})"
+
+
+class Load:
+    """RPN-only: push the value saved in temp slot `slot` by an earlier Store"""
+
+    __slots__ = ("slot",)
+
+    def __init__(self, slot: int):
+        self.slot = slot
+
     def __eq__(self, other):
-        return (
-            type(self) is type(other)
-            and self.function == other.function
-            and self.associativity == other.associativity
-            and self.arity == other.arity
-        )
+        return type(self) is type(other) and self.slot == other.slot
+
+    def __hash__(self):
+        return hash((Load, self.slot))
+
+    def __repr__(self):
+        return f"Load({self.slot})"
+
+
+def unwrap(function):
+    """The plain python function inside a Callable (which may itself wrap another Callable)"""
+    while isinstance(function, Callable):
+        function = function.function
+    return function
 
 
 # ------
@@ -144,6 +309,10 @@ entity_mapping = {
     "~": Operator(neg, arity=1, unary="left"),
     # abs isn't infix so we don't consider it an "operator"
     "abs": Function(operator.abs, arity=1),
+    "max": Function(_max, arity=None),
+    "min": Function(_min, arity=None),
+    "fsum": Function(_fsum, arity=None),
+    "prod": Function(_prod, arity=None),
     "sqrt": Function(math.sqrt, arity=1),
     # Disallow 5!, use factorial(5) instead
     #   mainly because I don't wat to handle "-5!"
@@ -156,34 +325,172 @@ entity_mapping = {
 }
 
 
-Entity = number | Special | Operator | Function
+Entity = number | Special | Operator | Function | Variable | Store | Load
+
+token_kinds = {
+    int: NUMBER,
+    float: NUMBER,
+    Variable: VARIABLE,
+    Operator: OPERATOR,
+    Function: FUNCTION,
+    Special: SPECIAL,
+    Store: STORE,
+    Load: LOAD,
+}
+special_kinds = {
+    Special.PAREN_LEFT: PAREN_LEFT,
+    Special.PAREN_RIGHT: PAREN_RIGHT,
+    Special.COMMA: COMMA,
+    Special.MINUS: MINUS,
+    Special.PAUSE: PAUSE,
+}
+
+
+# =========================
+# Registry
+#
+# Every operator, function and constant has one shared (interned) instance: parsing "sin"
+# a million times gives the same Function a million times, and each registered Callable
+# knows the name it renders as, so render() never has to search for it.
+# =========================
+
+_interned: dict[Callable, Callable] = {}
+# Callable -> the first name it was registered under, for equal Callables that weren't interned
+_rendered_names: dict[Callable, str] = {}
+# math functions, interned the first time they're looked up
+math_entities: dict[str, Function] = {}
+
+# math functions inspect.signature can't see into
+arity_overrides = {math.log: range(1, 3), math.hypot: None}
+
+
+def introspect_arity(function, default: int = 2) -> int | range | None:
+    """
+    How many arguments `function` takes: its positional parameters, or a range of counts if
+    some of them are optional, or None if it takes *args. Functions we can't introspect get
+    `default`.
+    """
+    if function in arity_overrides:
+        return arity_overrides[function]
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        return default
+    if any(parameter.kind is parameter.VAR_POSITIONAL for parameter in parameters):
+        return None
+    positional = [
+        parameter
+        for parameter in parameters
+        if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)
+    ]
+    required = sum(1 for parameter in positional if parameter.default is parameter.empty)
+    if required == len(positional):
+        return required
+    return range(required, len(positional) + 1)
+
+
+def intern(entity: Callable) -> Callable:
+    """The one shared instance of everything equal to `entity`"""
+    return _interned.setdefault(entity, entity)
+
+
+def called_with(function: Function, count: int) -> Function:
+    """A variadic Function, as called with `count` arguments: one call in the RPN"""
+    called = function._calls.get(count)
+    if called is None:
+        arities = function.arities
+        if arities is not None and count not in arities:
+            raise ParseError(
+                f"{render(function)} takes {arities[0]} to {arities[-1]} arguments, not {count}"
+            )
+        called = intern(Function(function.function, arity=count, rendered=render(function)))
+        function._calls[count] = called
+    return called
+
+
+def register(name: str, entity: Entity) -> Entity:
+    """Make `name` parse as `entity` (interned, if it's a Callable); returns what was registered"""
+    if isinstance(entity, Callable):
+        entity = intern(entity)
+        _rendered_names.setdefault(entity, name)
+        if entity.rendered is None:
+            entity.rendered = name
+    entity_mapping[name] = entity
+    return entity
+
+
+def register_function(name: str, function, arity: int | range | None = None) -> Function:
+    """
+    Make `name(...)` call `function` in expressions parsed from now on.
+    (Previously compiled expressions, e.g. in compiler.cache, aren't affected.)
+    `arity` is introspected from the signature, unless given; a function that takes *args
+    is variadic, and gets called with all of the arguments it's written with. So is one with
+    optional parameters, but only with as many as its signature allows.
+    """
+    if not name.isidentifier():
+        raise ValueError(f"Not a valid function name: {name!r}")
+    if name in entity_mapping:
+        raise ValueError(f"{name!r} is already defined")
+    if arity is None:
+        arity = introspect_arity(function)
+    return register(name, Function(function, arity=arity))
+
+
+def unregister(name: str):
+    """Undo register_function (or register)"""
+    del entity_mapping[name]
+
+
+for _name, _entity in list(entity_mapping.items()):
+    register(_name, _entity)
 
 
 def get_entity(token: str) -> Entity:
     entity = entity_mapping.get(token)
+    if entity is None:
+        entity = math_entities.get(token)
     if entity is None:
         # it might be in math!
-        math_func = getattr(math, token, None)
-        if math_func is None:
-            raise NotImplementedError
-        else:
-            # this will not work if math_func only takes one arg
-            return Function(math_func)
+        math_attribute = getattr(math, token, None)
+        if type(math_attribute) is float:
+            # math.e, math.tau, math.inf, ...
+            return math_attribute
+        if callable(math_attribute):
+            entity = intern(
+                Function(math_attribute, arity=introspect_arity(math_attribute), rendered=token)
+            )
+            math_entities[token] = entity
+            return entity
+        if token.isidentifier():
+            return Variable(token)
+        raise NotImplementedError
     return entity
 
 
+_renderers = {
+    int: str,
+    float: str,
+    Special: lambda special: special.value,
+    Variable: lambda variable: variable.name,
+    # temp slots; "$" can't appear in the input, so these can't be mistaken for variables
+    Store: lambda store: f"=${store.slot}",
+    Load: lambda load: f"${load.slot}",
+}
+
+
 def render(entity: Entity) -> str:
-    # renders the first-encountered entity (in case we have two names)
+    renderer = _renderers.get(type(entity))
+    if renderer is not None:
+        return renderer(entity)
+    # registered Callables know their (first-registered) name
     if entity.rendered is not None:
         return entity.rendered
-    for name, e in entity_mapping.items():
-        if type(e) is type(entity) and e == entity:
-            return name
+    name = _rendered_names.get(entity)
+    if name is not None:
+        return name
     # fallback for something we didn't specify:
     if type(entity) is Function or type(entity) is Operator:
         return entity.function.__name__
-    if type(entity) in [int, float]:
-        return entity
     # fallback to rendering the stringification of something
     return str(entity)
 
@@ -192,6 +499,5 @@ def render_tokens(entities: Iterable[Entity]) -> str:
     return " ".join(render(e) for e in entities)
 
 
-@cache
 def get_precedence(op: Operator | Function) -> int:
-    raise NotImplementedError
+    return op.precedence
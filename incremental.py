@@ -0,0 +1,83 @@
+"""
+# incremental.py
+#
+# Parse an expression as it arrives, a keystroke or a socket read at a time: feed() each
+# piece of input, and get back the RPN tokens it settled, as soon as they're settled.
+#
+#    In [1]: parser = IncrementalParser()
+#    In [2]: render_tokens(parser.feed("2 * 3"))  # 3 could still turn out to be 35
+#    Out[2]: '2'
+#    In [3]: render_tokens(parser.feed("5 + 4"))  # + pops the *
+#    Out[3]: '35 *'
+#    In [4]: render_tokens(parser.close())
+#    Out[4]: '4 +'
+#
+# It's the same scan -> enrich -> get_rpn_tokens pipeline, with its state (enrich's
+# last_non_minus, the shunting yard's operator stack) kept in suspended generators between
+# feeds, so the work for each feed is proportional to the input it brings, not everything
+# before it.
+"""
+
+from collections import deque
+from typing import Iterator
+
+from entities import Entity, Special
+from shunting_yard import get_rpn_tokens
+from tokenizer import ChunkScanner, Token, enrich
+
+
+class IncrementalParser:
+    """
+    Push-based parsing of one expression. Concatenating everything feed() and close() return
+    gives the same RPN as get_rpn_tokens(enrich(scan(whole_input))).
+
+    Once close() has been called, or anything has raised, the parser is closed, and
+    feed() raises ValueError. Scanning errors are ParseErrors positioned in the whole input.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._scanner = ChunkScanner()
+        self._tokens: deque[Token] = deque()  # scanned, but not enriched yet
+        self._rpn = get_rpn_tokens(self._entities())
+
+    def feed(self, chunk: str) -> list[Entity]:
+        """Parse more input; returns the RPN tokens it settled"""
+        if self.closed:
+            raise ValueError("feed() on a closed IncrementalParser")
+        return self._run(self._scanner.feed(chunk))
+
+    def close(self) -> list[Entity]:
+        """The end of the input; returns the rest of the RPN"""
+        if self.closed:
+            return []
+        self.closed = True
+        return self._run(self._scanner.close())
+
+    def _run(self, tokens: Iterator[Token]) -> list[Entity]:
+        output = []
+        try:
+            self._tokens.extend(tokens)
+            for token in self._rpn:
+                if token is Special.PAUSE:
+                    break
+                output.append(token)
+        except Exception:
+            self.closed = True
+            raise
+        return output
+
+    def _entities(self) -> Iterator[Entity]:
+        # enrich gives one entity per token, so it's only asked for one when there's a token
+        # for it to pull. get_rpn_tokens only pulls once it has output everything the entities
+        # before decided: so once the tokens run out, a PAUSE goes in, and comes straight back
+        # out to _run, which stops there until there's more.
+        tokens = self._tokens
+        enriched = enrich(iter(tokens.popleft, None))
+        while True:
+            if tokens:
+                yield next(enriched)
+            elif self.closed:
+                return
+            else:
+                yield Special.PAUSE
@@ -0,0 +1,268 @@
+"""
+# instrumentation.py
+#
+# Opt-in timers and counters for each stage of the pipeline, for finding out where the
+# time goes. Off by default; while it's off, the only cost is one `is None` check per
+# compile_uncached call, and evaluation isn't touched at all.
+#
+#    In [1]: instruments = instrumentation.enable()
+#    In [2]: compiler.compile("sqrt(x) + 2 * (x - 1)")({"x": 4})
+#    Out[2]: 8.0
+#    In [3]: print(instruments.snapshot())
+#    shunting_yard_stage_calls_total{stage="scan"} 1
+#    ...
+#    shunting_yard_stage_seconds_total{stage="scan"} 0.000048
+#    ...
+#    shunting_yard_tokens_total 12
+#    shunting_yard_rpn_tokens_total 8
+#    shunting_yard_stack_high_water 4
+#    shunting_yard_calls_total{function="*"} 1
+#    ...
+#    shunting_yard_calls_total{function="sqrt"} 1
+#    In [4]: instruments.add_hook(print)  # or your own tracer; called with each Event
+#
+# Stages are timed separately, so while instrumentation is on, each stage's output is
+# materialized before the next stage runs. Only expressions compiled while it's on are
+# instrumented: enable() and disable() clear compiler.cache so that nothing is missed.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable as CallableType, Iterable, Iterator, NamedTuple, Sequence
+
+import compiler
+from entities import Callable, Entity, Function, Operator, Special, render
+from optimizer import eliminate_common_subexpressions, optimize as optimize_rpn
+from shunting_yard import get_rpn_tokens, locate_rpn_tokens
+from tokenizer import Token, scan, enrich
+
+
+STAGES = ("scan", "enrich", "get_rpn_tokens", "optimize", "cse", "build", "evaluate")
+
+
+class Event(NamedTuple):
+    """What hooks get called with, once a stage has finished (or failed)"""
+
+    stage: str
+    source: str
+    seconds: float
+    error: Exception | None = None
+
+
+@dataclass
+class StageTimer:
+    calls: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class Instruments:
+    def __init__(self):
+        self.stages = {stage: StageTimer() for stage in STAGES}
+        self.tokens = 0  # scanned tokens, over every compile
+        self.rpn_tokens = 0
+        # the most entries get_rpn_tokens' operator stack has held, over every compile
+        self.stack_high_water = 0
+        # rendered operator/function -> calls, over every successful evaluation
+        self.function_calls = Counter()
+        self.hooks: list[CallableType[[Event], None]] = []
+
+    def add_hook(self, hook: CallableType[[Event], None]):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: CallableType[[Event], None]):
+        self.hooks.remove(hook)
+
+    def reset(self):
+        """Zero every timer and counter (hooks stay attached)"""
+        hooks = self.hooks
+        self.__init__()
+        self.hooks = hooks
+
+    def record(self, stage: str, source: str, start: float, error: Exception | None = None):
+        seconds = perf_counter() - start
+        timer = self.stages[stage]
+        timer.calls += 1
+        timer.seconds += seconds
+        timer.max_seconds = max(timer.max_seconds, seconds)
+        if error is not None:
+            timer.errors += 1
+        if self.hooks:
+            event = Event(stage, source, seconds, error)
+            for hook in self.hooks:
+                hook(event)
+
+    @contextmanager
+    def timing(self, stage: str, source: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(stage, source, start, e)
+            raise
+        self.record(stage, source, start)
+
+    # -------------
+    # The instrumented pipeline
+    # -------------
+
+    def compile(
+        self,
+        source: str,
+        optimize: bool = False,
+        backend: str = "stack",
+        cse: bool = False,
+        tokens: Sequence[Token] | None = None,
+        offset: int = 0,
+    ) -> compiler.CompiledExpression:
+        """
+        compiler.compile_uncached, timing each stage; see compile_uncached. It builds the
+        same CompiledExpression, spans included, and raises the same ParseErrors.
+
+        For compile_document: `tokens` already scanned (so there's no scan stage) out of a
+        string `offset` characters before `source` starts.
+        """
+        if tokens is None:
+            with self.timing("scan", source):
+                tokens = tuple(scan(source))
+        self.tokens += len(tokens)
+        with self.timing("enrich", source):
+            enriched = list(enrich(tokens))
+        with self.timing("get_rpn_tokens", source):
+            origins = []
+            rpn, high_water = rpn_with_high_water(enriched, tokens, origins)
+            spans = compiler._spans(tokens, origins, offset)
+        self.stack_high_water = max(self.stack_high_water, high_water)
+
+        stats = None
+        if optimize:
+            with self.timing("optimize", source):
+                rpn, stats = optimize_rpn(rpn)
+            spans = None
+        if cse:
+            with self.timing("cse", source):
+                rpn, _ = eliminate_common_subexpressions(rpn)
+            spans = None
+        self.rpn_tokens += len(rpn)
+
+        with self.timing("build", source):
+            expression = compiler.CompiledExpression(source, rpn, stats, backend, spans)
+        expression._evaluate = self._instrument_evaluate(expression._evaluate, source, rpn)
+        return expression
+
+    def _instrument_evaluate(self, evaluate, source: str, rpn: Iterable[Entity]):
+        # every Callable in the RPN runs exactly once per evaluation
+        calls = Counter(render(token) for token in rpn if isinstance(token, Callable))
+
+        def evaluate_instrumented(variables=None):
+            start = perf_counter()
+            try:
+                result = evaluate(variables)
+            except Exception as e:
+                self.record("evaluate", source, start, e)
+                raise
+            self.record("evaluate", source, start)
+            self.function_calls.update(calls)
+            return result
+
+        return evaluate_instrumented
+
+    # -------------
+    # Export
+    # -------------
+
+    def snapshot(self) -> str:
+        """Every timer and counter, in the Prometheus text format: one `name value` per line"""
+        lines = []
+        for field in ("calls", "errors", "seconds", "max_seconds"):
+            name = f"shunting_yard_stage_{field}" + ("" if field == "max_seconds" else "_total")
+            for stage, timer in self.stages.items():
+                value = getattr(timer, field)
+                value = f"{value:.6f}" if type(value) is float else value
+                lines.append(f'{name}{{stage="{stage}"}} {value}')
+        lines.append(f"shunting_yard_tokens_total {self.tokens}")
+        lines.append(f"shunting_yard_rpn_tokens_total {self.rpn_tokens}")
+        lines.append(f"shunting_yard_stack_high_water {self.stack_high_water}")
+        for function, calls in sorted(self.function_calls.items()):
+            lines.append(f'shunting_yard_calls_total{{function="{function}"}} {calls}')
+        return "\n".join(lines)
+
+
+def rpn_with_high_water(
+    tokens: Iterable[Entity],
+    source_tokens: Sequence[Token] | None = None,
+    origins: list[int] | None = None,
+) -> tuple[tuple[Entity, ...], int]:
+    """
+    get_rpn_tokens, plus the most entries its operator stack ever held, measured from outside.
+    Given the `source_tokens` that `tokens` were enriched from, it's locate_rpn_tokens instead
+    (which appends to `origins`), for ParseErrors with positions.
+
+    get_rpn_tokens finishes with one token before it pulls the next, so at every pull its
+    stack holds what's been pushed (operators, functions, and '(') less what's been popped
+    (operators and functions that were output, and the '(' each ')' discards).
+    """
+    depth = 0  # pushes less ')'s, over the tokens pulled so far
+    output_calls = 0
+    high_water = 0
+
+    def pull():
+        nonlocal depth, high_water
+        for token in tokens:
+            high_water = max(high_water, depth - output_calls)
+            if type(token) is Operator or type(token) is Function:
+                depth += 1
+            elif token is Special.PAREN_LEFT:
+                depth += 1
+            elif token is Special.PAREN_RIGHT:
+                depth -= 1
+            yield token
+        high_water = max(high_water, depth - output_calls)
+
+    if source_tokens is None:
+        parsed = get_rpn_tokens(pull())
+    else:
+        parsed = locate_rpn_tokens(pull(), source_tokens, origins)
+    rpn = []
+    for token in parsed:
+        if isinstance(token, Callable):
+            output_calls += 1
+        rpn.append(token)
+    return tuple(rpn), high_water
+
+
+# =========================
+# Turning it on and off
+# =========================
+
+
+def enable(instruments: Instruments | None = None) -> Instruments:
+    """Instrument everything compiled from now on (with new Instruments, unless given some)"""
+    if instruments is None:
+        instruments = Instruments()
+    compiler.instruments = instruments
+    compiler.cache.clear()
+    return instruments
+
+
+def disable() -> Instruments | None:
+    """Stop instrumenting; returns the Instruments that were in use"""
+    instruments, compiler.instruments = compiler.instruments, None
+    compiler.cache.clear()
+    return instruments
+
+
+@contextmanager
+def instrumented(instruments: Instruments | None = None) -> Iterator[Instruments]:
+    previous = compiler.instruments
+    instruments = enable(instruments)
+    try:
+        yield instruments
+    finally:
+        if previous is None:
+            disable()
+        else:
+            enable(previous)
@@ -0,0 +1,397 @@
+"""
+# optimizer.py
+#
+# Rewrite RPN programs (from get_rpn_tokens) into cheaper, equivalent ones before eval_rpn.
+#
+#    In [1]: rpn, stats = optimize(get_rpn_tokens(enrich(scan("sqrt(4) * pi * x - ---x ^ 1"))))
+#    In [2]: render_tokens(rpn)
+#    Out[2]: '6.283185307179586 x * x neg -'
+#    In [3]: stats
+#    Out[3]: OptimizationStats(folded=2, negations_collapsed=2, strength_reduced=1, removed=5)
+#
+# Rewrites:
+# - constant folding: any operation whose operands are all literals is computed now,
+#   unless that would be expensive (see FOLDING_BUDGET), e.g. 9 ^ 9 ^ 9 is left alone
+# - neg chains: "neg neg" cancels out, so --x becomes x (enrich leaves these in for us)
+# - strength reduction: x ^ 1 -> x, when x is a single operand
+#
+# The RPN gets rebuilt as an expression tree so rewrites can look at whole operands,
+# and then flattened back into RPN.
+#
+# Separately, eliminate_common_subexpressions (run it after optimize) finds repeated
+# subexpressions, and computes each one once:
+#
+#    In [4]: rpn, stats = eliminate_common_subexpressions(get_rpn_tokens(enrich(scan(
+#       ...:     "sqrt(x / 3) * sqrt(x / 3) + abs(x / 3)"))))
+#    In [5]: render_tokens(rpn)
+#    Out[5]: 'x 3 / =$0 sqrt =$1 $1 * $0 abs +'
+#    In [6]: stats
+#    Out[6]: CSEStats(deduplicated=3, slots=2)
+#
+# And canonicalize puts RPN in a canonical form, so that the same formula written
+# different ways gets the same fingerprint (e.g. to key caches on):
+#
+#    In [7]: fingerprint(get_rpn_tokens(enrich(scan("(x) × 3 + 1")))) == fingerprint(
+#       ...:     get_rpn_tokens(enrich(scan("1 + 3*x"))))
+#    Out[7]: True
+"""
+
+import hashlib
+import math
+import operator
+import sys
+from dataclasses import dataclass
+from typing import Iterable
+
+from budget import Budget
+from entities import (
+    Callable,
+    Entity,
+    Load,
+    Operator,
+    Store,
+    Variable,
+    _neg,
+    neg,
+    render,
+    unwrap,
+)
+
+
+# folding runs at compile time, where nothing else bounds it; over this, leave it to evaluation
+FOLDING_BUDGET = Budget(max_bits=1 << 16)
+
+
+@dataclass
+class OptimizationStats:
+    folded: int = 0  # operations computed at optimization time
+    negations_collapsed: int = 0  # neg operations cancelled out
+    strength_reduced: int = 0  # x ^ 1 -> x
+    removed: int = 0  # how many fewer operations the optimized program runs
+
+
+class Node:
+    """An operand (number or Variable), or an operation applied to argument Nodes"""
+
+    __slots__ = ("token", "args")
+
+    def __init__(self, token: Entity, args: tuple["Node", ...] = ()):
+        self.token = token
+        self.args = args
+
+    @property
+    def is_constant(self) -> bool:
+        return type(self.token) in [int, float]
+
+    @property
+    def is_leaf(self) -> bool:
+        return not self.args
+
+
+def is_negation(token: Entity) -> bool:
+    # entity_mapping's "neg" and "~" wrap the `neg` Operator, rather than _neg itself
+    return type(token) is Operator and (token.function is _neg or token.function is neg)
+
+
+def count_operations(rpn: Iterable[Entity]) -> int:
+    return sum(1 for token in rpn if isinstance(token, Callable))
+
+
+def optimize(rpn_tokens: Iterable[Entity]) -> tuple[tuple[Entity, ...], OptimizationStats]:
+    """
+    Optimize a sequence of RPN tokens.
+    Returns the optimized RPN, and stats about what changed.
+    """
+    rpn_tokens = tuple(rpn_tokens)
+    stats = OptimizationStats()
+
+    stack: list[Node] = []
+    for token in rpn_tokens:
+        if type(token) is Store or type(token) is Load:
+            raise ValueError("optimize() has to run before eliminate_common_subexpressions()")
+        if not isinstance(token, Callable):
+            stack.append(Node(token))
+            continue
+        arity = token.arity
+        if len(stack) < arity:
+            raise ValueError(f"Not enough operands for {render(token)}")
+        args = tuple(stack[len(stack) - arity :])
+        del stack[len(stack) - arity :]
+        stack.append(_rewrite(token, args, stats))
+
+    optimized = tuple(_flatten(stack))
+    stats.removed = count_operations(rpn_tokens) - count_operations(optimized)
+    return optimized, stats
+
+
+def _rewrite(token: Callable, args: tuple[Node, ...], stats: OptimizationStats) -> Node:
+    # a function without arguments (e.g. a registered random()) isn't constant
+    if args and all(arg.is_constant for arg in args):
+        folded = _fold(token, args)
+        if folded is not None:
+            stats.folded += 1
+            return folded
+
+    if is_negation(token):
+        (arg,) = args
+        if is_negation(arg.token):
+            # neg(neg(x)) -> x
+            stats.negations_collapsed += 2
+            return arg.args[0]
+
+    if type(token) is Operator and token.function is operator.pow:
+        base, exponent = args
+        # only for int exponents: x ^ 1.0 is always a float. (Not x ^ 2 -> x * x: for a
+        # float x, ** raises OverflowError where * gives inf.)
+        if base.is_leaf and type(exponent.token) is int and exponent.token == 1:
+            stats.strength_reduced += 1
+            return base
+
+    return Node(token, args)
+
+
+def _fold(token: Callable, args: tuple[Node, ...]) -> Node | None:
+    """Compute the operation now, unless that fails, or gives us something that isn't a number"""
+    try:
+        value = FOLDING_BUDGET.meter().call(token, [arg.token for arg in args])
+    except Exception:
+        # e.g. 1 / 0, or 9 ^ 9 ^ 9 (BudgetExceeded): leave it for evaluation to raise
+        return None
+    if type(value) not in [int, float]:
+        # e.g. (-8) ^ 0.5 is complex, which we can't represent as a literal
+        return None
+    if type(value) is int and not _printable(value):
+        # within FOLDING_BUDGET, but too many digits for str() to render it
+        return None
+    return Node(value)
+
+
+def _printable(value: int) -> bool:
+    limit = sys.get_int_max_str_digits()  # 0 is no limit
+    # an int of n bits has at most ceil(n * log10(2)) digits
+    return limit == 0 or value.bit_length() * math.log10(2) <= limit
+
+
+def _flatten(roots: list[Node]) -> Iterable[Entity]:
+    """Post-order walk back into RPN. Iterative, since chains like 1+2+...+n are very deep."""
+    for root in roots:
+        pending = [(root, False)]
+        while pending:
+            node, visited = pending.pop()
+            if visited or node.is_leaf:
+                yield node.token
+                continue
+            pending.append((node, True))
+            for arg in reversed(node.args):
+                pending.append((arg, False))
+
+
+# =========================
+# Common subexpression elimination
+#
+# Hash-cons the RPN into a DAG: structurally equal subexpressions (same operator or
+# function, same operands) become the same node. A node used more than once is computed
+# the first time it's needed, saved with a Store, and every later use is a Load.
+# =========================
+
+
+@dataclass
+class CSEStats:
+    deduplicated: int = 0  # operations that no longer run, because their result is reused
+    slots: int = 0  # temp slots used
+
+
+def _leaf_key(token: Entity) -> tuple:
+    if type(token) is float:
+        # repr keeps 0.0 and -0.0 apart, which == wouldn't
+        return (float, repr(token))
+    return (type(token), token)
+
+
+def eliminate_common_subexpressions(
+    rpn_tokens: Iterable[Entity],
+) -> tuple[tuple[Entity, ...], CSEStats]:
+    """
+    Rewrite RPN so each distinct subexpression is computed once.
+    Returns the new RPN (with Store/Load temp slots), and stats about what changed.
+    """
+    node_ids = {}  # structural key -> node id
+    tokens = []  # node id -> token
+    children = []  # node id -> child node ids
+    uses = []  # node id -> how many times it's referenced
+    operations = 0  # operations in the original RPN
+
+    def intern(key, token, args) -> int:
+        node_id = node_ids.get(key)
+        if node_id is None:
+            node_id = node_ids[key] = len(tokens)
+            tokens.append(token)
+            children.append(args)
+            uses.append(0)
+            for arg in args:
+                uses[arg] += 1
+        return node_id
+
+    stack = []
+    for token in rpn_tokens:
+        if isinstance(token, Callable):
+            arity = token.arity
+            if len(stack) < arity:
+                raise ValueError(f"Not enough operands for {render(token)}")
+            args = tuple(stack[len(stack) - arity :])
+            del stack[len(stack) - arity :]
+            operations += 1
+            stack.append(intern((token, args), token, args))
+        elif type(token) in [int, float] or type(token) is Variable:
+            stack.append(intern(_leaf_key(token), token, ()))
+        else:
+            raise ValueError(f"Unexpected token in RPN: {token!r}")
+    for root in stack:
+        uses[root] += 1
+
+    # walk the DAG back out to RPN, first use computes (and stores), later uses load
+    slots = {}  # node id -> temp slot
+    emitted = set()
+    output = []
+    for root in stack:
+        pending = [(root, False)]
+        while pending:
+            node_id, visited = pending.pop()
+            if node_id in emitted:
+                output.append(Load(slots[node_id]))
+                continue
+            if not visited and children[node_id]:
+                pending.append((node_id, True))
+                for child in reversed(children[node_id]):
+                    pending.append((child, False))
+                continue
+            output.append(tokens[node_id])
+            if uses[node_id] > 1 and children[node_id]:
+                # shared, and worth saving (leaves are as cheap to push as to load)
+                slots[node_id] = len(slots)
+                output.append(Store(slots[node_id]))
+                emitted.add(node_id)
+
+    remaining = sum(1 for token in output if isinstance(token, Callable))
+    return tuple(output), CSEStats(deduplicated=operations - remaining, slots=len(slots))
+
+
+# =========================
+# Canonical form
+#
+# Parsing already drops parens, and turns aliases (÷ and /, × and *) into the same interned
+# entity. canonicalize also puts the operands of each commutative operation in a fixed order
+# (by a digest of each operand's canonical form), so 3 + x and x + 3 come out the same.
+#
+# Only the operands of one operation are swapped, which is exact for ints and floats:
+# (a + b) + c isn't regrouped as a + (b + c), since floating point addition isn't associative.
+# Numbers keep their type too: x + 3 and x + 3.0 don't always evaluate the same (2 ^ 64
+# vs 2.0 ^ 64). What can differ between equivalent forms is which error is raised, when
+# both operands of + or * would raise one.
+# =========================
+
+commutative_functions = frozenset((operator.add, operator.mul))
+
+
+def _digest_key(token: Entity) -> bytes:
+    if type(token) is int:
+        kind, text = "i", str(token)
+    elif type(token) is float:
+        kind, text = "f", repr(token)
+    elif type(token) is Variable:
+        kind, text = "v", token.name
+    elif isinstance(token, Callable):
+        # rendered names are unique among registered entities, arity tells variadic calls apart
+        kind, text = "c", f"{render(token)}/{token.arity}"
+    elif type(token) is Store or type(token) is Load:
+        raise ValueError("canonicalize() has to run before eliminate_common_subexpressions()")
+    else:
+        raise ValueError(f"Unexpected token in RPN: {token!r}")
+    return f"{kind}{len(text)}:{text}".encode()
+
+
+def _is_commutative(token: Callable) -> bool:
+    return token.arity == 2 and unwrap(token.function) in commutative_functions
+
+
+def _combine(token: Callable, arg_digests: Iterable[bytes]) -> bytes:
+    # An operation's digest covers its token and its (ordered) operands' digests. A leaf's
+    # "digest" is just its (length-prefixed) key, which saves hashing half the nodes; it
+    # can't be mistaken for an operation's, which is always b"n" and 16 bytes of hash.
+    digest = hashlib.blake2b(_digest_key(token), digest_size=16)
+    for arg_digest in arg_digests:
+        digest.update(arg_digest)
+    return b"n" + digest.digest()
+
+
+def _hexdigest(digest: bytes) -> str:
+    # a bare leaf's key isn't a hash: hash it, for fingerprints that all look alike
+    if digest[:1] != b"n":
+        digest = b"n" + hashlib.blake2b(digest, digest_size=16).digest()
+    return digest[1:].hex()
+
+
+def _pop_args(stack: list, token: Callable) -> list:
+    arity = token.arity
+    if len(stack) < arity:
+        raise ValueError(f"Not enough operands for {render(token)}")
+    args = stack[len(stack) - arity :]
+    del stack[len(stack) - arity :]
+    return args
+
+
+def _check_done(stack: list):
+    if len(stack) != 1:
+        raise ValueError(f"Malformed RPN: {len(stack)} values left on the stack")
+
+
+def canonicalize(rpn_tokens: Iterable[Entity]) -> tuple[tuple[Entity, ...], str]:
+    """The canonical form of some RPN, and its fingerprint (see fingerprint)"""
+    stack: list[tuple[bytes, Node]] = []
+    for token in rpn_tokens:
+        if not isinstance(token, Callable):
+            stack.append((_digest_key(token), Node(token)))
+            continue
+        args = _pop_args(stack, token)
+        if _is_commutative(token):
+            args.sort(key=lambda arg: arg[0])
+        digest = _combine(token, (arg_digest for arg_digest, _ in args))
+        stack.append((digest, Node(token, tuple(node for _, node in args))))
+    _check_done(stack)
+    digest, root = stack[0]
+    return tuple(_flatten([root])), _hexdigest(digest)
+
+
+def fingerprint(rpn_tokens: Iterable[Entity]) -> str:
+    """
+    A digest of the canonical form of some RPN: equal for the same formula however it was
+    written (up to the rewrites above), and, short of a 128-bit hash collision, different
+    for anything else.
+    """
+    # canonicalize's loop, without building the tree, and with _combine inlined (this is
+    # per token, on every CompileCache(canonical=True) miss)
+    stack: list[bytes] = []
+    blake2b = hashlib.blake2b
+    for token in rpn_tokens:
+        if not isinstance(token, Callable):
+            stack.append(_digest_key(token))
+            continue
+        arity = token.arity
+        if len(stack) < arity:
+            raise ValueError(f"Not enough operands for {render(token)}")
+        digest = blake2b(_digest_key(token), digest_size=16)
+        if arity == 2:
+            right = stack.pop()
+            left = stack.pop()
+            if right < left and unwrap(token.function) in commutative_functions:
+                left, right = right, left
+            digest.update(left)
+            digest.update(right)
+        elif arity == 1:
+            digest.update(stack.pop())
+        else:
+            for arg_digest in _pop_args(stack, token):
+                digest.update(arg_digest)
+        stack.append(b"n" + digest.digest())
+    _check_done(stack)
+    return _hexdigest(stack[0])
@@ -0,0 +1,439 @@
+"""
+# program.py
+#
+# A compact, array-backed form of an RPN program, for when we're holding onto lots of them.
+#
+# RPN from get_rpn_tokens is a list of python objects: ints, floats, Variables, and
+# Operator/Function instances. A Program is instead:
+# - opcodes:   array('H') of (opcode, argument) pairs, 4 bytes per instruction
+# - constants: the pool of distinct literals, indexed by PUSH_CONST arguments
+# - names:     the variable names, indexed by LOAD_VAR arguments
+# - operators: the table of Operators/Functions, indexed by CALL arguments. This one is
+#              shared by every Program, since there are only ever a few dozen of them.
+# - max_stack_depth: how big the evaluation stack ever gets, so it can be preallocated
+# - temp_count: how many temp slots STORE/LOAD use (see optimizer.eliminate_common_subexpressions)
+#
+#    In [1]: program = Program.from_rpn(get_rpn_tokens(enrich(scan("2 * x + 2"))))
+#    In [2]: program.disassemble()
+#    Out[2]:
+#    ['PUSH_CONST 0 (2)',
+#     'LOAD_VAR 0 (x)',
+#     'CALL2 3 (*)',
+#     'PUSH_CONST 0 (2)',
+#     'CALL2 5 (+)']
+#
+# Programs serialize to bytes (Program.to_bytes / Program.from_bytes), with the operators
+# named symbolically, so that they can be read back by another process: see program_cache.py.
+"""
+
+import math
+import struct
+import sys
+from array import array
+from typing import Iterable, Mapping
+
+from entities import (
+    Callable,
+    Entity,
+    Function,
+    Load,
+    Store,
+    Variable,
+    called_with,
+    entity_mapping,
+    get_entity,
+    render,
+    unwrap,
+)
+from optimizer import _leaf_key
+
+
+# opcodes
+PUSH_CONST = 0
+LOAD_VAR = 1
+CALL1 = 2  # unary operators/functions
+CALL2 = 3  # binary operators/functions
+CALLN = 4  # anything else
+STORE = 5  # copy the top of the stack into a temp slot
+LOAD = 6  # push a temp slot
+
+opcode_names = ["PUSH_CONST", "LOAD_VAR", "CALL1", "CALL2", "CALLN", "STORE", "LOAD"]
+call_opcodes = {1: CALL1, 2: CALL2}
+call_opcode_set = frozenset((CALL1, CALL2, CALLN))
+
+# opcode arguments are unsigned shorts, so each table can have this many entries
+MAX_TABLE_SIZE = 2**16
+
+
+# =========================
+# Shared operator table
+# =========================
+
+operator_table: list[Callable] = []
+# what eval_program actually calls, skipping Callable.__call__
+operator_functions: list = []
+_operator_index = {}
+
+
+def _operator_key(token: Callable) -> tuple:
+    # what makes Callables behave differently, with wrapped Callables unwrapped: e.g.
+    # entity_mapping's neg wraps the neg enrich emits, and they share a slot and a name
+    return (
+        type(token),
+        unwrap(token.function),
+        token.arity,
+        token.associativity,
+        getattr(token, "unary", None),
+    )
+
+
+def get_operator_index(token: Callable) -> int:
+    """Index of `token` in the shared operator table, adding it if it's new"""
+    key = _operator_key(token)
+    index = _operator_index.get(key)
+    if index is None:
+        index = len(operator_table)
+        if index >= MAX_TABLE_SIZE:
+            raise OverflowError("Too many distinct operators for the shared operator table")
+        operator_table.append(token)
+        operator_functions.append(unwrap(token.function))
+        _operator_index[key] = index
+    return index
+
+
+class Program:
+    __slots__ = ("opcodes", "constants", "names", "max_stack_depth", "temp_count")
+
+    def __init__(
+        self,
+        opcodes: array,
+        constants: tuple,
+        names: tuple[str, ...],
+        max_stack_depth: int,
+        temp_count: int = 0,
+    ):
+        self.opcodes = opcodes
+        self.constants = constants
+        self.names = names
+        self.max_stack_depth = max_stack_depth
+        self.temp_count = temp_count
+
+    @classmethod
+    def from_rpn(cls, rpn_tokens: Iterable[Entity]) -> "Program":
+        """
+        Assemble RPN tokens into a Program.
+        Equal constants share a pool slot, and repeated variables share a name.
+        """
+        opcodes = array("H")
+        # optimizer._leaf_key -> index, so that 1 and 1.0, and 0.0 and -0.0, stay distinct
+        constants = {}
+        values = []
+        names = {}
+
+        depth = max_depth = 0
+        temp_count = 0
+        for token in rpn_tokens:
+            if type(token) in [int, float]:
+                key = _leaf_key(token)
+                index = constants.get(key)
+                if index is None:
+                    index = constants[key] = len(values)
+                    values.append(token)
+                opcodes.extend((PUSH_CONST, index))
+                depth += 1
+            elif type(token) is Variable:
+                index = names.setdefault(token.name, len(names))
+                opcodes.extend((LOAD_VAR, index))
+                depth += 1
+            elif isinstance(token, Callable):
+                if depth < token.arity:
+                    raise ValueError(f"Not enough operands for {render(token)}")
+                index = get_operator_index(token)
+                opcodes.extend((call_opcodes.get(token.arity, CALLN), index))
+                depth += 1 - token.arity
+            elif type(token) is Store:
+                if depth < 1:
+                    raise ValueError("Nothing to store")
+                opcodes.extend((STORE, token.slot))
+                temp_count = max(temp_count, token.slot + 1)
+            elif type(token) is Load:
+                opcodes.extend((LOAD, token.slot))
+                depth += 1
+            else:
+                raise ValueError(f"Unexpected token in RPN: {token!r}")
+            max_depth = max(max_depth, depth)
+
+        if depth != 1:
+            raise ValueError(f"Malformed RPN: {depth} values left on the stack")
+        for table in (constants, names):
+            if len(table) > MAX_TABLE_SIZE:
+                raise OverflowError(f"Too many distinct entries for a Program: {len(table)}")
+
+        return cls(opcodes, tuple(values), tuple(names), max_depth, temp_count)
+
+    def to_rpn(self) -> list[Entity]:
+        """The equivalent list of RPN tokens"""
+        rpn = []
+        opcodes = iter(self.opcodes)
+        for opcode, argument in zip(opcodes, opcodes):
+            if opcode == PUSH_CONST:
+                rpn.append(self.constants[argument])
+            elif opcode == LOAD_VAR:
+                rpn.append(Variable(self.names[argument]))
+            elif opcode == STORE:
+                rpn.append(Store(argument))
+            elif opcode == LOAD:
+                rpn.append(Load(argument))
+            else:
+                rpn.append(operator_table[argument])
+        return rpn
+
+    def disassemble(self) -> list[str]:
+        lines = []
+        opcodes = iter(self.opcodes)
+        for opcode, argument in zip(opcodes, opcodes):
+            if opcode == PUSH_CONST:
+                detail = self.constants[argument]
+            elif opcode == LOAD_VAR:
+                detail = self.names[argument]
+            elif opcode == STORE or opcode == LOAD:
+                detail = f"${argument}"
+            else:
+                detail = render(operator_table[argument])
+            lines.append(f"{opcode_names[opcode]} {argument} ({detail})")
+        return lines
+
+    def to_bytes(self) -> bytes:
+        """Serialize; see the Serialization section below for the format"""
+        # operator arguments index the shared operator table, which is different in every
+        # process, so renumber them into this program's own table of symbolic names
+        functions = {}
+        opcodes = array("H", self.opcodes)
+        for position in range(0, len(opcodes), 2):
+            if opcodes[position] in call_opcode_set:
+                argument = opcodes[position + 1]
+                opcodes[position + 1] = functions.setdefault(argument, len(functions))
+        if sys.byteorder != "little":
+            opcodes.byteswap()
+
+        parts = [
+            _header.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                len(self),
+                len(self.constants),
+                len(self.names),
+                len(functions),
+                self.max_stack_depth,
+                self.temp_count,
+            ),
+            opcodes.tobytes(),
+        ]
+        for constant in self.constants:
+            parts.append(_pack_constant(constant))
+        for name in self.names:
+            parts.append(_pack_string(name))
+        for index in functions:
+            token = operator_table[index]
+            parts.append(_pack_string(symbolic_name(token)))
+            parts.append(_arity.pack(token.arity))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> "Program":
+        """Deserialize what to_bytes produced; raises ValueError if it isn't that"""
+        data = memoryview(data)
+        if len(data) < _header.size:
+            raise ValueError("Truncated program")
+        (
+            magic,
+            version,
+            instructions,
+            constant_count,
+            name_count,
+            function_count,
+            max_stack_depth,
+            temp_count,
+        ) = _header.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a serialized program")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported program format version {version}")
+
+        offset = _header.size
+        end = offset + instructions * 4
+        if len(data) < end:
+            raise ValueError("Truncated program")
+        opcodes = array("H")
+        opcodes.frombytes(data[offset:end])
+        if sys.byteorder != "little":
+            opcodes.byteswap()
+        offset = end
+
+        try:
+            constants = []
+            for _ in range(constant_count):
+                constant, offset = _unpack_constant(data, offset)
+                constants.append(constant)
+            names = []
+            for _ in range(name_count):
+                name, offset = _unpack_string(data, offset)
+                names.append(name)
+            functions = []
+            for _ in range(function_count):
+                name, offset = _unpack_string(data, offset)
+                (arity,) = _arity.unpack_from(data, offset)
+                offset += _arity.size
+                functions.append(get_operator_index(resolve_symbolic_name(name, arity)))
+        except struct.error:
+            raise ValueError("Truncated program") from None
+
+        opcodes[1::2] = array(
+            "H",
+            [
+                functions[argument] if opcode in call_opcode_set else argument
+                for opcode, argument in zip(opcodes[0::2], opcodes[1::2])
+            ],
+        )
+        return cls(opcodes, tuple(constants), tuple(names), max_stack_depth, temp_count)
+
+    def __len__(self):
+        """Number of instructions"""
+        return len(self.opcodes) // 2
+
+    def __repr__(self):
+        return (
+            f"Program({len(self)} instructions, {len(self.constants)} constants, "
+            f"max_stack_depth={self.max_stack_depth})"
+        )
+
+
+# =========================
+# Serialization
+#
+# Everything is little-endian:
+#   header:    magic, format version, then the counts of instructions, constants, names and
+#              functions, max_stack_depth, and temp_count
+#   opcodes:   (opcode, argument) pairs of unsigned shorts; CALL arguments index the
+#              functions table below, rather than the process-wide operator table
+#   constants: a type byte (i or f), then an int (length-prefixed two's complement bytes,
+#              since python ints are unbounded) or a double
+#   names:     length-prefixed utf-8 variable names
+#   functions: length-prefixed utf-8 names, as they appear in entity_mapping or math,
+#              each followed by the arity it was called with (an unsigned int)
+# =========================
+
+MAGIC = b"SYPG"
+FORMAT_VERSION = 2  # 2: arities are 4 bytes, for variadic calls
+
+_header = struct.Struct("<4sHIIIIII")
+_length = struct.Struct("<H")
+_arity = struct.Struct("<I")
+_float = struct.Struct("<d")
+
+
+def symbolic_name(token: Callable) -> str:
+    """The name `token` can be looked up by: its entity_mapping key, or its name in math"""
+    key = _operator_key(token)
+    # a call of a variadic function is named after the function
+    variadic_key = (*key[:2], None, *key[3:])
+    for name, entity in entity_mapping.items():
+        # by key, since e.g. entity_mapping's neg wraps the neg that enrich emits
+        if isinstance(entity, Callable) and _operator_key(entity) in (key, variadic_key):
+            return name
+    function = unwrap(token.function)
+    if getattr(math, getattr(function, "__name__", ""), None) is function:
+        return function.__name__
+    raise ValueError(f"{render(token)} has no symbolic name, so it can't be serialized")
+
+
+def resolve_symbolic_name(name: str, arity: int) -> Callable:
+    entity = get_entity(name) if name.isidentifier() or name in entity_mapping else None
+    if type(entity) is Function and entity.arity is None:
+        return called_with(entity, arity)
+    if not isinstance(entity, Callable) or entity.arity != arity:
+        raise ValueError(f"Unknown function {name!r} (with {arity} arguments)")
+    return entity
+
+
+def _pack_string(string: str) -> bytes:
+    encoded = string.encode("utf-8")
+    return _length.pack(len(encoded)) + encoded
+
+
+def _unpack_string(data: memoryview, offset: int) -> tuple[str, int]:
+    (length,) = _length.unpack_from(data, offset)
+    offset += _length.size
+    if len(data) < offset + length:
+        raise ValueError("Truncated program")
+    return str(data[offset : offset + length], "utf-8"), offset + length
+
+
+def _pack_constant(constant: int | float) -> bytes:
+    if type(constant) is float:
+        return b"f" + _float.pack(constant)
+    encoded = constant.to_bytes(constant.bit_length() // 8 + 1, "little", signed=True)
+    return b"i" + _length.pack(len(encoded)) + encoded
+
+
+def _unpack_constant(data: memoryview, offset: int) -> tuple[int | float, int]:
+    tag = data[offset : offset + 1].tobytes()
+    offset += 1
+    if tag == b"f":
+        (value,) = _float.unpack_from(data, offset)
+        return value, offset + _float.size
+    if tag == b"i":
+        (length,) = _length.unpack_from(data, offset)
+        offset += _length.size
+        if len(data) < offset + length:
+            raise ValueError("Truncated program")
+        return int.from_bytes(
+            data[offset : offset + length], "little", signed=True
+        ), offset + length
+    raise ValueError(f"Unknown constant type {tag!r}")
+
+
+def eval_program(program: Program, variables: Mapping[str, int | float] | None = None):
+    """
+    Evaluate a Program, like eval_rpn does for RPN tokens.
+    The stack is preallocated at program.max_stack_depth, and `sp` points just past its top.
+    """
+    if program.names:
+        if variables is None:
+            raise NameError(f"Unbound variables: {', '.join(program.names)}")
+        try:
+            values = [variables[name] for name in program.names]
+        except KeyError as e:
+            raise NameError(f"Unbound variable {e}") from None
+
+    constants = program.constants
+    functions = operator_functions
+    stack = [None] * program.max_stack_depth
+    sp = 0
+    temps = [None] * program.temp_count
+
+    opcodes = iter(program.opcodes)
+    for opcode, argument in zip(opcodes, opcodes):
+        if opcode == PUSH_CONST:
+            stack[sp] = constants[argument]
+            sp += 1
+        elif opcode == CALL2:
+            sp -= 1
+            stack[sp - 1] = functions[argument](stack[sp - 1], stack[sp])
+        elif opcode == LOAD_VAR:
+            stack[sp] = values[argument]
+            sp += 1
+        elif opcode == CALL1:
+            stack[sp - 1] = functions[argument](stack[sp - 1])
+        elif opcode == LOAD:
+            stack[sp] = temps[argument]
+            sp += 1
+        elif opcode == STORE:
+            temps[argument] = stack[sp - 1]
+        else:
+            arity = operator_table[argument].arity
+            sp -= arity
+            stack[sp] = functions[argument](*stack[sp : sp + arity])
+            sp += 1
+
+    return stack[0]
@@ -0,0 +1,167 @@
+"""
+# program_cache.py
+#
+# A file of serialized Programs (see Program.to_bytes), keyed on normalized expression text,
+# so that processes can share a formula set without each of them parsing it again.
+# Readers mmap the file: opening it only checks the header, and each lookup deserializes
+# just the one Program it finds, through a hash index at the end of the file.
+#
+#    In [1]: write_cache("formulas.sypc", ["2 * x + 1", "sqrt(x) / y"])
+#    Out[1]: 2
+#    In [2]: cache = ProgramCache("formulas.sypc")
+#    In [3]: cache.compile(" 2 * x  + 1")({"x": 3})  # not parsed: normalizes to "2 * x + 1"
+#    Out[3]: 7
+#
+# File layout (little-endian):
+#   header:  magic, format version, flags (how the programs were compiled), index slot
+#            count, entry count, index offset
+#   records: key length, program length, utf-8 normalized key, serialized program
+#   index:   open addressing table of (key hash, record offset), an offset of 0 being empty
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from typing import Iterable
+
+from compiler import CompiledExpression, compile_uncached
+from program import Program
+
+
+MAGIC = b"SYPC"
+FORMAT_VERSION = 2  # 2: holds version 2 programs
+
+# header flags
+OPTIMIZED = 1
+CSE = 2
+
+_header = struct.Struct("<4sHHIIQ")
+_record = struct.Struct("<II")
+_slot = struct.Struct("<QQ")
+
+
+def normalize(source: str) -> str:
+    """
+    The key for `source`: with runs of whitespace collapsed to one space, and none at the ends.
+    (Removing whitespace altogether could change the meaning: "1e - 5" isn't "1e-5")
+    """
+    return " ".join(source.split())
+
+
+def key_hash(key: bytes) -> int:
+    # stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def write_cache(path, sources: Iterable[str], optimize: bool = False, cse: bool = False) -> int:
+    """
+    Compile `sources` and write them to a cache file at `path`, replacing it atomically,
+    so that processes with the old file open keep reading the old file.
+    Sources that fail to compile are left out. Returns how many programs were written.
+    """
+    records = {}  # normalized key -> serialized program
+    for source in sources:
+        key = normalize(source)
+        try:
+            if key not in records:
+                program = compile_uncached(source, optimize, "program", cse).program
+                records[key] = program.to_bytes()
+        except Exception:
+            continue
+
+    slot_count = 8
+    while slot_count < 2 * len(records):
+        slot_count *= 2
+    slots = [(0, 0)] * slot_count
+
+    chunks = []
+    offset = _header.size
+    for key, data in records.items():
+        encoded = key.encode("utf-8")
+        chunks.append(_record.pack(len(encoded), len(data)) + encoded + data)
+        position = key_hash(encoded) & (slot_count - 1)
+        while slots[position][1]:
+            position = (position + 1) & (slot_count - 1)
+        slots[position] = (key_hash(encoded), offset)
+        offset += len(chunks[-1])
+
+    flags = (OPTIMIZED if optimize else 0) | (CSE if cse else 0)
+    header = _header.pack(MAGIC, FORMAT_VERSION, flags, slot_count, len(records), offset)
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("wb", dir=directory, delete=False) as file:
+        file.write(header)
+        file.writelines(chunks)
+        file.writelines(_slot.pack(*slot) for slot in slots)
+    os.replace(file.name, path)
+    return len(records)
+
+
+class ProgramCache:
+    """Read-only view of a cache file written by write_cache"""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _header.size:
+            self.close()
+            raise ValueError(f"{path}: not a program cache")
+        magic, version, flags, slot_count, entries, index_offset = _header.unpack_from(self._map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path}: not a program cache")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path}: unsupported program cache version {version}")
+        self.optimize = bool(flags & OPTIMIZED)
+        self.cse = bool(flags & CSE)
+        self._slot_count = slot_count
+        self._entries = entries
+        self._index_offset = index_offset
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, source: str) -> Program | None:
+        """The cached Program for `source`, or None"""
+        encoded = normalize(source).encode("utf-8")
+        wanted = key_hash(encoded)
+        mask = self._slot_count - 1
+        position = wanted & mask
+        while True:
+            stored_hash, offset = _slot.unpack_from(
+                self._map, self._index_offset + position * _slot.size
+            )
+            if not offset:
+                return None
+            if stored_hash == wanted:
+                key_length, program_length = _record.unpack_from(self._map, offset)
+                start = offset + _record.size
+                if self._map[start : start + key_length] == encoded:
+                    start += key_length
+                    return Program.from_bytes(self._map[start : start + program_length])
+            position = (position + 1) & mask
+
+    def compile(self, source: str) -> CompiledExpression:
+        """Like compiler.compile_uncached, but skips parsing whatever is in the file"""
+        program = self.lookup(source)
+        if program is None:
+            self.misses += 1
+            return compile_uncached(source, self.optimize, "program", self.cse)
+        self.hits += 1
+        return CompiledExpression.from_program(source, program)
+
+    def __contains__(self, source: str) -> bool:
+        return self.lookup(source) is not None
+
+    def __len__(self):
+        return self._entries
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
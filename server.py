@@ -0,0 +1,413 @@
+"""
+# server.py
+#
+# An asyncio evaluation server, speaking a line protocol over TCP or a Unix socket,
+# and a client for it that doubles as a load generator.
+#
+# Protocol: each request is one line, and each gets one response line, in request order
+# (so clients can pipeline: send many requests without waiting for each response).
+#    2 * (3 + 4)                                   ->  OK 14
+#    {"expression": "2 * x", "variables": {"x": 4}}  ->  OK 8
+#    3 +                                           ->  ERR ValueError: Not enough operands for +
+#    :stats                                        ->  OK {"requests": 3, ..., "latency_ms": {...}}
+#
+# Requests from every connection go into one bounded queue. A batcher takes whatever has
+# queued up (up to max_batch requests) and evaluates it as a micro-batch, through a shared
+# compile cache, or on a process pool with workers > 0. When the queue is full, connections
+# stop reading, so that clients are slowed down by TCP flow control instead of by memory.
+#
+#    $ shunting-yard serve --port 7000 &
+#    $ shunting-yard load --port 7000 --connections 8 --requests 100000 formulas.txt
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Mapping
+
+import compiler
+from batch import _init_worker
+from budget import Budget
+from compiler import CompileCache
+
+
+DEFAULT_MAX_BATCH = 256
+DEFAULT_QUEUE_SIZE = 4096
+# responses a connection may have outstanding before it stops reading requests
+DEFAULT_MAX_PIPELINE = 1024
+# longest request line, in bytes
+LINE_LIMIT = 2**20
+LATENCY_SAMPLES = 10_000
+
+STATS_COMMAND = ":stats"
+
+
+def percentiles(samples: Iterable[float], points=(50, 90, 99)) -> dict[str, float]:
+    """Nearest-rank percentiles (and the max) of `samples`; zeros if there aren't any"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {**{f"p{point}": 0.0 for point in points}, "max": 0.0}
+    result = {}
+    for point in points:
+        rank = max(1, -(-point * len(ordered) // 100))  # ceil
+        result[f"p{point}"] = ordered[rank - 1]
+    result["max"] = ordered[-1]
+    return result
+
+
+def format_response(value, error: Exception | None) -> str:
+    if error is None:
+        try:
+            return f"OK {value}"
+        except ValueError as e:
+            # an int with more digits than str() will print (see sys.get_int_max_str_digits)
+            error = e
+    return f"ERR {type(error).__name__}: {error}"
+
+
+def parse_request(line: str) -> tuple[str, Mapping | None]:
+    """A request line -> (expression, variables)"""
+    if not line.startswith("{"):
+        return line, None
+    request = json.loads(line)
+    if not isinstance(request, dict) or not isinstance(request.get("expression"), str):
+        raise ValueError('expected {"expression": ..., "variables": {...}}')
+    return request["expression"], request.get("variables")
+
+
+def evaluate_requests(
+    requests: list[tuple[str, Mapping | None]],
+    cache: CompileCache | None = None,
+    budget: Budget | None = None,
+) -> list[tuple[object, Exception | None]]:
+    """Evaluate a micro-batch; runs in the server process, or in a pool worker"""
+    if cache is None:
+        cache = compiler.cache
+    results = []
+    for source, variables in requests:
+        try:
+            results.append((cache.get(source).evaluate(variables, budget), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+class Request:
+    __slots__ = ("source", "variables", "future", "received")
+
+    def __init__(self, source: str, variables: Mapping | None, future: asyncio.Future):
+        self.source = source
+        self.variables = variables
+        self.future = future
+        self.received = time.perf_counter()
+
+
+class EvaluationServer:
+    def __init__(
+        self,
+        cache: CompileCache | None = None,
+        workers: int = 0,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        max_pipeline: int = DEFAULT_MAX_PIPELINE,
+        cache_size: int | None = None,
+        budget: Budget | None = None,
+    ):
+        """
+        cache:      compile cache for in-process evaluation (default: compiler.cache)
+        workers:    evaluate batches on this many worker processes; 0 evaluates them here
+        cache_size: compile cache size for each worker process
+        budget:     limits on each request's evaluation (see budget.py); None is no limit
+        """
+        self.cache = cache if cache is not None else compiler.cache
+        self.budget = budget
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_pipeline = max_pipeline
+        self.queue: asyncio.Queue[Request] = asyncio.Queue(queue_size)
+        self.pool = None
+        if workers:
+            self.pool = ProcessPoolExecutor(
+                workers, initializer=_init_worker, initargs=(cache_size,)
+            )
+        # bounds the batches a pool has queued, so they wait here instead, where we can see them
+        self._batch_slots = asyncio.Semaphore(max(1, 2 * workers))
+        self._servers: list[asyncio.Server] = []
+        self._connections: set[asyncio.StreamWriter] = set()
+        self._batcher: asyncio.Task | None = None
+
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # seconds, most recent requests
+
+    # -------------
+    # Starting and stopping
+    # -------------
+
+    async def start_tcp(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.Server:
+        """Listen on TCP; port 0 picks a free port (see server.sockets)"""
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=LINE_LIMIT)
+        return self._started(server)
+
+    async def start_unix(self, path: str) -> asyncio.Server:
+        server = await asyncio.start_unix_server(self.handle_connection, path, limit=LINE_LIMIT)
+        return self._started(server)
+
+    def _started(self, server: asyncio.Server) -> asyncio.Server:
+        self._servers.append(server)
+        if self._batcher is None:
+            self._batcher = asyncio.create_task(self._run_batches())
+        return server
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+        # wait_closed waits for every connection to finish, so finish them
+        for writer in list(self._connections):
+            writer.close()
+        for server in self._servers:
+            await server.wait_closed()
+        if self._batcher is not None:
+            self._batcher.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # -------------
+    # Connections
+    # -------------
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # futures for this connection's responses, in request order
+        responses: asyncio.Queue[asyncio.Future | None] = asyncio.Queue(self.max_pipeline)
+        responder = asyncio.create_task(self._write_responses(responses, writer))
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # longer than LINE_LIMIT: there's no telling where the next request starts
+                    await responses.put(self._resolved(None, ValueError("Request too long")))
+                    break
+                if not line:
+                    break
+                await responses.put(await self._submit(line.decode("utf-8", "replace").strip()))
+        except ConnectionError:
+            pass
+        finally:
+            await responses.put(None)
+            await responder
+            self._connections.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _submit(self, line: str) -> asyncio.Future:
+        if line == STATS_COMMAND:
+            return self._resolved(json.dumps(self.stats()), None)
+        try:
+            source, variables = parse_request(line)
+        except ValueError as e:
+            return self._resolved(None, e)
+        future = asyncio.get_running_loop().create_future()
+        # waits while the queue is full, so this connection stops reading: backpressure
+        await self.queue.put(Request(source, variables, future))
+        return future
+
+    def _resolved(self, value, error: Exception | None) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result((value, error))
+        return future
+
+    async def _write_responses(self, responses: asyncio.Queue, writer: asyncio.StreamWriter):
+        try:
+            while (future := await responses.get()) is not None:
+                value, error = await future
+                writer.write(format_response(value, error).encode("utf-8") + b"\n")
+                if responses.empty():
+                    # flush once we've caught up with the pipeline, rather than per response
+                    await writer.drain()
+        except ConnectionError:
+            # the client went away; let the reader side notice and wind down
+            while await responses.get() is not None:
+                pass
+
+    # -------------
+    # Micro-batching
+    # -------------
+
+    async def _run_batches(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.batches += 1
+
+            if self.pool is None:
+                self._finish(
+                    batch, evaluate_requests(self._arguments(batch), self.cache, self.budget)
+                )
+                # let connections queue up the next batch
+                await asyncio.sleep(0)
+            else:
+                await self._batch_slots.acquire()
+                asyncio.create_task(self._run_pooled(batch))
+
+    async def _run_pooled(self, batch: list[Request]):
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(
+                    self.pool, evaluate_requests, self._arguments(batch), None, self.budget
+                )
+            except Exception as e:
+                # e.g. a worker died
+                results = [(None, e)] * len(batch)
+            self._finish(batch, results)
+        finally:
+            self._batch_slots.release()
+
+    @staticmethod
+    def _arguments(batch: list[Request]) -> list[tuple[str, Mapping | None]]:
+        return [(request.source, request.variables) for request in batch]
+
+    def _finish(self, batch: list[Request], results: list):
+        now = time.perf_counter()
+        for request, result in zip(batch, results):
+            self.requests += 1
+            if result[1] is not None:
+                self.errors += 1
+            self.latencies.append(now - request.received)
+            if not request.future.done():
+                request.future.set_result(result)
+
+    def stats(self) -> dict:
+        latency = percentiles(self.latencies)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "queued": self.queue.qsize(),
+            "latency_ms": {point: seconds * 1000 for point, seconds in latency.items()},
+            "cache": self.cache.stats() if self.pool is None else None,
+        }
+
+
+# =========================
+# Client / load generator
+# =========================
+
+
+class Client:
+    """One connection to an EvaluationServer"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect_tcp(cls, host: str = "127.0.0.1", port: int = 0) -> "Client":
+        return cls(*await asyncio.open_connection(host, port, limit=LINE_LIMIT))
+
+    @classmethod
+    async def connect_unix(cls, path: str) -> "Client":
+        return cls(*await asyncio.open_unix_connection(path, limit=LINE_LIMIT))
+
+    async def request(self, line: str) -> str:
+        """Send one request line, and wait for its response line"""
+        return (await self.pipeline([line]))[0]
+
+    async def evaluate(self, source: str, variables: Mapping | None = None) -> str:
+        if variables is not None:
+            return await self.request(json.dumps({"expression": source, "variables": variables}))
+        return await self.request(source)
+
+    async def pipeline(self, lines: list[str]) -> list[str]:
+        """Send every request before reading any response"""
+        self.writer.write("".join(line + "\n" for line in lines).encode("utf-8"))
+        await self.writer.drain()
+        return [await self._read_response() for _ in lines]
+
+    async def stats(self) -> dict:
+        response = await self.request(STATS_COMMAND)
+        return json.loads(response.removeprefix("OK "))
+
+    async def _read_response(self) -> str:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        return line.decode("utf-8").rstrip("\n")
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def generate_load(
+    connect,
+    sources: list[str],
+    requests: int,
+    connections: int = 8,
+    depth: int = 64,
+) -> dict:
+    """
+    Send `requests` requests (cycling through `sources`) over `connections` connections,
+    each keeping up to `depth` requests in flight, and report throughput and latency
+    as the client saw it. `connect` is a coroutine function returning a Client.
+    """
+    if not sources:
+        raise ValueError("No expressions to send")
+    latencies = []
+    errors = 0
+
+    async def run_connection(share: range):
+        nonlocal errors
+        client = await connect()
+        in_flight = asyncio.Semaphore(depth)
+        sent = deque()  # send times of the requests awaiting a response
+
+        async def send():
+            for index in share:
+                await in_flight.acquire()
+                sent.append(time.perf_counter())
+                client.writer.write(sources[index % len(sources)].encode("utf-8") + b"\n")
+                if len(sent) >= depth or index == share[-1]:
+                    await client.writer.drain()
+
+        sender = asyncio.create_task(send())
+        try:
+            for _ in share:
+                response = await client._read_response()
+                latencies.append(time.perf_counter() - sent.popleft())
+                in_flight.release()
+                if not response.startswith("OK"):
+                    errors += 1
+            await sender
+        finally:
+            sender.cancel()
+            await client.close()
+
+    shares = [range(start, requests, connections) for start in range(connections)]
+    start = time.perf_counter()
+    await asyncio.gather(*(run_connection(share) for share in shares if share))
+    seconds = time.perf_counter() - start
+    latency = percentiles(latencies)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": seconds,
+        "requests_per_second": requests / seconds if seconds else 0.0,
+        "latency_ms": {point: value * 1000 for point, value in latency.items()},
+    }
@@ -5,8 +5,32 @@
 # cf. https://en.wikipedia.org/wiki/Shunting_yard_algorithm
 """
 
-from typing import Iterable
-from entities import Special, Operator, Function, Entity
+from typing import Iterable, Iterator, Mapping, Sequence
+
+from budget import Budget, Meter
+from entities import (
+    ParseError,
+    Special,
+    Operator,
+    Function,
+    Variable,
+    Entity,
+    called_with,
+    render,
+    token_kinds,
+    special_kinds,
+    NUMBER,
+    VARIABLE,
+    OPERATOR,
+    FUNCTION,
+    PAREN_LEFT,
+    PAREN_RIGHT,
+    COMMA,
+    PAUSE,
+    SPECIAL,
+    STORE,
+    LOAD,
+)
 # from tokenizer import tokenize, enrich
 
 
@@ -23,8 +47,20 @@ def is_right_paren(token):
     return token is Special.PAREN_RIGHT
 
 
+def is_comma(token):
+    return token is Special.COMMA
+
+
 def is_number(token):
-    return type(token) in [float, int]
+    return type(token) in (float, int)
+
+
+def is_variable(token):
+    return type(token) is Variable
+
+
+def is_operand(token):
+    return is_number(token) or is_variable(token)
 
 
 def is_function(token):
@@ -35,6 +71,10 @@ def is_operator(token):
     return type(token) is Operator
 
 
+# below every operator's precedence
+FLOOR = -1
+
+
 def get_rpn_tokens(input_tokens: Iterable[Entity]) -> Iterable[Entity]:
     """
     cf. https://mathcenter.oxford.emory.edu/site/cs171/shuntingYardAlgorithm/
@@ -57,68 +97,252 @@ def get_rpn_tokens(input_tokens: Iterable[Entity]) -> Iterable[Entity]:
         or has the same precedence as the operator on the top of the stack and is left associative --
         continue to pop the stack until this is not true. Then, push the incoming operator.
     At the end of the expression, pop and print all operators on the stack. (No parentheses should remain.)
+
+    A comma pops and prints the stack down to the '(' of its call. Every call counts its
+    arguments: variadic functions (arity None) are printed as one call with that many, and
+    other functions must be given exactly their arity. Those errors are ParseErrors, without
+    a position (locate_rpn_tokens gives them the function's).
     """
     stack = []  # contains operators, functions, and parens
+    # the precedence of each entry in `stack`. Parens and functions are a FLOOR that
+    # operators never pop past, so popping only ever has to compare two ints.
+    levels = []
+    # how many commas each open call has had, innermost last
+    counts = []
+    previous = None  # the kind of the last token, other than a PAUSE
+    # a variadic function that was just pushed: the next token has to be its '('
+    bare = None
 
     for token in input_tokens:
-        if is_number(token):
+        kind = token_kinds.get(type(token))
+        if kind == SPECIAL:
+            kind = special_kinds[token]
+
+        if bare is not None:
+            if kind == PAREN_LEFT:
+                bare = None
+            elif kind != PAUSE:
+                raise ParseError(f"{render(bare)} needs its arguments in parentheses")
+
+        if kind == NUMBER or kind == VARIABLE:
             yield token
+        elif kind == OPERATOR:
+            # Prefix unary operators (neg) haven't seen their operand yet,
+            # so there is nothing to their left that they could bind tighter than.
+            if token.unary != "left":
+                # pop while the top of the stack has
+                #   higher precedence than the incoming operator,
+                #   or the same precedence and the incoming operator is left associative
+                threshold = token.precedence + token.right_associative
+                while levels and levels[-1] >= threshold:
+                    levels.pop()
+                    yield stack.pop()
+            stack.append(token)
+            levels.append(token.precedence)
+        elif kind == PAREN_LEFT:
+            if stack and type(stack[-1]) is Function:
+                counts.append(0)
             stack.append(token)
-        elif is_function(token):
+            levels.append(FLOOR)
+        elif kind == FUNCTION:
             # push function onto the stack until we get done w/ the parens
             # fn ( a, b , ... )
+            if token.arity is None:
+                bare = token
             stack.append(token)
-        elif is_left_paren(token):
-            stack.append(token)
-        elif is_right_paren(token):
+            levels.append(FLOOR)
+        elif kind == PAREN_RIGHT:
             # discard ')' token, pop + discard stack symbols until we see '('
-            while stack and not is_left_paren(stack[-1]):
+            while stack and stack[-1] is not Special.PAREN_LEFT:
+                levels.pop()
                 yield stack.pop()
-            if stack and is_left_paren(stack[-1]):
-                # discard left paren (IDK about enforcing balance)
-                stack.pop()
-                #
+            if not stack:
+                raise ValueError("Mismatched parens: unexpected ')'")
+            # discard left paren
+            levels.pop()
+            stack.pop()
             # if there's a function left at the top of the stack, pop + discard that
             # e.g sin(a)
             # (this one comes from wiki description I believe)
-            if stack and is_function(stack[-1]):
+            if stack and type(stack[-1]) is Function:
+                levels.pop()
+                function = stack.pop()
+                # f() has no arguments, f(a) has one, f(a, b) two, ...
+                count = counts.pop() + (previous != PAREN_LEFT)
+                if function.arity is None:
+                    # one call, with every argument
+                    function = called_with(function, count)
+                elif count != function.arity:
+                    raise ParseError(
+                        f"{render(function)} takes {function.arity} "
+                        f"argument{'s' * (function.arity != 1)}, not {count}"
+                    )
+                yield function
+        elif kind == COMMA:
+            # a comma ends one function argument: flush it, but leave the '(' alone
+            while stack and stack[-1] is not Special.PAREN_LEFT:
+                levels.pop()
                 yield stack.pop()
-        elif is_operator(token):
-            # and has either
-            #   higher precedence than the operator on the top of the stack,
-            #   or has the same precedence as the operator on the top of the stack and is right associative,
-            #   or if the stack is empty,
-            #   or if the top of the stack is "(" (a floor)
-            # push it on the stack.
-
-            if (
-                not stack
-                or is_left_paren(stack[-1])
-                or precedence(token) > precedence(stack[-1])
-                or (precdence(token) == precedence(stack[-1]) and token.associativity == "left")
-            ):
-                stack.append(token)
-            else:
-                top_op = stack[-1]
-                # TODO The rest of this
-
-            # and has either
-            #   lower precedence than the operator on the top of the stack,
-            #   or has the same precedence as the operator on the top of the stack and is left associative
-            # -- continue to pop the stack until this is not true.
-            # -- Then, push the incoming operator.
+            if len(stack) > 1 and type(stack[-2]) is Function:
+                counts[-1] += 1
+        elif kind == PAUSE:
+            yield token
+            continue
+        else:
+            raise ValueError(f"Unexpected token: {token!r}")
+        previous = kind
 
-        elif type(token) is Operator or type(token) is Special:
-            # TODO: Consider Special type operators (paren, comma)
-            # TODO: Fancy shit with precedence and parens
-            pass
+    if bare is not None:
+        raise ParseError(f"{render(bare)} needs its arguments in parentheses")
 
     # finally, once there are no more tokens, pop the rest of the stack:
     while stack:
-        yield stack.pop()
+        token = stack.pop()
+        if token is Special.PAREN_LEFT:
+            raise ValueError("Mismatched parens: unclosed '('")
+        yield token
+
+
+def locate_rpn_tokens(
+    input_tokens: Iterable[Entity], source_tokens: Sequence, origins: list[int]
+) -> Iterator[Entity]:
+    """
+    get_rpn_tokens, for enriched `source_tokens` (tokenizer.Tokens, one per input token),
+    keeping track of where everything came from: appends the index of the source token each
+    RPN token came from to `origins`, and raises errors as ParseErrors with a position.
+
+    Worked out from outside get_rpn_tokens (like instrumentation.rpn_with_high_water), so
+    that parsing without positions doesn't pay for them: get_rpn_tokens finishes with one
+    token before it pulls the next, operands are output as soon as they're pulled, and
+    operators and functions are output in reverse order of being pushed.
+    """
+    pulled = -1  # index of the last token pulled
+    pending = None  # an operator or function that gets pushed once the stack is popped for it
+    callables = []  # indices of the operators and functions on get_rpn_tokens' stack
+    parens = []  # indices of the unclosed '('s
+    exhausted = False
+
+    def pull():
+        nonlocal pulled, pending, exhausted
+        for pulled, token in enumerate(input_tokens):
+            if pending is not None:
+                callables.append(pending)
+                pending = None
+            if type(token) is Operator or type(token) is Function:
+                pending = pulled
+            elif token is Special.PAREN_LEFT:
+                parens.append(pulled)
+            elif token is Special.PAREN_RIGHT and parens:
+                parens.pop()
+            yield token
+        if pending is not None:
+            callables.append(pending)
+            pending = None
+        exhausted = True
 
+    try:
+        for token in get_rpn_tokens(pull()):
+            if type(token) is Operator or type(token) is Function:
+                origins.append(callables.pop())
+            else:
+                origins.append(pulled)
+            yield token
+    except ParseError as e:
+        if e.position is not None:
+            raise
+        # get_rpn_tokens' own, about a function it was about to output: the top of its stack
+        raise ParseError(e.message, source_tokens[callables[-1]].start) from None
+    except ValueError as e:
+        # at the end, the only thing that can go wrong is the innermost '(' never closing
+        index = parens[-1] if exhausted and parens else pulled
+        raise ParseError(str(e), source_tokens[index].start) from None
+
+
+def eval_rpn(
+    input_rpn_tokens: Iterable[Entity],
+    variables: Mapping[str, int | float] | None = None,
+    budget: Budget | None = None,
+) -> int | float:
+    """
+    Evaluate a sequence of RPN tokens
+        [3, 4, add] -> 7
+        [Variable("x"), 4, add], {"x": 3} -> 7
+
+    Numbers (and the values bound to Variables) are pushed onto a stack;
+    Operators and Functions pop `arity` arguments off of it and push their result.
+    Store and Load save and restore values in temp slots (see optimizer.py).
+
+    With a `budget`, evaluation raises budget.BudgetExceeded rather than going over it.
+    """
+    if budget is not None:
+        return _eval_rpn_metered(input_rpn_tokens, variables, budget.meter())
+    stack = []
+    temps = {}
+    for token in input_rpn_tokens:
+        kind = token_kinds.get(type(token))
+        if kind == NUMBER:
+            stack.append(token)
+        elif kind == OPERATOR or kind == FUNCTION:
+            arity = token.arity
+            if len(stack) < arity:
+                raise ValueError(f"Not enough operands for {render(token)}")
+            if arity == 2:
+                right = stack.pop()
+                stack[-1] = token.function(stack[-1], right)
+            elif arity == 1:
+                stack[-1] = token.function(stack[-1])
+            else:
+                args = stack[len(stack) - arity :]
+                del stack[len(stack) - arity :]
+                stack.append(token.function(*args))
+        elif kind == VARIABLE:
+            if variables is None or token.name not in variables:
+                raise NameError(f"Unbound variable {token.name!r}")
+            stack.append(variables[token.name])
+        elif kind == LOAD:
+            stack.append(temps[token.slot])
+        elif kind == STORE:
+            if not stack:
+                raise ValueError("Nothing to store")
+            temps[token.slot] = stack[-1]
+        else:
+            raise ValueError(f"Unexpected token in RPN: {token!r}")
+
+    if len(stack) != 1:
+        raise ValueError(f"Malformed RPN: {len(stack)} values left on the stack")
+    return stack[0]
+
+
+def _eval_rpn_metered(
+    input_rpn_tokens: Iterable[Entity], variables: Mapping[str, int | float] | None, meter: Meter
+) -> int | float:
+    """eval_rpn, with every operation applied through `meter` (kept apart to keep eval_rpn lean)"""
+    stack = []
+    temps = {}
+    for token in input_rpn_tokens:
+        kind = token_kinds.get(type(token))
+        if kind == NUMBER:
+            stack.append(token)
+        elif kind == OPERATOR or kind == FUNCTION:
+            arity = token.arity
+            if len(stack) < arity:
+                raise ValueError(f"Not enough operands for {render(token)}")
+            args = stack[len(stack) - arity :]
+            del stack[len(stack) - arity :]
+            stack.append(meter.call(token, args))
+        elif kind == VARIABLE:
+            if variables is None or token.name not in variables:
+                raise NameError(f"Unbound variable {token.name!r}")
+            stack.append(variables[token.name])
+        elif kind == LOAD:
+            stack.append(temps[token.slot])
+        elif kind == STORE:
+            if not stack:
+                raise ValueError("Nothing to store")
+            temps[token.slot] = stack[-1]
+        else:
+            raise ValueError(f"Unexpected token in RPN: {token!r}")
 
-def eval_rpn(input_rpn_tokens: list[Entity]) -> int | float:
-    # evaluate the RPN stack
-    # [3, 4, add] -> 7
-    raise NotImplementedError
+    if len(stack) != 1:
+        raise ValueError(f"Malformed RPN: {len(stack)} values left on the stack")
+    return stack[0]
@@ -0,0 +1,55 @@
+"""
+# tests of evaluating many expressions across worker processes
+"""
+
+import pytest
+
+from batch import BatchResult, evaluate_many
+
+
+SOURCES = ["1 + 2", "3 *", "2 ^ 10", "x * 2", "1 / 0", "(4 - 1) * 3"]
+
+
+def summarize(results):
+    return [(r.index, r.value, type(r.error).__name__ if r.error else None) for r in results]
+
+
+EXPECTED = [
+    (0, 3, None),
+    (1, None, "ValueError"),
+    (2, 1024, None),
+    (3, None, "NameError"),
+    (4, None, "ZeroDivisionError"),
+    (5, 9, None),
+]
+
+
+@pytest.mark.parametrize("workers, chunksize", [(0, 4), (2, 1), (2, 4)])
+def test_evaluate_many_in_order(workers, chunksize):
+    results = list(evaluate_many(SOURCES, workers=workers, chunksize=chunksize))
+    assert summarize(results) == EXPECTED
+    assert [r.source for r in results] == SOURCES
+
+
+def test_evaluate_many_unordered():
+    results = evaluate_many(SOURCES * 10, workers=2, chunksize=3, ordered=False)
+    assert sorted(r.index for r in results) == list(range(len(SOURCES) * 10))
+
+
+def test_evaluate_many_variables():
+    results = list(evaluate_many(["x * 2", "x + y"], workers=0, variables={"x": 3, "y": 4}))
+    assert results == [BatchResult(0, "x * 2", 6, None), BatchResult(1, "x + y", 7, None)]
+
+
+def test_evaluate_many_streams():
+    # an endless input: results have to come back before we've read all of it
+    def endless():
+        n = 0
+        while True:
+            yield f"{n} + 1"
+            n += 1
+
+    results = evaluate_many(endless(), workers=2, chunksize=8)
+    first = [next(results) for _ in range(100)]
+    results.close()
+    assert [r.value for r in first] == list(range(1, 101))
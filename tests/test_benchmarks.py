@@ -0,0 +1,95 @@
+"""
+# tests of the benchmark corpus generator, and baseline comparison
+"""
+
+import json
+import random
+
+import pytest
+
+from benchmarks.corpus import PROFILES, Profile, VARIABLES, generate_corpus, rewrite
+from compiler import compile_uncached
+from benchmarks.suite import compare, main, parse_threshold, threshold_for
+from shunting_yard import get_rpn_tokens, eval_rpn
+from tokenizer import scan, enrich
+
+
+def test_corpus_is_seeded():
+    profile = PROFILES["functions"]
+    assert generate_corpus(profile, 20, seed=3) == generate_corpus(profile, 20, seed=3)
+    assert generate_corpus(profile, 20, seed=3) != generate_corpus(profile, 20, seed=4)
+
+
+@pytest.mark.parametrize("name", list(PROFILES))
+def test_corpus_parses(name):
+    for source in generate_corpus(PROFILES[name], 50, seed=1):
+        rpn = list(get_rpn_tokens(enrich(scan(source))))
+        try:
+            eval_rpn(rpn, VARIABLES)
+        except (ArithmeticError, ValueError):
+            # e.g. 1 % (2 - 2)
+            pass
+
+
+def test_corpus_profile_shape():
+    profile = Profile(terms=5, nesting=0, operators={"+": 1}, functions=0, unary_minus=1)
+    (source,) = generate_corpus(profile, 1)
+    tokens = source.split()
+    assert tokens[1::2] == ["+"] * 4
+    assert all(operand.startswith("-") for operand in tokens[::2])
+    (source,) = generate_corpus(Profile(terms=2, operators={"^": 1}, nesting=0), 1)
+    assert "^" in source
+
+
+def result(seconds):
+    return {"seconds": seconds}
+
+
+def report(**results):
+    return {"version": 1, "results": {name: result(s) for name, s in results.items()}}
+
+
+def test_compare():
+    current = report(a=1.2, b=1.2, c=1.0)
+    baseline = report(a=1.0, b=1.0, d=1.0)
+    comparisons = compare(current, baseline, threshold=0.1, overrides=[("b", 0.5)])
+    assert [c.name for c in comparisons] == ["a", "b"]
+    assert [c.regressed for c in comparisons] == [True, False]
+    assert comparisons[0].change == pytest.approx(0.2)
+
+
+def test_threshold_for():
+    overrides = [("deep/*", 0.5), ("*/eval_rpn", 0.2)]
+    assert threshold_for("deep/scan", 0.1, overrides) == 0.5
+    assert threshold_for("deep/eval_rpn", 0.1, overrides) == 0.2
+    assert threshold_for("short/scan", 0.1, overrides) == 0.1
+    assert parse_threshold("deep/*=0.25") == ("deep/*", 0.25)
+
+
+def test_main(tmp_path):
+    output = tmp_path / "results.json"
+    argv = ["--profile", "short", "--count", "10", "--repeat", "1"]
+    assert main(argv + ["--output", str(output)]) == 0
+    results = json.loads(output.read_text())
+    assert set(results["results"]) == {
+        "short/scan",
+        "short/enrich",
+        "short/get_rpn_tokens",
+        "short/eval_rpn",
+        "short/end_to_end",
+    }
+
+    # a baseline that was impossibly fast
+    for value in results["results"].values():
+        value["seconds"] = 1e-12
+    output.write_text(json.dumps(results))
+    assert main(argv + ["--baseline", str(output)]) == 1
+    assert main(argv + ["--baseline", str(output), "--threshold", "1e20"]) == 0
+
+
+@pytest.mark.parametrize("name", sorted(PROFILES))
+def test_rewrite_is_the_same_formula(name):
+    rng = random.Random(0)
+    for source in generate_corpus(PROFILES[name], 20, seed=1):
+        written = rewrite(source, rng)
+        assert compile_uncached(written).fingerprint == compile_uncached(source).fingerprint
@@ -0,0 +1,157 @@
+"""
+# tests of evaluation cost estimates and budgets
+"""
+
+import math
+import time
+
+import pytest
+
+from budget import Budget, BudgetExceeded, Cost, UNKNOWN_BITS, estimate_cost
+from compiler import compile_uncached
+from optimizer import eliminate_common_subexpressions, optimize
+from shunting_yard import get_rpn_tokens, eval_rpn
+from tokenizer import scan, enrich
+
+
+def to_rpn(source):
+    return list(get_rpn_tokens(enrich(scan(source))))
+
+
+def evaluate(source, variables=None, **limits):
+    return eval_rpn(to_rpn(source), variables, Budget(**limits))
+
+
+@pytest.mark.parametrize(
+    "source, bits",
+    [
+        ("2 ^ 100", 101),
+        ("2 ^ 100 * 3", 102),
+        ("1 + 1 + 1 + 1", 3),
+        ("factorial(20)", 87),  # 20 ^ 20, where 20! is 62 bits
+        ("comb(1000, 500)", 1001),
+        ("-(2 ^ 10) % 7", 11),
+        ("2.5 ^ 5000", 13),  # floats are cheap, however big: only 5000 counts
+        ("2 ^ 0.5 * 3", 2),
+        ("prod(2 ^ 10, 2 ^ 20, 4)", 33),
+        ("max(2 ^ 10, 2 ^ 20, 4) + 1", 21),
+    ],
+)
+def test_estimate_bits(source, bits):
+    assert estimate_cost(to_rpn(source)).max_bits == bits
+
+
+@pytest.mark.parametrize(
+    "source", ["2 ^ 100 * 3 - 7", "factorial(30) % 1000", "comb(40, 20)", "prod(7, 9 ^ 9, 11)"]
+)
+def test_estimate_is_an_upper_bound(source):
+    assert estimate_cost(to_rpn(source)).max_bits >= eval_rpn(to_rpn(source)).bit_length()
+
+
+def test_estimate_pathological():
+    assert estimate_cost(to_rpn("9 ^ 9 ^ 9")).max_bits > 10**9
+    assert estimate_cost(to_rpn("factorial(10 ^ 6)")).max_bits > 10**7
+    assert estimate_cost(to_rpn("(2 ^ 4000) ^ (2 ^ 4000)")).max_bits == math.inf
+
+
+def test_estimate_variables():
+    rpn = to_rpn("x ^ 3 + y")
+    assert estimate_cost(rpn, {"x": 2**10, "y": 1}).max_bits == 31
+    # just the 3
+    assert estimate_cost(rpn, {"x": 2.0**10, "y": 1}).max_bits == 2
+    assert estimate_cost(rpn).max_bits == 3 * UNKNOWN_BITS + 1
+
+
+def test_estimate_cse():
+    rpn, _ = eliminate_common_subexpressions(to_rpn("(2 ^ 50) * (2 ^ 50) * (2 ^ 50)"))
+    assert estimate_cost(rpn) == Cost(operations=3, max_bits=151)
+
+
+def test_check():
+    budget = Budget(max_operations=2, max_bits=64)
+    budget.check(estimate_cost(to_rpn("2 ^ 63 - 1")))
+    with pytest.raises(BudgetExceeded) as raised:
+        budget.check(estimate_cost(to_rpn("2 ^ 64")))
+    assert raised.value.limit == "bits"
+    with pytest.raises(BudgetExceeded) as raised:
+        budget.check(estimate_cost(to_rpn("1 + 2 + 3 + 4")))
+    assert raised.value.limit == "operations"
+
+
+# =========================
+# Runtime budgets
+# =========================
+
+
+def test_within_budget():
+    assert evaluate("2 ^ 100 * 3", max_bits=128, max_operations=2, max_seconds=1) == 3 * 2**100
+    assert evaluate("x ^ -2", {"x": 10**30}, max_bits=64) == 1e-60
+    assert evaluate("factorial(x)", {"x": 20}, max_bits=128) == math.factorial(20)
+
+
+@pytest.mark.parametrize(
+    "source",
+    ["9 ^ 9 ^ 9", "factorial(10 ^ 6)", "comb(10 ^ 7, 5 * 10 ^ 6)", "(2 ^ 1000) * (2 ^ 1000)"],
+)
+def test_bits_exceeded_before_the_work(source):
+    start = time.perf_counter()
+    with pytest.raises(BudgetExceeded) as raised:
+        evaluate(source, max_bits=1024)
+    assert raised.value.limit == "bits"
+    assert raised.value.value > raised.value.maximum == 1024
+    assert time.perf_counter() - start < 0.5
+
+
+def test_bits_checked_after_functions_without_rules():
+    with pytest.raises(BudgetExceeded, match="lcm gave a"):
+        evaluate("lcm(2 ^ 40 + 1, 2 ^ 40 - 1)", max_bits=64)
+
+
+def test_operations_exceeded():
+    assert evaluate("1 + 2 + 3", max_operations=2) == 6
+    with pytest.raises(BudgetExceeded) as raised:
+        evaluate("1 + 2 + 3 + 4", max_operations=2)
+    assert raised.value.limit == "operations"
+
+
+def test_seconds_exceeded():
+    source = " + ".join(["sqrt(2)"] * 2000)
+    with pytest.raises(BudgetExceeded) as raised:
+        evaluate(source, max_seconds=0)
+    assert raised.value.limit == "seconds"
+
+
+def test_downgrade():
+    assert evaluate("2 ^ 100 / 2 ^ 90", max_bits=64, downgrade=True) == 1024.0
+    assert evaluate("factorial(100) / factorial(99)", max_bits=64, downgrade=True) == (
+        pytest.approx(100)
+    )
+    # too big for a float too: quickly an OverflowError, rather than slowly a huge int
+    with pytest.raises(OverflowError):
+        evaluate("9 ^ 9 ^ 9", max_bits=1024, downgrade=True)
+
+
+def test_compiled_expression_budget():
+    for backend in ("stack", "python", "program"):
+        expression = compile_uncached("x ^ y", backend=backend)
+        assert expression({"x": 2, "y": 10}, Budget(max_bits=16)) == 1024
+        with pytest.raises(BudgetExceeded):
+            expression({"x": 2, "y": 100}, Budget(max_bits=16))
+    assert expression.cost({"x": 2, "y": 100}).max_bits == 101
+
+
+def test_optional_arguments():
+    # perm(n) is perm(n, n)
+    expression = compile_uncached("perm(5)")
+    assert expression.cost().max_bits == 12
+    assert expression(budget=Budget(max_bits=64)) == 120
+    assert evaluate("perm(30)", max_bits=64, downgrade=True) == pytest.approx(math.factorial(30))
+
+
+def test_folding_respects_budget():
+    start = time.perf_counter()
+    rpn, stats = optimize(to_rpn("9 ^ 9 ^ 9 + factorial(10 ^ 6) + 2 ^ 10"))
+    assert time.perf_counter() - start < 0.5
+    # 9 ^ 9 and 10 ^ 6 fold, 2 ^ 10 too, but the rest is left for evaluation
+    assert stats.folded == 3
+    assert estimate_cost(rpn).operations == 4
@@ -0,0 +1,107 @@
+"""
+# tests of the command line interface
+"""
+
+import io
+import json
+
+import pytest
+
+from budget import DEFAULT_BUDGET, Budget
+from cli import budget_from_args, main, parse_args
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("3 + 4\n\n2 ^ 10\n3 +\nx * 2\n", encoding="utf-8")
+    return str(path)
+
+
+def run(*argv):
+    out = io.StringIO()
+    code = main(["eval", *argv], out=out)
+    return code, out.getvalue().splitlines()
+
+
+def test_eval(input_file):
+    assert run("--on-error", "skip", input_file) == (0, ["7", "1024"])
+
+
+def test_eval_null(input_file):
+    assert run("--on-error", "null", input_file) == (0, ["7", "1024", "null", "null"])
+
+
+def test_eval_fail(input_file, capsys):
+    assert run(input_file) == (1, ["7", "1024"])
+    assert "line 4" in capsys.readouterr().err
+
+
+def test_eval_json(input_file):
+    code, lines = run("--json", "--on-error", "null", "--var", "x=2.5", input_file)
+    records = [json.loads(line) for line in lines]
+    assert [r["line"] for r in records] == [1, 3, 4, 5]
+    assert [r["result"] for r in records] == [7, 1024, None, 5.0]
+    assert "error" in records[2]
+
+
+def test_unwritable_results(tmp_path, capsys):
+    path = tmp_path / "input.txt"
+    path.write_text("2 ^ 20000\n(0 - 8) ^ 0.5\n1e308 * 10\n1e308 * 10 - 1e308 * 10\n2 + 3\n")
+    # too many digits for str(): an error, under the --on-error policy
+    assert run("--on-error", "null", str(path)) == (
+        0,
+        ["null", str((0 - 8) ** 0.5), "inf", "nan", "5"],
+    )
+    assert run("--on-error", "skip", str(path))[1][0] == str((0 - 8) ** 0.5)
+    assert run(str(path)) == (1, [])
+    assert "line 1" in capsys.readouterr().err
+
+    # JSON has no complex numbers, inf or nan
+    code, lines = run("--json", "--on-error", "null", str(path))
+    records = [json.loads(line) for line in lines]
+    assert [r["result"] for r in records] == [None, str((0 - 8) ** 0.5), "inf", "nan", 5]
+    assert "Exceeds the limit" in records[0]["error"]
+
+
+def test_eval_rpn(input_file):
+    assert run("--rpn", "--on-error", "skip", input_file) == (
+        0,
+        ["3 4 +", "2 10 ^", "3 +", "x 2 *"],
+    )
+
+
+def test_eval_workers(input_file):
+    assert run("--workers", "2", "--on-error", "skip", input_file) == (0, ["7", "1024"])
+
+
+def test_bad_variable(input_file):
+    with pytest.raises(SystemExit):
+        run("--var", "x", input_file)
+
+
+def test_serve_and_load_arguments():
+    args = parse_args(["serve", "--unix", "/tmp/s.sock", "--workers", "2"])
+    assert (args.command, args.unix, args.workers) == ("serve", "/tmp/s.sock", 2)
+    assert budget_from_args(args) == DEFAULT_BUDGET
+    args = parse_args(["serve", "--max-bits", "0", "--max-seconds", "0.5", "--downgrade"])
+    assert budget_from_args(args) == Budget(
+        DEFAULT_BUDGET.max_operations, None, 0.5, downgrade=True
+    )
+    args = parse_args(["load", "--port", "7001", "--depth", "8", "a.txt"])
+    assert (args.port, args.depth, args.files) == (7001, 8, ["a.txt"])
+    with pytest.raises(SystemExit):
+        parse_args(["serve", "--port", "7001", "--unix", "/tmp/s.sock"])
+
+
+def test_csv(tmp_path, capsys):
+    path = tmp_path / "orders.csv"
+    path.write_text("price,qty\n9.5,3\n20,1\n", encoding="utf-8")
+    out = io.StringIO()
+    argv = ["csv", str(path), "--formula", "total=price * qty * (1 + tax)", "--var", "tax=0.5"]
+    assert main(argv, out=out) == 0
+    assert out.getvalue().splitlines() == ["total", "42.75", "30.0"]
+    assert main(["csv", str(path), "--formula", "total=price * tax"], out=io.StringIO()) == 1
+    assert "Unbound variable 'tax'" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        parse_args(["csv", str(path), "--formula", "total"])
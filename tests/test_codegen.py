@@ -0,0 +1,65 @@
+"""
+# tests of compiling RPN programs to python functions
+"""
+
+import pytest
+
+from codegen import compile_rpn
+from compiler import CompileCache, compile_uncached
+from shunting_yard import get_rpn_tokens, eval_rpn
+from tokenizer import scan, enrich
+
+
+def rpn(source):
+    return list(get_rpn_tokens(enrich(scan(source))))
+
+
+@pytest.mark.parametrize(
+    "input",
+    [
+        "3 + 4",
+        "2 + 3 * 4 - 5",
+        "8 / 2 / 2",
+        "2 ^ 3 ^ 2",
+        "-2 ^ 2",
+        "(-2) ^ 2",
+        "-----5",
+        "3--5",
+        "7 % 4 + abs(-3) * sqrt(16)",
+        "x * (y - x) ^ 2",
+        "atan2(y, x) + factorial(4)",
+    ],
+)
+def test_codegen_matches_eval_rpn(input):
+    tokens = rpn(input)
+    variables = {"x": 1.5, "y": -2}
+    assert compile_rpn(tokens)(variables) == eval_rpn(tokens, variables)
+
+
+def test_codegen_source():
+    function = compile_rpn(rpn("2 * x + x"))
+    assert "return 2 * _v0 + _v0" in function.source
+
+
+def test_codegen_unbound_variables():
+    function = compile_rpn(rpn("x + y"))
+    with pytest.raises(NameError):
+        function({"x": 1})
+    with pytest.raises(NameError):
+        function()
+
+
+def test_python_backend():
+    expr = compile_uncached("x ^ 2 + 1", backend="python")
+    assert expr.backend == "python"
+    assert expr({"x": 3}) == 10
+    assert expr.with_backend("stack")({"x": 3}) == 10
+    assert CompileCache(backend="python").get("1 + 2").backend == "python"
+    with pytest.raises(ValueError):
+        compile_uncached("1", backend="llvm")
+
+
+def test_python_backend_falls_back_when_too_deep():
+    expr = compile_uncached(" + ".join(["x"] * 100_000), backend="python")
+    assert expr.backend == "stack"
+    assert expr({"x": 1}) == 100_000
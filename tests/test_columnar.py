@@ -0,0 +1,125 @@
+"""
+# tests of evaluating groups of same-shaped expressions as numpy columns
+"""
+
+import math
+
+import pytest
+
+from columnar import evaluate_group, evaluate_grouped, group_expressions
+from compiler import compile_uncached
+from shunting_yard import eval_rpn
+
+np = pytest.importorskip("numpy")
+
+VARIABLES = {"a": 1.5, "n": 3, "c": 2, "x": 3}
+
+
+def scalar(source, variables=VARIABLES):
+    try:
+        return eval_rpn(compile_uncached(source).rpn, variables), None
+    except Exception as e:
+        return None, e
+
+
+def assert_same_as_scalar(sources, variables=VARIABLES):
+    results = evaluate_grouped(sources, variables)
+    assert [result.index for result in results] == list(range(len(sources)))
+    assert [result.source for result in results] == sources
+    for result in results:
+        value, error = scalar(result.source, variables)
+        assert type(result.error) is type(error)
+        assert type(result.value) is type(value)
+        if isinstance(value, float) and not math.isnan(value):
+            assert result.value == pytest.approx(value, rel=1e-14)
+        elif not isinstance(value, float):
+            assert result.value == value
+
+
+def test_grouping():
+    sources = ["a * 1.07 ^ n - c", "x + 1", "a * 1.5 ^ n - c", "a*2.0^n-c", "a * 2 ^ n - c"]
+    groups, errors = group_expressions(sources)
+    assert errors == []
+    # spacing doesn't matter, but literals' types do
+    assert [[row[0] for row in group.rows] for group in groups] == [[0, 2, 3], [1], [4]]
+    assert list(groups[0].column_texts(0)) == ["1.07", "1.5", "2.0"]
+    assert groups[0].columns == ((1, float),)
+
+
+def test_grouped_matches_scalar():
+    sources = [f"a * {1 + rate / 100} ^ n - c" for rate in range(50)]
+    sources += [f"x % {k} + {k} / 2" for k in range(10)]
+    sources += [f"max({k}, x, 2.5) - min(x, {k})" for k in range(10)]
+    sources += [f"sin({k} * pi) * exp(-{k})" for k in range(10)]
+    sources += [f"{k} ^ {k} - 2 ^ {k}" for k in range(10)]
+    sources += [f"log(x * {k + 1}, 2) + log(x + {k})" for k in range(10)]
+    assert_same_as_scalar(sources)
+
+
+def test_rows_that_fall_back():
+    assert_same_as_scalar(
+        [
+            # division by zero, and sqrt of a negative, raise for just those rows
+            "1 / (3 - 3)",
+            "1 / (4 - 3)",
+            "sqrt(2 - x)",
+            "sqrt(5 - x)",
+            # integer % 0
+            "x % 0",
+            "x % 2",
+            # a nan or inf that doesn't reach the result still raises
+            "atan(1 / 0.0)",
+            "atan(1 / 2.0)",
+            # integers that are too big for int64: the whole group
+            "2 ^ 99 * 3",
+            "2 ^ 9 * 3",
+            # integer ^ a negative integer is a float
+            "2 ^ -1",
+            "2 ^ -3",
+            # python's max keeps the larger argument's type
+            "max(2, 2.5)",
+            "max(3, 2.5)",
+            # no exact ufunc
+            "floor(2.5 * x)",
+            "floor(3.5 * x)",
+            "factorial(3)",
+            "factorial(4)",
+            # unbound variables
+            "y + 1",
+            "y + 2",
+        ]
+    )
+
+
+def test_errors_in_order():
+    results = evaluate_grouped(["1 +", "2 *", "3 + 4", "(5"], {})
+    assert [result.value for result in results] == [None, None, 7, None]
+    assert [type(result.error).__name__ for result in results] == [
+        "ValueError",
+        "ValueError",
+        "NoneType",
+        "ParseError",
+    ]
+
+
+def test_singletons_use_eval_rpn(monkeypatch):
+    import columnar
+
+    def fail(*args):
+        raise AssertionError("vectorized a group of one")
+
+    monkeypatch.setattr(columnar, "_evaluate_columns", fail)
+    (group,), _ = group_expressions(["x * 2.5"])
+    assert [result.value for result in evaluate_group(group, {"x": 2})] == [5.0]
+
+
+def test_groups_are_vectorized(monkeypatch):
+    import columnar
+
+    def fail(*args):
+        raise AssertionError("fell back to eval_rpn")
+
+    monkeypatch.setattr(columnar, "eval_rpn", fail)
+    sources = [f"a * {1 + rate / 100} ^ n - c" for rate in range(5)] + ["x % 2", "x % 3"]
+    values = [result.value for result in evaluate_grouped(sources, VARIABLES)]
+    assert values == [pytest.approx(1.5 * (1 + rate / 100) ** 3 - 2) for rate in range(5)] + [1, 0]
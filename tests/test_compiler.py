@@ -0,0 +1,157 @@
+"""
+# tests of compile() and the LRU compile cache
+"""
+
+import contextlib
+
+import pytest
+
+import instrumentation
+from entities import ParseError
+from compiler import CompileCache, CompiledExpression, compile, compile_document, evaluate_stream
+
+
+def test_compile_evaluates():
+    expr = compile("2 + 3 * 4")
+    assert isinstance(expr, CompiledExpression)
+    assert expr.render() == "2 3 4 * +"
+    assert expr() == 14
+    # it's reusable
+    assert expr.evaluate() == 14
+
+
+def test_compile_is_cached():
+    assert compile("1 + 2 + 3") is compile("1 + 2 + 3")
+
+
+def test_cache_counters():
+    cache = CompileCache(maxsize=2)
+    first = cache.get("1 + 1")
+    assert cache.stats() == {"hits": 0, "misses": 1, "evictions": 0, "size": 1, "maxsize": 2}
+    assert cache.get("1 + 1") is first
+    cache.get("2 + 2")
+    cache.get("3 + 3")  # evicts "1 + 1", the least recently used
+    assert "1 + 1" not in cache
+    assert cache.stats() == {"hits": 1, "misses": 3, "evictions": 1, "size": 2, "maxsize": 2}
+
+
+def test_cache_recency():
+    cache = CompileCache(maxsize=2)
+    cache.get("1")
+    cache.get("2")
+    cache.get("1")  # "2" is now the oldest
+    cache.get("3")
+    assert "1" in cache
+    assert "2" not in cache
+
+
+def test_cache_resize():
+    cache = CompileCache(maxsize=3)
+    for source in ["1", "2", "3"]:
+        cache.get(source)
+    cache.resize(1)
+    assert len(cache) == 1
+    assert "3" in cache
+    assert cache.evictions == 2
+
+
+def test_cache_disabled():
+    cache = CompileCache(maxsize=0)
+    assert cache.get("1 + 1") is not cache.get("1 + 1")
+    assert len(cache) == 0
+
+
+def test_cache_does_not_store_errors():
+    cache = CompileCache()
+    with pytest.raises(ValueError):
+        cache.get("1 + 2)")
+    assert len(cache) == 0
+    assert cache.misses == 1
+
+
+def test_compile_with_variables():
+    expr = compile("x * (y + x)")
+    assert expr.variables == ("x", "y")
+    assert expr({"x": 2, "y": 3}) == 10
+    assert expr({"x": 1, "y": 1}) == 2
+
+
+def test_spans():
+    expression = compile("2 * (x + 10) - sqrt(y)")
+    assert expression.spans[:3] == ((0, 1), (5, 6), (9, 11))
+    assert expression.locate()[-3:] == [("y", "y"), ("sqrt", "sqrt"), ("-", "-")]
+    assert expression.with_backend("python").spans == expression.spans
+    # the optimizer rewrites the RPN, so its tokens don't come from anywhere in particular
+    assert CompileCache(optimize=True).get("2 * (x + 10)").spans is None
+
+
+def test_parse_error_positions():
+    with pytest.raises(ParseError, match="unclosed '\\(' at position 4"):
+        compile("2 * (3 + (4 - 1)")
+    with pytest.raises(ParseError) as raised:
+        compile("1 + 2 $ 3")
+    assert raised.value.position == 6
+
+
+@pytest.mark.parametrize("instrumented", [False, True])
+def test_compile_document(instrumented):
+    document = "2 * x + 1\n\n# not a formula\n  sqrt(x); (1 + 2\nx ^ 2 ;"
+    context = instrumentation.instrumented() if instrumented else contextlib.nullcontext()
+    with context as instruments:
+        results = list(compile_document(document, backend="python"))
+    if instruments is not None:
+        # the document was scanned in one go: its expressions aren't scanned again
+        assert instruments.stages["scan"].calls == 0
+        assert instruments.stages["get_rpn_tokens"].calls == 4
+    assert [line for line, _ in results] == [1, 3, 4, 4, 5]
+    first, error, root, unclosed, square = (result for _, result in results)
+    assert first.source == "2 * x + 1"
+    assert first({"x": 3}) == 7
+    assert isinstance(error, ParseError)
+    assert error.position == document.index("#")
+    assert root.source == "sqrt(x)"
+    assert root({"x": 9}) == 3.0
+    # spans are into the expression's own source; error positions into the document
+    assert root.locate() == [("x", "x"), ("sqrt", "sqrt")]
+    assert unclosed.position == document.index("(1")
+    assert square({"x": 5}) == 25
+    assert [str(result) for _, result in compile_document("1 + 2")] == [str(compile("1 + 2"))]
+
+
+def test_evaluate_stream():
+    chunks = ["2 * (3", " + 4) - sq", "rt(x", ") ^ 1e", "+1"]
+    assert evaluate_stream(chunks, {"x": 4}) == 2 * (3 + 4) - 2.0**10
+    assert evaluate_stream(iter(["1 + 1"])) == 2
+    with pytest.raises(ValueError):
+        evaluate_stream(["2 *", " (3"])
+
+
+def test_fingerprint():
+    assert compile("x*2 + 1").fingerprint == compile("1 + 2 × (x)").fingerprint
+    assert compile("x*2 + 1").fingerprint != compile("x*2 - 1").fingerprint
+    assert compile("x*2 + 1").with_backend("python").fingerprint == compile("x*2 + 1").fingerprint
+
+
+def test_canonical_cache():
+    cache = CompileCache(canonical=True)
+    first = cache.get("3 + x")
+    assert cache.get("x + 3") is first
+    assert cache.get("(x)+3") is first
+    assert cache.get("x + 3.0") is not first
+    assert cache.get("3 + x") is first
+    assert cache.stats()["canonical_hits"] == 2
+    assert (cache.hits, cache.misses) == (1, 4)
+    # without canonical=True, every spelling is its own entry
+    assert "canonical_hits" not in CompileCache().stats()
+    assert CompileCache().get("x + 3") is not CompileCache().get("3 + x")
+
+
+def test_canonical_cache_eviction():
+    cache = CompileCache(maxsize=2, canonical=True)
+    cache.get("x + 1")
+    cache.get("x + 2")
+    cache.get("x + 3")
+    assert cache.get("1 + x") is not None
+    assert cache.canonical_hits == 0
+    cache.clear()
+    assert cache.stats()["canonical_hits"] == 0
@@ -0,0 +1,88 @@
+"""
+# tests of evaluating formulas over the columns of a CSV file, a chunk at a time
+"""
+
+import io
+
+import pytest
+
+from compiler import compile
+from csv_columns import evaluate_csv, read_columns, read_header
+
+np = pytest.importorskip("numpy")
+
+ROWS = [(1.5, 2, "eu"), (20, 1, "us"), (0.25, 17, "eu, west"), (3, 0, "ap")]
+FORMULAS = {"total": "price * qty * (1 + tax)", "ratio": "price / qty", "const": "2 + 3"}
+
+
+@pytest.fixture
+def orders(tmp_path):
+    path = tmp_path / "orders.csv"
+    lines = ["price, qty ,region"]
+    for price, qty, region in ROWS:
+        lines.append(f'{price},{qty},"{region}"')
+    lines.insert(3, "")  # a blank line
+    path.write_bytes(("\r\n".join(lines) + "\r\n").encode())
+    return path
+
+
+def evaluate(path, formulas=FORMULAS, **kwargs):
+    out = io.StringIO()
+    rows = evaluate_csv(path, formulas, out, {"tax": 0.5}, **kwargs)
+    return rows, out.getvalue().splitlines()
+
+
+@pytest.mark.filterwarnings("ignore:divide by zero")
+@pytest.mark.parametrize("chunk_bytes", [1, 7, 20, 1 << 20])
+def test_matches_scalar(orders, chunk_bytes):
+    rows, lines = evaluate(orders, chunk_bytes=chunk_bytes)
+    assert rows == len(ROWS)
+    assert lines[0] == "total,ratio,const"
+    for line, (price, qty, _) in zip(lines[1:], ROWS, strict=True):
+        expected = []
+        for source in FORMULAS.values():
+            variables = {"price": float(price), "qty": float(qty), "tax": 0.5}
+            try:
+                expected.append(float(compile(source)(variables)))
+            except ZeroDivisionError:
+                expected.append(float("inf"))
+        assert [float(value) for value in line.split(",")] == expected
+
+
+def test_read_columns_in_chunks(orders):
+    assert read_header(orders) == ["price", "qty", "region"]
+    chunks = list(
+        (rows, {name: column.tolist() for name, column in columns.items()})
+        for rows, columns in read_columns(orders, ["qty"], chunk_bytes=12)
+    )
+    assert len(chunks) > 1
+    assert sum(rows for rows, _ in chunks) == len(ROWS)
+    assert [qty for _, columns in chunks for qty in columns["qty"]] == [2, 1, 17, 0]
+
+
+def test_unbound_variables(orders):
+    with pytest.raises(NameError, match="'rate'"):
+        evaluate(orders, {"x": "price * rate"})
+    with pytest.raises(ValueError, match="no column 'rate'"):
+        list(read_columns(orders, ["rate"]))
+
+
+def test_bad_values(tmp_path):
+    path = tmp_path / "bad.csv"
+    path.write_text("x,y\n1,2\n3,4\n5,oops\n")
+    with pytest.raises(ValueError, match="chunk from line 4: could not convert string 'oops'"):
+        evaluate(path, {"sum": "x + y"}, chunk_bytes=4)
+    # columns that aren't used aren't parsed
+    assert evaluate(path, {"double": "x * 2"}) == (3, ["double", "2.0", "6.0", "10.0"])
+
+
+def test_edges(tmp_path):
+    path = tmp_path / "empty.csv"
+    path.write_text("x,y")
+    assert evaluate(path, {"x": "x"}) == (0, ["x"])
+    path.write_text("")
+    with pytest.raises(ValueError, match="no header"):
+        evaluate(path, {"x": "x"})
+    # a line longer than a chunk, and no newline at the end
+    path.write_text("x,y\n" + "1" * 50 + ",2\n3,4")
+    assert evaluate(path, {"y": "y"}, chunk_bytes=8) == (2, ["y", "2.0", "4.0"])
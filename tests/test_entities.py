@@ -0,0 +1,158 @@
+"""
+# tests of the entity registry: interning, arity introspection, rendering
+"""
+
+import math
+import operator
+
+import pytest
+
+import compiler
+from entities import (
+    Function,
+    Operator,
+    ParseError,
+    called_with,
+    entity_mapping,
+    get_entity,
+    introspect_arity,
+    register_function,
+    render,
+    render_tokens,
+    unregister,
+)
+from shunting_yard import eval_rpn, get_rpn_tokens
+from tokenizer import scan, enrich
+
+
+def evaluate(source, variables=None):
+    return eval_rpn(get_rpn_tokens(enrich(scan(source))), variables)
+
+
+def test_entities_are_interned():
+    assert get_entity("sin") is get_entity("sin")
+    assert get_entity("×") is get_entity("*")
+    assert get_entity("~") is get_entity("neg")
+    assert Operator(operator.mul) == get_entity("*")
+    assert Operator(operator.mul) is not get_entity("*")
+
+
+@pytest.mark.parametrize(
+    "name, arity",
+    [
+        ("sin", 1),
+        ("atan2", 2),
+        ("fma", 3),
+        ("log", None),
+        ("hypot", None),
+        ("gcd", None),
+        ("perm", None),
+    ],
+)
+def test_math_arity(name, arity):
+    assert get_entity(name).arity == arity
+
+
+def test_optional_arguments():
+    # log(x[, base]) and perm(n[, k]) are variadic, within their signatures
+    assert get_entity("log").arities == range(1, 3)
+    assert get_entity("perm").arities == range(1, 3)
+    assert evaluate("log(8, 2) + log(e)") == pytest.approx(4.0)
+    assert evaluate("perm(5, 2) + perm(5)") == 140
+    with pytest.raises(ParseError, match="log takes 1 to 2 arguments, not 3"):
+        evaluate("log(8, 2, 3)")
+
+
+def test_variadic_calls_are_interned():
+    ((rpn_max, count),) = [
+        (token, token.arity)
+        for token in get_rpn_tokens(enrich(scan("max(1, 2, 3)")))
+        if type(token) is Function
+    ]
+    assert count == 3
+    assert rpn_max is called_with(get_entity("max"), 3)
+    assert render(rpn_max) == "max"
+    assert called_with(get_entity("max"), 2) is not rpn_max
+
+
+def test_introspect_arity():
+    assert introspect_arity(lambda: 1) == 0
+    assert introspect_arity(lambda a, b, *, c: a) == 2
+    assert introspect_arity(lambda a, b=2, *, c: a) == range(1, 3)
+    assert introspect_arity(lambda *args: 1) is None
+    assert introspect_arity(max, default=3) == 3
+
+
+@pytest.mark.parametrize(
+    "source, expected",
+    [
+        ("sin(0) + cos(0)", 1.0),
+        ("2 * sin(pi / 2) ^ 2", 2.0),
+        ("log(e) + exp(0)", 2.0),
+        ("fma(2, 3, 4)", 10.0),
+        ("floor(2.5) + ceil(-2.5)", 0),
+        ("hypot(1, 2, 2) + gcd(12, 18, 8)", 5.0),
+        ("max(1, 5, -2) - min(4) * prod(1, 2, 3)", -19),
+        ("fsum(0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1)", 1.0),
+    ],
+)
+def test_math_functions(source, expected):
+    assert evaluate(source) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize(
+    "entity, expected",
+    [
+        (get_entity("×"), "*"),  # the first name registered
+        (get_entity("÷"), "/"),
+        (get_entity("~"), "neg"),
+        (get_entity("sin"), "sin"),
+        (Operator(operator.mul), "*"),  # not interned, but equal to something registered
+        (Function(math.gcd), "gcd"),
+    ],
+)
+def test_render(entity, expected):
+    assert render(entity) == expected
+
+
+def test_render_tokens():
+    rpn = get_rpn_tokens(enrich(scan("2 × -sin(x) ÷ 3")))
+    assert render_tokens(rpn) == "2 x sin neg * 3 /"
+
+
+@pytest.fixture
+def clamp():
+    function = register_function("clamp", lambda x, low, high: max(low, min(x, high)))
+    yield function
+    unregister("clamp")
+
+
+def test_register_function(clamp):
+    assert clamp.arity == 3
+    assert get_entity("clamp") is clamp
+    assert evaluate("clamp(x, 0, 10) * 2", {"x": 14}) == 20
+    assert render_tokens(get_rpn_tokens(enrich(scan("clamp(x, 0, 1)")))) == "x 0 1 clamp"
+    # all the backends go through the same registry
+    for backend in ("python", "program"):
+        assert compiler.compile_uncached("clamp(-3, 0, 1)", backend=backend)() == 0
+
+
+def test_register_function_errors(clamp):
+    with pytest.raises(ValueError, match="already defined"):
+        register_function("clamp", min)
+    with pytest.raises(ValueError, match="already defined"):
+        register_function("abs", min)
+    with pytest.raises(ValueError, match="Not a valid"):
+        register_function("+", min)
+    with pytest.raises(ValueError, match="Not a valid"):
+        register_function("2x", min)
+
+
+def test_register_function_arity():
+    try:
+        function = register_function("smallest", min, arity=2)
+        assert evaluate("smallest(3, 2)") == 2
+        assert entity_mapping["smallest"] is function
+    finally:
+        unregister("smallest")
+    assert "smallest" not in entity_mapping
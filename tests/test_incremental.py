@@ -0,0 +1,70 @@
+"""
+# tests of pushing input into the parser a piece at a time
+"""
+
+import pytest
+
+from entities import ParseError, render_tokens
+from incremental import IncrementalParser
+from shunting_yard import eval_rpn, get_rpn_tokens
+from tokenizer import enrich, scan
+
+
+SOURCE = "-2 * (x - -3) ^ 2 - atan2(1e+5, sin(pi)) / 4.5"
+
+
+def feed_all(chunks):
+    parser = IncrementalParser()
+    outputs = [parser.feed(chunk) for chunk in chunks]
+    outputs.append(parser.close())
+    return outputs
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, len(SOURCE)])
+def test_same_rpn_as_whole_input(size):
+    chunks = [SOURCE[start : start + size] for start in range(0, len(SOURCE), size)]
+    rpn = [token for output in feed_all(chunks) for token in output]
+    assert rpn == list(get_rpn_tokens(enrich(scan(SOURCE))))
+    assert eval_rpn(rpn, {"x": 1}) == eval_rpn(get_rpn_tokens(enrich(scan(SOURCE))), {"x": 1})
+
+
+def test_tokens_come_out_once_settled():
+    outputs = feed_all(["2 * 3", "5 + ", "4", ""])
+    assert [render_tokens(output) for output in outputs] == ["2", "35 *", "", "", "4 +"]
+    # parens only settle a function's operands once they close
+    outputs = feed_all(["sqrt(", "x", ")", " * 2"])
+    assert [render_tokens(output) for output in outputs] == ["", "", "x sqrt", "", "2 *"]
+
+
+def test_enrich_state_carries_across_feeds():
+    # whether a minus is a negation depends on what came before it, in an earlier feed
+    outputs = feed_all(["3 -", "-", "5", " - 1"])
+    assert render_tokens([token for output in outputs for token in output]) == "3 5 neg - 1 -"
+
+
+def test_errors():
+    parser = IncrementalParser()
+    parser.feed("1 + 2 ")
+    with pytest.raises(ParseError) as raised:
+        parser.feed("$ 3")
+    assert raised.value.position == 6
+    # a parser that has raised is done
+    assert parser.closed
+    with pytest.raises(ValueError, match="closed"):
+        parser.feed("4")
+
+    parser = IncrementalParser()
+    with pytest.raises(ValueError, match="unexpected '\\)'"):
+        parser.feed("(1 + 2)) ")
+    parser = IncrementalParser()
+    parser.feed("(1 + 2")
+    with pytest.raises(ValueError, match="unclosed"):
+        parser.close()
+
+
+def test_close():
+    parser = IncrementalParser()
+    assert parser.close() == []
+    assert parser.close() == []
+    with pytest.raises(ValueError, match="closed"):
+        parser.feed("1")
@@ -0,0 +1,134 @@
+"""
+# tests of the opt-in pipeline instrumentation
+"""
+
+import pytest
+
+import compiler
+import instrumentation
+from entities import ParseError
+from instrumentation import Event, Instruments, instrumented, rpn_with_high_water
+from shunting_yard import get_rpn_tokens
+from tokenizer import scan, enrich
+
+
+@pytest.fixture
+def instruments():
+    with instrumented() as instruments:
+        yield instruments
+
+
+def test_disabled_by_default():
+    assert compiler.instruments is None
+    expression = compiler.compile_uncached("1 + 2")
+    assert expression._evaluate.func.__name__ == "eval_rpn"
+
+
+def test_stage_timers(instruments):
+    expression = compiler.compile_uncached("sqrt(x) + 2 * (x - 1)", optimize=True, cse=True)
+    assert expression({"x": 4}) == 8.0
+    assert expression({"x": 9}) == 19.0
+    for stage in instrumentation.STAGES:
+        expected = 2 if stage == "evaluate" else 1
+        assert instruments.stages[stage].calls == expected, stage
+    assert instruments.stages["scan"].seconds > 0
+    assert instruments.tokens == 12
+    assert instruments.function_calls == {"sqrt": 2, "+": 2, "*": 2, "-": 2}
+
+
+@pytest.mark.parametrize(
+    "source, expected",
+    [
+        ("1", 0),
+        ("1 + 2 + 3", 1),
+        ("1 + 2 * (3 ^ 4)", 4),
+        ("sqrt(x) + 2 * (x - 1)", 4),
+        ("---1", 3),
+        ("atan2(1, (2))", 3),
+        ("2 ^ 2 ^ 2 ^ 2", 3),
+    ],
+)
+def test_stack_high_water(source, expected):
+    tokens = list(enrich(scan(source)))
+    rpn, high_water = rpn_with_high_water(tokens)
+    assert rpn == tuple(get_rpn_tokens(tokens))
+    assert high_water == expected
+    # the same, through locate_rpn_tokens
+    origins = []
+    assert rpn_with_high_water(tokens, list(scan(source)), origins) == (rpn, high_water)
+    assert len(origins) == len(rpn)
+
+
+def test_same_expression_as_uninstrumented(instruments):
+    # spans and ParseError positions included
+    source = "2 * (x + max(1, y))"
+    instrumented_expression = compiler.compile_uncached(source)
+    instrumentation.disable()
+    expression = compiler.compile_uncached(source)
+    instrumentation.enable(instruments)
+    assert instrumented_expression.rpn == expression.rpn
+    assert instrumented_expression.spans == expression.spans
+    assert instrumented_expression.locate() == expression.locate()
+    with pytest.raises(ParseError) as raised:
+        compiler.compile_uncached("2 * (3 + 4")
+    assert raised.value.position == 4
+    with pytest.raises(ParseError, match="sin takes 1 argument, not 2 at position 2"):
+        compiler.compile_uncached("1+sin(1, 2)")
+
+
+def test_hooks_and_errors(instruments):
+    events = []
+    instruments.add_hook(events.append)
+    with pytest.raises(ValueError):
+        compiler.compile_uncached("(1 + 2")
+    with pytest.raises(ZeroDivisionError):
+        compiler.compile("1 / 0")()
+
+    assert [(event.stage, event.error is None) for event in events] == [
+        ("scan", True),
+        ("enrich", True),
+        ("get_rpn_tokens", False),
+        ("scan", True),
+        ("enrich", True),
+        ("get_rpn_tokens", True),
+        ("build", True),
+        ("evaluate", False),
+    ]
+    assert isinstance(events[-1], Event)
+    assert events[-1].source == "1 / 0"
+    assert instruments.stages["evaluate"].errors == 1
+    # failed evaluations don't count as calls
+    assert not instruments.function_calls
+
+    instruments.remove_hook(events.append)
+    compiler.compile_uncached("1")
+    assert len(events) == 8
+
+
+def test_snapshot(instruments):
+    compiler.compile_uncached("abs(-2) * 3")()
+    lines = instruments.snapshot().splitlines()
+    assert 'shunting_yard_stage_calls_total{stage="scan"} 1' in lines
+    assert 'shunting_yard_stage_errors_total{stage="evaluate"} 0' in lines
+    assert "shunting_yard_tokens_total 7" in lines
+    assert "shunting_yard_stack_high_water 3" in lines
+    assert 'shunting_yard_calls_total{function="abs"} 1' in lines
+    assert all(len(line.split(" ")) == 2 for line in lines)
+
+    instruments.reset()
+    assert "shunting_yard_tokens_total 0" in instruments.snapshot().splitlines()
+
+
+def test_enable_disable():
+    compiler.compile("1 + 1")
+    instruments = instrumentation.enable(Instruments())
+    try:
+        assert compiler.instruments is instruments
+        # compiled before instrumentation was on, so it mustn't be served from the cache
+        assert "1 + 1" not in compiler.cache
+        compiler.compile("1 + 1")()
+        assert instruments.stages["evaluate"].calls == 1
+    finally:
+        assert instrumentation.disable() is instruments
+    assert compiler.instruments is None
+    assert "1 + 1" not in compiler.cache
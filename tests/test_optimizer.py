@@ -0,0 +1,235 @@
+"""
+# tests of the RPN optimizer
+"""
+
+import math
+
+import pytest
+
+from compiler import CompileCache, compile_uncached
+from entities import register_function, render_tokens, unregister
+from optimizer import (
+    CSEStats,
+    OptimizationStats,
+    canonicalize,
+    eliminate_common_subexpressions,
+    fingerprint,
+    optimize,
+)
+from shunting_yard import get_rpn_tokens, eval_rpn
+from tokenizer import scan, enrich
+
+
+def rpn(source):
+    return list(get_rpn_tokens(enrich(scan(source))))
+
+
+@pytest.mark.parametrize(
+    "input, expected",
+    [
+        ("2 + 3 * 4", "14"),
+        ("sqrt(2) * pi * x", f"{math.sqrt(2) * math.pi} x *"),
+        ("x * (2 ^ 10)", "x 1024 *"),
+        ("-----5", "-5"),
+        ("--x", "x"),
+        ("---x", "x neg"),
+        ("x - -(-y)", "x y -"),
+        ("x ^ 2", "x 2 ^"),  # x * x would be inf, not an OverflowError, for a huge float x
+        ("x ^ 1 + 1", "x 1 +"),
+        ("x ^ 2.0", "x 2.0 ^"),  # stays a float
+        ("(x + 1) ^ 2", "x 1 + 2 ^"),  # would double the work of x + 1
+        ("x / 0 + 1 / 0", "x 0 / 1 0 / +"),  # left for eval to raise
+    ],
+)
+def test_optimize(input, expected):
+    optimized, _ = optimize(rpn(input))
+    assert expected == render_tokens(optimized)
+
+
+def test_optimize_stats():
+    _, stats = optimize(rpn("sqrt(4) * pi * x - ---x ^ 1"))
+    assert stats == OptimizationStats(
+        folded=2, negations_collapsed=2, strength_reduced=1, removed=5
+    )
+
+
+@pytest.mark.parametrize(
+    "input",
+    [
+        "2 * x + 3 * 4",
+        "-----x * 2 ^ 3 ^ 2",
+        "x ^ 2 - y ^ 2",
+        "abs(-3) * x ^ 1 - 7 % 4",
+        "x % 3 / 2",
+    ],
+)
+def test_optimize_preserves_results(input):
+    original = rpn(input)
+    optimized, _ = optimize(original)
+    for x, y in [(3, 4), (-2.5, 0.5), (7, -1)]:
+        variables = {"x": x, "y": y}
+        assert eval_rpn(optimized, variables) == pytest.approx(eval_rpn(original, variables))
+
+
+@pytest.mark.parametrize("backend", ["stack", "python", "program"])
+def test_optimize_huge_floats(backend):
+    # float ** raises OverflowError, where float * would give inf
+    for source in ("x ^ 2", "2 * x ^ 2 + 1"):
+        for optimize_ in (False, True):
+            expr = compile_uncached(source, optimize=optimize_, backend=backend)
+            with pytest.raises(OverflowError):
+                expr({"x": 1e200})
+
+
+def test_optimize_keeps_ints_printable():
+    # 2 ^ 60000 is within FOLDING_BUDGET, but has more digits than str() prints
+    expr = compile_uncached("2 ^ 60000 * 2 ^ 60000 * 2 ^ 60000", optimize=True)
+    assert expr.render() == "2 60000 ^ 2 60000 ^ * 2 60000 ^ *"
+    assert expr.fingerprint
+    assert compile_uncached("2 ^ 14000", optimize=True).render() == str(2**14000)
+
+
+def test_optimize_deep_chain():
+    # flattening must not recurse once per operation
+    source = " + ".join(["x"] * 5000)
+    optimized, stats = optimize(rpn(source))
+    assert stats.removed == 0
+    assert eval_rpn(optimized, {"x": 1}) == 5000
+
+
+def test_compile_optimized():
+    expr = compile_uncached("2 * 3 * x", optimize=True)
+    assert expr.render() == "6 x *"
+    assert expr.optimization.folded == 1
+    assert CompileCache(optimize=True).get("x ^ 2")({"x": 3}) == 9
+
+
+@pytest.fixture
+def counter():
+    calls = []
+    register_function("tick", lambda: calls.append(None) or len(calls))
+    yield calls
+    unregister("tick")
+
+
+@pytest.mark.parametrize("backend", ["stack", "python", "program"])
+def test_zero_arguments(counter, backend):
+    # a call without arguments takes nothing off the stack, and isn't folded
+    expr = compile_uncached("5 * (tick() + 1)", optimize=True, backend=backend)
+    assert expr.render() == "5 tick 1 + *"
+    assert [expr(), expr()] == [10, 15]
+    assert compile_uncached("tick() - tick()", cse=True, backend=backend)() == -1
+
+
+def test_zero_arguments_vectorized(counter):
+    np = pytest.importorskip("numpy")
+    from vectorized import VectorizationFallbackWarning, eval_rpn_vectorized
+
+    with pytest.warns(VectorizationFallbackWarning):
+        result = eval_rpn_vectorized(rpn("x * (tick() + 1)"), {"x": np.arange(3)})
+    assert result.tolist() == [0, 2, 4]
+
+
+# =========================
+# Common subexpression elimination
+# =========================
+
+
+@pytest.mark.parametrize(
+    "input, expected",
+    [
+        ("sqrt(x / 3) * sqrt(x / 3) + abs(x / 3)", "x 3 / =$0 sqrt =$1 $1 * $0 abs +"),
+        ("(a + b) ^ 2 - (a + b)", "a b + =$0 2 ^ $0 -"),
+        ("x * x", "x x *"),  # leaves are as cheap to push as to load
+        ("x + 1.0 + (x + 1)", "x 1.0 + x 1 + +"),  # 1.0 and 1 aren't the same literal
+        ("x - y", "x y -"),
+    ],
+)
+def test_cse(input, expected):
+    eliminated, _ = eliminate_common_subexpressions(rpn(input))
+    assert expected == render_tokens(eliminated)
+
+
+def test_cse_stats():
+    _, stats = eliminate_common_subexpressions(rpn("sqrt(x / 3) * sqrt(x / 3) + abs(x / 3)"))
+    assert stats == CSEStats(deduplicated=3, slots=2)
+
+
+@pytest.mark.parametrize(
+    "input",
+    [
+        "(x * y + 1) * (x * y + 1) + (x * y + 1)",
+        "atan2(x - y, x - y) * (x - y) % 5",
+        "-(x + y) * -(x + y) - (x + y) ^ 2",
+        "sqrt(abs(x) + abs(y)) / sqrt(abs(x) + abs(y))",
+    ],
+)
+@pytest.mark.parametrize("backend", ["stack", "python", "program"])
+def test_cse_preserves_results(input, backend):
+    expected = compile_uncached(input)
+    eliminated = compile_uncached(input, backend=backend, cse=True)
+    assert eliminated.backend == backend
+    for x, y in [(3, 4), (-2.5, 0.5), (7, -1)]:
+        variables = {"x": x, "y": y}
+        assert eliminated(variables) == pytest.approx(expected(variables))
+
+
+def test_cse_deep_chain():
+    source = " + ".join(["(x * 2)"] * 5000)
+    eliminated, stats = eliminate_common_subexpressions(rpn(source))
+    assert stats == CSEStats(deduplicated=4999, slots=1)
+    assert eval_rpn(eliminated, {"x": 1}) == 10000
+
+
+def test_cse_after_optimize():
+    eliminated, _ = eliminate_common_subexpressions(optimize(rpn("(x + 2 * 3) * (x + 6)"))[0])
+    assert render_tokens(eliminated) == "x 6 + =$0 $0 *"
+    with pytest.raises(ValueError):
+        optimize(eliminated)
+    assert CompileCache(optimize=True, cse=True).get("(x + 1) * (x + 1)").render() == (
+        "x 1 + =$0 $0 *"
+    )
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ("3 + x", "x + 3"),
+        ("2 * x / y", "(x × 2) ÷ (y)"),
+        ("sin(a * b) + 1", "1 + sin((b * a))"),
+        ("(a + b) * (c + d)", "(d + c) * (b + a)"),
+        ("max(x, 1, y)", "max((x), 1, y)"),
+    ],
+)
+def test_fingerprint_same_formula(first, second):
+    assert fingerprint(rpn(first)) == fingerprint(rpn(second))
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ("x + 3", "x + 3.0"),  # numbers keep their type
+        ("x - 3", "3 - x"),
+        ("(a + b) + c", "a + (b + c)"),  # no regrouping
+        ("max(x, y)", "max(x, y, y)"),
+        ("atan2(x, y)", "atan2(y, x)"),
+        ("-x ^ 2", "(-x) ^ 2"),
+    ],
+)
+def test_fingerprint_different_formula(first, second):
+    assert fingerprint(rpn(first)) != fingerprint(rpn(second))
+
+
+@pytest.mark.parametrize("input", ["3 * x + y / 2", "(z * y) * x - 1", "hypot(x * 2, 3 + y)"])
+def test_canonicalize_preserves_results(input):
+    variables = {"x": 1.5, "y": -2, "z": 7}
+    canonical, digest = canonicalize(rpn(input))
+    assert eval_rpn(canonical, variables) == eval_rpn(rpn(input), variables)
+    assert digest == fingerprint(rpn(input)) == fingerprint(canonical)
+
+
+def test_canonicalize_errors():
+    with pytest.raises(ValueError, match="before eliminate_common_subexpressions"):
+        fingerprint(eliminate_common_subexpressions(rpn("(x + 1) * (x + 1)"))[0])
+    with pytest.raises(ValueError, match="Not enough operands"):
+        fingerprint(rpn("x")[:0] + rpn("1 + 2")[1:])
@@ -0,0 +1,154 @@
+"""
+# tests of the compact array-backed Program format
+"""
+
+import pytest
+
+from compiler import compile_uncached
+from entities import Operator, Function, render_tokens
+from program import Program, eval_program
+from shunting_yard import get_rpn_tokens, eval_rpn
+from tokenizer import scan, enrich
+
+
+def rpn(source):
+    return list(get_rpn_tokens(enrich(scan(source))))
+
+
+@pytest.mark.parametrize(
+    "input",
+    [
+        "3",
+        "x",
+        "2 + 3 * 4 - 5",
+        "2 ^ 3 ^ 2",
+        "-----5 + x",
+        "7 % 4 + abs(-3) * sqrt(16)",
+        "(x + y) * (x - y) / 2.0",
+        "atan2(y, x) + factorial(4)",
+    ],
+)
+def test_program_matches_eval_rpn(input):
+    tokens = rpn(input)
+    program = Program.from_rpn(tokens)
+    variables = {"x": 1.5, "y": -2}
+    assert eval_program(program, variables) == eval_rpn(tokens, variables)
+    assert render_tokens(program.to_rpn()) == render_tokens(tokens)
+
+
+def test_program_pools():
+    program = Program.from_rpn(rpn("2 * x + 2 * x + 2.0"))
+    assert program.constants == (2, 2.0)  # 2 and 2.0 stay distinct
+    assert program.names == ("x",)
+    assert len(program) == 9
+    assert program.opcodes.typecode == "H"
+
+
+def test_program_signed_zeros():
+    # equal, but not the same constant (-0.0 in the source is neg 0.0, until it's folded)
+    program = Program.from_rpn(compile_uncached("0.0 + -0.0 * x + 0.0", optimize=True).rpn)
+    assert list(map(repr, program.constants)) == ["0.0", "-0.0"]
+    source = "copysign(x, -0.0) + copysign(x, 0.0) * 2"
+    for optimize in (False, True):
+        results = [
+            compile_uncached(source, optimize=optimize, backend=backend)({"x": 1})
+            for backend in ("stack", "python", "program")
+        ]
+        assert results == [1.0, 1.0, 1.0]
+
+
+@pytest.mark.parametrize(
+    "input, depth",
+    [("1", 1), ("1 + 2 + 3 + 4", 2), ("1 + (2 + (3 + 4))", 4), ("2 ^ 3 ^ 2", 3)],
+)
+def test_program_max_stack_depth(input, depth):
+    assert Program.from_rpn(rpn(input)).max_stack_depth == depth
+
+
+def test_program_malformed():
+    with pytest.raises(ValueError):
+        Program.from_rpn(rpn("3 4"))
+    with pytest.raises(ValueError):
+        Program.from_rpn(rpn("3 *"))
+
+
+def test_program_unbound_variables():
+    program = Program.from_rpn(rpn("x + y"))
+    with pytest.raises(NameError):
+        eval_program(program, {"x": 1})
+    with pytest.raises(NameError):
+        eval_program(program)
+
+
+def test_program_backend():
+    expr = compile_uncached("x * (y + 1)", backend="program")
+    assert expr.backend == "program"
+    assert expr.variables == ("x", "y")
+    assert expr({"x": 2, "y": 3}) == 8
+    assert expr.render() == "x y 1 + *"
+
+
+def test_callables_have_slots():
+    for entity in [Operator(abs), Function(abs)]:
+        with pytest.raises(AttributeError):
+            entity.__dict__
+
+
+# =========================
+# Serialization
+# =========================
+
+
+@pytest.mark.parametrize(
+    "input",
+    [
+        "3",
+        "x * y - x",
+        "2 ^ 3 ^ 2 % 123456789012345678901234567890",
+        "-----5.5 + x × 2 ÷ 3",
+        "atan2(y, -x) + factorial(4) - abs(-0.0)",
+        # variadic calls, stored by the function's name and how many arguments they got
+        "max(x, 1, y) + hypot(x, y, 2, 2) - min(x)",
+    ],
+)
+def test_program_bytes_round_trip(input):
+    program = Program.from_rpn(rpn(input))
+    loaded = Program.from_bytes(program.to_bytes())
+    assert loaded.disassemble() == program.disassemble()
+    assert loaded.max_stack_depth == program.max_stack_depth
+    variables = {"x": 3, "y": 4}
+    assert eval_program(loaded, variables) == eval_program(program, variables)
+
+
+def test_program_bytes_with_temps():
+    program = compile_uncached("sqrt(x) * sqrt(x)", backend="program", cse=True).program
+    loaded = Program.from_bytes(memoryview(program.to_bytes()))
+    assert loaded.temp_count == 1
+    assert eval_program(loaded, {"x": 2}) == pytest.approx(2)
+
+
+def test_program_bytes_names_functions():
+    # the operator table differs between processes, so functions are stored by name
+    data = Program.from_rpn(rpn("atan2(1, 2) - neg(3)")).to_bytes()
+    assert b"atan2" in data and b"subtract" in data and b"neg" in data
+
+
+@pytest.mark.parametrize(
+    "data, message",
+    [
+        (b"SYPG", "Truncated"),
+        (b"nope" + bytes(30), "Not a serialized program"),
+        (b"SYPG\x09\x00" + bytes(28), "version"),
+    ],
+)
+def test_program_bytes_invalid(data, message):
+    with pytest.raises(ValueError, match=message):
+        Program.from_bytes(data)
+    with pytest.raises(ValueError, match="Truncated"):
+        Program.from_bytes(Program.from_rpn(rpn("sqrt(x)")).to_bytes()[:-3])
+
+
+def test_program_bytes_unnamed_function():
+    program = Program.from_rpn([2, Function(lambda x: x, arity=1)])
+    with pytest.raises(ValueError, match="no symbolic name"):
+        program.to_bytes()
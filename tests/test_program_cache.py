@@ -0,0 +1,82 @@
+"""
+# tests of the memory-mapped program cache file
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from compiler import compile_uncached
+from program_cache import ProgramCache, normalize, write_cache
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SOURCES = ["2 * x + 1", "sqrt(x) / y", "atan2(y, -x) % 3", "1 + 2 + 3", "(x + y) ^ 2"]
+
+
+def test_normalize():
+    assert normalize("  2 *\tx\n+ 1 ") == "2 * x + 1"
+    # removing spaces altogether would change what these mean
+    assert normalize("1e - 5") == "1e - 5"
+    assert normalize("x 2") == "x 2"
+
+
+def test_write_and_read(tmp_path):
+    path = tmp_path / "formulas.sypc"
+    assert write_cache(path, SOURCES + ["2  *  x + 1", "1 +", "$"]) == len(SOURCES)
+    variables = {"x": 3, "y": 4}
+    with ProgramCache(path) as cache:
+        assert len(cache) == len(SOURCES)
+        for source in SOURCES:
+            assert source in cache
+            expression = cache.compile(" " + source + " ")
+            assert expression.backend == "program"
+            assert expression.variables == compile_uncached(source).variables
+            assert expression(variables) == compile_uncached(source)(variables)
+        assert cache.hits == len(SOURCES)
+
+        assert "1 +" not in cache
+        assert "3 * x" not in cache
+        assert cache.compile("3 * x")(variables) == 9
+        assert cache.misses == 1
+
+
+def test_many_entries(tmp_path):
+    # enough entries for plenty of index collisions
+    sources = [f"x * {n} + {n % 7}" for n in range(2000)]
+    path = tmp_path / "formulas.sypc"
+    write_cache(path, sources)
+    with ProgramCache(path) as cache:
+        for n, source in enumerate(sources):
+            assert cache.compile(source)({"x": 2}) == 2 * n + n % 7
+        assert f"x * {len(sources)} + 0" not in cache
+
+
+def test_flags(tmp_path):
+    path = tmp_path / "formulas.sypc"
+    write_cache(path, ["(x + 2 * 3) * (x + 6)"], optimize=True, cse=True)
+    with ProgramCache(path) as cache:
+        assert cache.optimize and cache.cse
+        assert cache.compile("(x + 2 * 3) * (x + 6)").render() == "x 6 + =$0 $0 *"
+        assert cache.compile("2 * 3 * x").render() == "6 x *"
+
+
+def test_read_from_another_process(tmp_path):
+    path = tmp_path / "formulas.sypc"
+    script = f"from program_cache import write_cache; write_cache({str(path)!r}, {SOURCES!r})"
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
+    with ProgramCache(path) as cache:
+        assert cache.compile("atan2(y, -x) % 3")({"x": 1, "y": 1}) == pytest.approx(2.35619449)
+
+
+def test_not_a_cache(tmp_path):
+    path = tmp_path / "formulas.sypc"
+    path.write_bytes(b"hello, world" * 10)
+    with pytest.raises(ValueError, match="not a program cache"):
+        ProgramCache(path)
+    path.write_bytes(b"SYPC")
+    with pytest.raises(ValueError, match="not a program cache"):
+        ProgramCache(path)
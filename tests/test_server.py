@@ -0,0 +1,202 @@
+"""
+# tests of the asyncio evaluation server, over localhost
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from budget import Budget
+from compiler import CompileCache
+from server import Client, EvaluationServer, generate_load, percentiles
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=30))
+
+
+async def start(**options):
+    server = EvaluationServer(CompileCache(), **options)
+    listening = await server.start_tcp()
+    port = listening.sockets[0].getsockname()[1]
+    return server, lambda: Client.connect_tcp(port=port)
+
+
+def test_pipelined_requests():
+    async def main():
+        server, connect = await start()
+        async with server:
+            client = await connect()
+            responses = await client.pipeline(
+                [
+                    "2 * (3 + 4)",
+                    "3 +",
+                    json.dumps({"expression": "2 * x", "variables": {"x": 4}}),
+                    "x",
+                    "{not json",
+                    '{"variables": {}}',
+                    "sin(0)",
+                ]
+            )
+            assert await client.evaluate("x ^ y", {"x": 2, "y": 5}) == "OK 32"
+            await client.close()
+        return responses
+
+    assert run(main()) == [
+        "OK 14",
+        "ERR ValueError: Not enough operands for +",
+        "OK 8",
+        "ERR NameError: Unbound variable 'x'",
+        "ERR JSONDecodeError: Expecting property name enclosed in double quotes: line 1 column 2 (char 1)",
+        'ERR ValueError: expected {"expression": ..., "variables": {...}}',
+        "OK 0.0",
+    ]
+
+
+def test_unix_socket(tmp_path):
+    async def main():
+        path = str(tmp_path / "server.sock")
+        async with EvaluationServer(CompileCache()) as server:
+            await server.start_unix(path)
+            client = await Client.connect_unix(path)
+            response = await client.request("1 + 1")
+            await client.close()
+            return response
+
+    assert run(main()) == "OK 2"
+
+
+def test_micro_batching_and_stats():
+    async def main():
+        server, connect = await start(max_batch=64)
+        async with server:
+            client = await connect()
+            responses = await client.pipeline([f"{n} * 2" for n in range(500)])
+            stats = await client.stats()
+            await client.close()
+        return responses, stats
+
+    responses, stats = run(main())
+    assert responses == [f"OK {n * 2}" for n in range(500)]
+    assert stats["requests"] == 500
+    # requests that arrive together are evaluated together
+    assert 500 / 64 <= stats["batches"] < 500
+    assert stats["mean_batch_size"] > 1
+    assert set(stats["latency_ms"]) == {"p50", "p90", "p99", "max"}
+    assert stats["cache"]["misses"] == 500
+
+
+def test_backpressure():
+    async def main():
+        server, connect = await start(queue_size=4)
+        async with server:
+            # stall evaluation, so requests pile up
+            server._batcher.cancel()
+            client = await connect()
+            client.writer.write(b"".join(b"%d + 1\n" % n for n in range(50)))
+            await asyncio.sleep(0.2)
+            # the connection stopped reading once the queue filled up
+            assert server.queue.qsize() == 4
+            server._batcher = asyncio.create_task(server._run_batches())
+            responses = [await client._read_response() for _ in range(50)]
+            await client.close()
+        return responses
+
+    assert run(main()) == [f"OK {n + 1}" for n in range(50)]
+
+
+def test_worker_pool():
+    async def main():
+        server, connect = await start(workers=1)
+        async with server:
+            client = await connect()
+            responses = await client.pipeline(["2 ^ 10", "1 / 0"])
+            await client.close()
+        return responses
+
+    assert run(main()) == ["OK 1024", "ERR ZeroDivisionError: division by zero"]
+
+
+def test_budget():
+    async def main():
+        server, connect = await start(budget=Budget(max_bits=64))
+        async with server:
+            client = await connect()
+            responses = await client.pipeline(["9 ^ 9 ^ 9", "2 ^ 63"])
+            await client.close()
+        return responses
+
+    assert run(main()) == [
+        "ERR BudgetExceeded: ^ would give a ~1228093895-bit integer, over the budget of 64",
+        f"OK {2**63}",
+    ]
+
+
+def test_unprintable_result():
+    # within DEFAULT_BUDGET, but too many digits for str(): an error, not a dead connection
+    async def main():
+        server, connect = await start()
+        async with server:
+            client = await connect()
+            responses = await client.pipeline(["2 ^ 20000", "2 + 3"])
+            await client.close()
+        return responses
+
+    error, ok = run(main())
+    assert error.startswith("ERR ValueError: Exceeds the limit")
+    assert ok == "OK 5"
+
+
+def test_budget_on_worker_pool():
+    # BudgetExceeded has to make it back from the worker, without breaking the pool
+    async def main():
+        server, connect = await start(workers=1, budget=Budget(max_bits=64))
+        async with server:
+            client = await connect()
+            first = await client.pipeline(["9 ^ 9 ^ 9", "2 ^ 10"])
+            second = await client.pipeline(["3 * 4"])
+            await client.close()
+        return first + second
+
+    assert run(main()) == [
+        "ERR BudgetExceeded: ^ would give a ~1228093895-bit integer, over the budget of 64",
+        "OK 1024",
+        "OK 12",
+    ]
+
+
+def test_close_with_clients_connected():
+    async def main():
+        server, connect = await start()
+        client = await connect()
+        assert await client.request("1") == "OK 1"
+        await server.close()
+        return await client.reader.read()
+
+    assert run(main()) == b""
+
+
+def test_generate_load():
+    async def main():
+        server, connect = await start()
+        async with server:
+            return await generate_load(
+                connect, ["1 + 2", "3 +"], requests=1000, connections=3, depth=16
+            )
+
+    report = run(main())
+    assert report["requests"] == 1000
+    assert report["errors"] == 500
+    assert report["requests_per_second"] > 0
+    assert (
+        report["latency_ms"]["p50"] <= report["latency_ms"]["p99"] <= report["latency_ms"]["max"]
+    )
+
+
+def test_percentiles():
+    assert percentiles(range(1, 101)) == {"p50": 50, "p90": 90, "p99": 99, "max": 100}
+    assert percentiles([3]) == {"p50": 3, "p90": 3, "p99": 3, "max": 3}
+    assert percentiles([]) == {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    with pytest.raises(ValueError):
+        run(generate_load(None, [], 1))
@@ -4,11 +4,21 @@
 
 import pytest
 from operator import add, mul  # , pow
+import math
 from math import pi, sin
 
-from entities import div, _neg, Special, Operator as Op, Function as Fn, render_tokens
-from shunting_yard import get_rpn_tokens, eval_rpn
-from tokenizer import tokenize, enrich
+from entities import (
+    ParseError,
+    div,
+    _neg,
+    Special,
+    Operator as Op,
+    Function as Fn,
+    Variable,
+    render_tokens,
+)
+from shunting_yard import get_rpn_tokens, eval_rpn, locate_rpn_tokens
+from tokenizer import scan, tokenize, enrich
 
 
 # Formatting notes: test parametrization is sometimes hand-wrapped
@@ -19,22 +29,21 @@ from tokenizer import tokenize, enrich
 # -------------
 
 
-@pytest.mark.skip  # shunting yard NYI
 @pytest.mark.parametrize(
     "input, expected",
     [
-        ([3, Op(add), 4], [3, 4, add]),
+        ([3, Op(add), 4], [3, 4, Op(add)]),
         (
             # "sin ( max ( 2, 3 ) ÷ 3 × π )",
             [
-                sin, Special.PAREN_LEFT, max,
-                Special.PAREN_LEFT, 2, 3, Special.PAREN_RIGHT,
-                div, 3, mul, pi, Special.PAREN_RIGHT,
+                Fn(sin, arity=1), Special.PAREN_LEFT, Fn(max),
+                Special.PAREN_LEFT, 2, Special.COMMA, 3, Special.PAREN_RIGHT,
+                Op(div), 3, Op(mul), pi, Special.PAREN_RIGHT,
             ],
             # 2 3 max 3 ÷ π × sin
             [
                 2, 3, Fn(max), 3, Op(div),
-                pi, Op(mul), Fn(sin),
+                pi, Op(mul), Fn(sin, arity=1),
             ],
         ),
     ],
@@ -42,15 +51,16 @@ from tokenizer import tokenize, enrich
 def test_get_rpn_tokens(input, expected):
     # TODO: This might be a LOT easier to read if we kept string inputs,
     #       and then used render to get string version of the tokens.
-    assert expected == get_rpn_tokens(input)
+    # get_rpn_tokens is a generator, so that it can stream: nothing is computed until asked for
+    assert expected == list(get_rpn_tokens(input))
 
 
-@pytest.mark.skip  # shunting yard NYI
 @pytest.mark.parametrize(
     "input, expected",
     [
         ("3 + 4", "3 4 +"),
-        ("sin ( max ( 2, 3 ) ÷ 3 × π )", "2 3 max 3 ÷ π × sin"),
+        # aliases render as the first name registered; π is just a number
+        ("sin ( max ( 2, 3 ) ÷ 3 × π )", f"2 3 max 3 / {math.pi} * sin"),
         # trololol. Let eval handle repeated calls to neg.
         ("-----5", "5 neg neg neg neg neg"),
         ("3--5", "3 5 neg -"),
@@ -62,29 +72,134 @@ def test_get_rendered_rpn_tokens(input, expected):
     assert expected == render_tokens(rpn_tokens)
 
 
+@pytest.mark.parametrize(
+    "input, expected",
+    [
+        ("2 + 3 * 4", "2 3 4 * +"),
+        ("2 * 3 + 4", "2 3 * 4 +"),
+        ("(2 + 3) * (4 - 1)", "2 3 + 4 1 - *"),
+        ("5 - 3 - 2", "5 3 - 2 -"),
+        ("4 / 2 / 2", "4 2 / 2 /"),
+        ("2 ^ 3 ^ 2", "2 3 2 ^ ^"),  # right-associative
+        ("-2 ^ 2", "2 2 ^ neg"),  # -(2^2)
+        ("2 ^ -3", "2 3 neg ^"),
+        ("sqrt(4 + 5)", "4 5 + sqrt"),
+        ("((3))", "3"),
+    ],
+)
+def test_rpn_precedence(input, expected):
+    assert expected == render_tokens(get_rpn_tokens(enrich(tokenize(input))))
+
+
+@pytest.mark.parametrize(
+    "input",
+    [
+        [Special.PAREN_LEFT, 2, Op(add), 3],  # (2 + 3
+        [2, Op(add), 3, Special.PAREN_RIGHT],  # 2 + 3)
+    ],
+)
+def test_rpn_mismatched_parens(input):
+    with pytest.raises(ValueError):
+        list(get_rpn_tokens(input))
+
+
+@pytest.mark.parametrize(
+    "source, rpn, arities",
+    [
+        ("max(1, 2, 3)", "1 2 3 max", [3]),
+        ("max(1)", "1 max", [1]),
+        ("fsum()", "fsum", [0]),
+        ("min(4, max(1, 2 + 3, 9), -2)", "4 1 2 3 + 9 max 2 neg min", [2, 3, 1, 3]),
+        # only the commas of its own call count
+        ("max(atan2(1, 2), (3), hypot(4, 5, 6, 7))", "1 2 atan2 3 4 5 6 7 hypot max", [2, 4, 3]),
+    ],
+)
+def test_rpn_variadic(source, rpn, arities):
+    tokens = list(get_rpn_tokens(enrich(tokenize(source))))
+    assert render_tokens(tokens) == rpn
+    assert [token.arity for token in tokens if isinstance(token, (Op, Fn))] == arities
+
+
+def test_rpn_passes_pause_through():
+    # once everything before it is output, in the same place whatever comes after it
+    tokens = [2, Op(mul), 3, Special.PAUSE, Op(add), 4]
+    assert list(get_rpn_tokens(tokens)) == [2, 3, Special.PAUSE, Op(mul), 4, Op(add)]
+
+
+@pytest.mark.parametrize(
+    "source, position",
+    [
+        ("(2 + 3", 0),
+        ("2 * (3 + (4 - 1)", 4),
+        ("2 + 3)", 5),
+        ("max(1, (2)", 3),
+        # the wrong number of arguments: where the function is
+        ("max(sin(1, 2), atan2(3))", 4),
+        ("1 + atan2((1, 2))", 4),
+        ("sqrt()", 0),
+        # variadic functions need their parens
+        ("max 3", 0),
+        ("2 + min", 4),
+    ],
+)
+def test_rpn_error_positions(source, position):
+    tokens = list(scan(source))
+    with pytest.raises(ParseError) as raised:
+        list(locate_rpn_tokens(enrich(tokens), tokens, []))
+    assert raised.value.position == position
+
+
+@pytest.mark.parametrize(
+    "source, message",
+    [
+        ("sin(1, 2)", "sin takes 1 argument, not 2"),
+        ("atan2(3)", "atan2 takes 2 arguments, not 1"),
+        ("factorial()", "factorial takes 1 argument, not 0"),
+        ("max 3", "max needs its arguments in parentheses"),
+        ("max", "max needs its arguments in parentheses"),
+    ],
+)
+def test_rpn_argument_counts(source, message):
+    with pytest.raises(ParseError, match=message):
+        list(get_rpn_tokens(enrich(tokenize(source))))
+
+
+def test_rpn_without_parens():
+    # fixed-arity functions can still go without them
+    assert render_tokens(get_rpn_tokens(enrich(tokenize("sin 3 + 1")))) == "3 1 + sin"
+
+
+def test_rpn_origins():
+    source = "2 * (x + 10) - sqrt(y)"
+    tokens = list(scan(source))
+    origins = []
+    rpn = list(locate_rpn_tokens(enrich(tokens), tokens, origins))
+    assert len(origins) == len(rpn)
+    assert [tokens[origin].text for origin in origins] == render_tokens(rpn).split()
+
+
 # -------------
 # Evaluate RPN token stream so that we can have simpler test cases
 # -------------
 
 
-@pytest.mark.skip  # eval NYI
 @pytest.mark.parametrize(
     "input, expected",
     [
         ([3, 4, Op(add)], 7),
-        ([3, 4, Fn(_neg), add], -1),
+        ([3, 4, Op(_neg, arity=1), Op(add)], -1),
         (
             # "sin ( max ( 2, 3 ) ÷ 3 × π )"
             [
                 2, 3, Fn(max), 3, Op(div),
-                pi, Op(mul), Fn(sin),
+                pi, Op(mul), Fn(sin, arity=1),
             ],
             0,
         ),
     ],
 )  # fmt: skip
 def test_eval_rpn(input, expected):
-    assert eval_rpn(input) == expected
+    assert eval_rpn(input) == pytest.approx(expected, abs=1e-15)
 
 
 # ==================
@@ -150,3 +265,62 @@ def test_eval_rpn(input, expected):
 #     {"input": "(2 + 3", "expected": "ERR"},
 #     {"input": "2 + * 3", "expected": "ERR"},
 # ]
+
+
+@pytest.mark.parametrize(
+    "input, expected",
+    [
+        ("3 + 4", 7),
+        ("2 + 3 * 4 - 5", 9),
+        ("8 / 2", 4.0),
+        ("2 ^ 3 ^ 2", 512),
+        ("-----5", -5),
+        ("3--5", 8),
+        ("abs(-4) + sqrt(16)", 8.0),
+        ("7 % 4", 3),
+    ],
+)
+def test_eval_expression(input, expected):
+    assert eval_rpn(get_rpn_tokens(enrich(tokenize(input)))) == expected
+
+
+@pytest.mark.parametrize("input", [[3, Op(add)], [3, 4]])
+def test_eval_malformed_rpn(input):
+    with pytest.raises(ValueError):
+        eval_rpn(input)
+
+
+@pytest.mark.parametrize(
+    "input, expected_rpn, expected",
+    [
+        ("x + y", "x y +", 5),
+        ("x1 - _var2", "x1 _var2 -", -1),
+        ("2 * x - -y", "2 x * y neg -", 7),
+        ("x ^ 2 + e", "x 2 ^ 2.718281828459045 +", 4 + math.e),
+    ],
+)
+def test_variables(input, expected_rpn, expected):
+    rpn = list(get_rpn_tokens(enrich(tokenize(input))))
+    assert expected_rpn == render_tokens(rpn)
+    assert expected == eval_rpn(rpn, {"x": 2, "y": 3, "x1": 1, "_var2": 2})
+
+
+def test_unbound_variable():
+    with pytest.raises(NameError):
+        eval_rpn([Variable("x")])
+
+
+def test_operator_precedence_fields():
+    from entities import entity_mapping, get_precedence, neg
+
+    plus, times, power = entity_mapping["+"], entity_mapping["*"], entity_mapping["^"]
+    assert plus.precedence < times.precedence < neg.precedence < power.precedence
+    assert get_precedence(times) == times.precedence
+    assert (plus.right_associative, power.right_associative) == (0, 1)
+    assert Op(abs, precedence=7).precedence == 7
+
+
+def test_callables_are_hashable():
+    assert hash(Op(add)) == hash(Op(add))
+    assert len({Op(add), Op(add), Fn(add), Op(mul)}) == 3
+    assert Op(add) != 3
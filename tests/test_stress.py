@@ -0,0 +1,81 @@
+"""
+# stress tests: million-token expressions, streamed, with peak memory tracked
+#
+# These take a while, so they're opt-in:
+#    SHUNTING_YARD_STRESS=1 python -m pytest tests/test_stress.py
+#
+# Each run is a fresh subprocess, so that ru_maxrss (the peak RSS) is its own.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("SHUNTING_YARD_STRESS"), reason="set SHUNTING_YARD_STRESS=1 to run"
+)
+
+ROOT = Path(__file__).parent.parent
+
+SCRIPT = """
+import json, resource, sys, time
+from compiler import evaluate_stream
+
+shape, tokens = sys.argv[1], int(sys.argv[2])
+
+def sum_of_products():
+    # 8 tokens a term; generated in chunks, never held whole
+    terms = tokens // 8
+    for _ in range(terms // 1000):
+        yield "3 * x - 2 * x + " * 1000
+    yield "0"
+
+def nested_calls():
+    # 3 tokens a level
+    depth = tokens // 3
+    for _ in range(depth // 1000):
+        yield "abs(" * 1000
+    yield "-1"
+    for _ in range(depth // 1000):
+        yield ")" * 1000
+
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+result = evaluate_stream({"sum": sum_of_products, "nested": nested_calls}[shape](), {"x": 1})
+print(json.dumps({
+    "result": result,
+    "seconds": time.perf_counter() - start,
+    "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024,
+}))
+"""
+
+
+def stream(shape: str, tokens: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT, shape, str(tokens)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output)
+
+
+@pytest.mark.parametrize("tokens", [10**6, 10**7])
+def test_long_sum_of_products(tokens):
+    report = stream("sum", tokens)
+    assert report["result"] == tokens // 8
+    # memory doesn't grow with the length of the input
+    assert report["rss_growth_mb"] < 16, report
+
+
+def test_deeply_nested_calls():
+    shallow = stream("nested", 10**5)
+    deep = stream("nested", 10**6)
+    assert shallow["result"] == deep["result"] == 1
+    # memory grows with nesting depth (the operator stack), at most linearly
+    assert deep["rss_growth_mb"] < 10 * max(shallow["rss_growth_mb"], 4) + 16, (shallow, deep)
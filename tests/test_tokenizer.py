@@ -6,8 +6,8 @@ import pytest
 from math import pi, sqrt
 from operator import add, mul, pow, abs
 
-from entities import div, Special, Operator as Op, Function as Fn, neg, subtract
-from tokenizer import tokenize, enrich
+from entities import ParseError, div, Special, Operator as Op, Function as Fn, neg, subtract
+from tokenizer import Token, TokenKind, scan, scan_chunks, scan_document, tokenize, enrich
 
 
 @pytest.mark.parametrize(
@@ -72,8 +72,101 @@ def test_enrich(input, expected):
         (["-", "-", "-", "5"], [neg, neg, neg, 5]),
         # evens do not cancel out because we'll do the math during eval
         (["-", "-", "5"], [neg, neg, 5]),
+        # a function argument can start with a minus too
+        (
+            ["(", "1", ",", "-", "2", ")"],
+            [Special.PAREN_LEFT, 1, Special.COMMA, neg, 2, Special.PAREN_RIGHT],
+        ),
     ],
 )
 def test_enrich_negation(input, expected):
     enriched = list(enrich(input))
     assert expected == enriched
+
+
+@pytest.mark.parametrize(
+    "input, expected",
+    [
+        ("3", [(TokenKind.INT, "3")]),
+        ("3.", [(TokenKind.FLOAT, "3.")]),
+        (".5", [(TokenKind.FLOAT, ".5")]),
+        ("2.5E-2", [(TokenKind.FLOAT, "2.5E-2")]),
+        ("1e3", [(TokenKind.FLOAT, "1e3")]),
+        ("x1 _var2", [(TokenKind.NAME, "x1"), (TokenKind.NAME, "_var2")]),
+        ("2π", [(TokenKind.INT, "2"), (TokenKind.NAME, "π")]),
+        (
+            "6÷2×3",
+            [
+                (TokenKind.INT, "6"),
+                (TokenKind.OP, "÷"),
+                (TokenKind.INT, "2"),
+                (TokenKind.OP, "×"),
+                (TokenKind.INT, "3"),
+            ],
+        ),
+        ("  ", []),
+    ],
+)
+def test_scan(input, expected):
+    assert expected == [(token.kind, token.text) for token in scan(input)]
+
+
+def test_scan_spans():
+    source = "12 + sin(x)"
+    tokens = list(scan(source))
+    assert [(token.start, token.end) for token in tokens] == [
+        (0, 2),
+        (3, 4),
+        (5, 8),
+        (8, 9),
+        (9, 10),
+        (10, 11),
+    ]
+    # every Token is a view of the same string, not a copy
+    assert all(token.source is source for token in tokens)
+    assert tokens[0] == Token(TokenKind.INT, 0, 2, source)
+    assert repr(tokens[2]) == "Token(NAME, 'sin', 5:8)"
+
+
+@pytest.mark.parametrize("input, position", [("3 $ 4", 2), ("2 ! ", 2), ("a = 1", 2)])
+def test_scan_rejects_unknown_characters(input, position):
+    with pytest.raises(ParseError) as raised:
+        list(scan(input))
+    assert raised.value.position == position
+    assert str(raised.value).endswith(f"at position {position}")
+
+
+SPLIT_SOURCE = "1e+5 - 3E-2 * x2e - e+1 - .5e-3 + sin(2.5) ÷ 10"
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, len(SPLIT_SOURCE)])
+def test_scan_chunks(size):
+    # tokens split between chunks (even inside 1e+5) come out whole
+    chunks = [SPLIT_SOURCE[start : start + size] for start in range(0, len(SPLIT_SOURCE), size)]
+    expected = [(token.kind, token.text) for token in scan(SPLIT_SOURCE)]
+    assert [(token.kind, token.text) for token in scan_chunks(chunks)] == expected
+    assert [(token.kind, token.text) for token in scan_chunks(["", *chunks, ""])] == expected
+    # errors are placed in the whole input, not the chunk
+    with pytest.raises(ParseError) as raised:
+        list(scan_chunks([*chunks, " + $"]))
+    assert raised.value.position == len(SPLIT_SOURCE) + 3
+
+
+def test_scan_document():
+    document = "1 + 2; x\n\n  sin(y) $ 3 ;\n4;;  \n2 *\n"
+    scanned = list(scan_document(document))
+    assert [line for line, _ in scanned] == [1, 1, 3, 4, 5]
+    assert [token.text for token in scanned[0][1]] == ["1", "+", "2"]
+    assert [token.text for token in scanned[4][1]] == ["2", "*"]
+    # spans are into the whole document
+    assert scanned[1][1][0].start == document.index("x")
+    # one bad expression doesn't stop the rest
+    error = scanned[2][1]
+    assert isinstance(error, ParseError)
+    assert error.position == document.index("$")
+    assert list(scan_document("")) == list(scan_document(" ;\n\n")) == []
+
+
+def test_enrich_scanned_tokens():
+    # enrich takes typed tokens as well as strings, and gives the same result
+    assert list(enrich(scan("3e2 + sqrt(-4)"))) == list(enrich(tokenize("3e2 + sqrt(-4)")))
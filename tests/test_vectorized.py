@@ -0,0 +1,90 @@
+"""
+# tests of evaluating RPN against numpy arrays of bindings
+"""
+
+import math
+
+import pytest
+
+from compiler import compile
+from vectorized import VectorizationFallbackWarning, eval_rpn_vectorized
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.mark.parametrize(
+    "input",
+    [
+        "2 * x + y",
+        "x - y - 3",
+        "-x ^ 2",
+        "(x + 1) / (y + 1)",
+        "abs(x - 10) % 3",
+        "sqrt(x) * pi",
+        "atan2(x, y + 2) * 2",
+        # variadic calls, as one ufunc reduction
+        "max(x, 3, y) - min(y) + hypot(x, y, 1)",
+        "fsum(x, y, 0.5) * prod(x, y, 2)",
+    ],
+)
+def test_vectorized_matches_scalar(input):
+    expr = compile(input)
+    xs = np.arange(8, dtype=float)
+    ys = np.linspace(0, 1, 8)
+    result = eval_rpn_vectorized(expr.rpn, {"x": xs, "y": ys})
+    expected = [expr({"x": x, "y": y}) for x, y in zip(xs.tolist(), ys.tolist())]
+    assert result.shape == (8,)
+    np.testing.assert_allclose(result, expected)
+
+
+@pytest.mark.parametrize(
+    "input, expected",
+    [
+        ("hypot(x)", [3.0, 4.0]),
+        ("max(x) + min(x) + prod(x) + 0.5", [-8.5, 12.5]),
+        ("fsum(x) + fsum() + prod()", [-2.0, 5.0]),
+        ("x * hypot()", [-0.0, 0.0]),
+    ],
+)
+def test_vectorized_variadic_few_arguments(input, expected):
+    # reducing over fewer than 2 arguments isn't always the function
+    expr = compile(input)
+    xs = np.array([-3, 4])
+    result = expr.evaluate_vectorized({"x": xs})
+    assert result.tolist() == expected == [expr({"x": x}) for x in xs.tolist()]
+    assert result.dtype == np.float64
+
+
+def test_vectorized_int_powers():
+    # int64 would wrap around, or refuse a negative exponent: python's ** doesn't
+    xs = np.array([3, 2, -5])
+    for source in ("x ^ 40", "x ^ -1", "2 ^ (x + 60)", "x ^ 2 * 3"):
+        expr = compile(source)
+        assert expr.evaluate_vectorized({"x": xs}).tolist() == [
+            expr({"x": x}) for x in xs.tolist()
+        ]
+    assert compile("x ^ 2").evaluate_vectorized({"x": xs}).dtype == np.int64
+    # math.pow is always a float
+    result = compile("pow(x, 40)").evaluate_vectorized({"x": xs})
+    assert result.tolist() == [3.0**40, 2.0**40, 5.0**40]
+
+
+def test_vectorized_broadcasts_constants():
+    result = compile("2 * 3 + x * 0").evaluate_vectorized({"x": np.zeros(4)})
+    np.testing.assert_array_equal(result, [6, 6, 6, 6])
+
+
+def test_vectorized_unbound_variable():
+    with pytest.raises(NameError):
+        eval_rpn_vectorized(compile("x + z").rpn, {"x": np.ones(2)})
+
+
+def test_vectorized_fallback_warns():
+    expr = compile("factorial(x)")
+    with pytest.warns(VectorizationFallbackWarning):
+        result = expr.evaluate_vectorized({"x": np.array([3, 4, 5])})
+    assert list(result) == [math.factorial(n) for n in [3, 4, 5]]
+    # np.log is a ufunc, but not for log(x, base)
+    with pytest.warns(VectorizationFallbackWarning):
+        result = compile("log(x, 2)").evaluate_vectorized({"x": np.array([1, 8])})
+    assert list(result) == [0.0, 3.0]
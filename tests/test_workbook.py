@@ -0,0 +1,84 @@
+"""
+# tests of the spreadsheet-style Workbook
+"""
+
+import pytest
+
+from workbook import CycleError, Workbook
+
+
+@pytest.fixture
+def book():
+    book = Workbook()
+    book.set_inputs({"price": 10, "quantity": 3, "rate": 0.5})
+    book.define("subtotal", "price * quantity")
+    book.define("tax", "subtotal * rate")
+    book.define("total", "subtotal + tax")
+    book.define("unrelated", "rate * 2")
+    return book
+
+
+def test_values(book):
+    assert book["subtotal"] == 30
+    assert book["total"] == 45.0
+    assert book["unrelated"] == 1.0
+
+
+def test_only_affected_cells_recompute(book):
+    before = book.evaluations
+    assert book.set_input("quantity", 4) == ["subtotal", "tax", "total"]
+    assert book.evaluations - before == 3
+    assert book["total"] == 60.0
+
+
+def test_topological_order(book):
+    # rate feeds tax directly, and unrelated; total has to wait for tax
+    order = book.set_input("rate", 0.1)
+    assert sorted(order) == ["tax", "total", "unrelated"]
+    assert order.index("tax") < order.index("total")
+    assert book["total"] == pytest.approx(33.0)
+
+
+def test_set_inputs_recomputes_once(book):
+    assert book.set_inputs({"price": 1, "quantity": 1}) == ["subtotal", "tax", "total"]
+
+
+def test_redefine(book):
+    assert book.define("tax", "subtotal * 0") == ["tax", "total"]
+    assert book["total"] == 30
+    # subtotal no longer feeds the old tax formula's dependencies
+    assert book.set_input("rate", 1) == ["unrelated"]
+
+
+@pytest.mark.parametrize(
+    "name, source",
+    [("subtotal", "total * 2"), ("self", "self + 1"), ("price_again", "price_again")],
+)
+def test_cycles_are_rejected(book, name, source):
+    with pytest.raises(CycleError):
+        book.define(name, source)
+    assert book["total"] == 45.0
+
+
+def test_forward_references():
+    book = Workbook()
+    book.define("b", "a + 1")
+    with pytest.raises(NameError):
+        book["b"]
+    assert book.set_input("a", 1) == ["b"]
+    assert book["b"] == 2
+
+
+def test_remove(book):
+    book.remove("rate")
+    with pytest.raises(NameError):
+        book["total"]
+    book.set_input("rate", 0)
+    assert book["total"] == 30
+
+
+def test_inputs_and_formulas_dont_mix(book):
+    with pytest.raises(ValueError):
+        book.define("price", "1")
+    with pytest.raises(ValueError):
+        book.set_input("total", 1)
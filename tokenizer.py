@@ -3,32 +3,34 @@
 #
 # split a stream of stuff into a stream of strings, and then enrich those into meaningful values
 #
-# Uses python's builtin tokenize.tokenize to get tokens, which auto-handles finding numbers and names and parens
+# Uses a small regex-driven scanner for the expression grammar, which finds numbers,
+# names and operators in one pass and remembers which kind each token was:
 #
-#    In [51]: tokens = list(tokenize(BytesIO("-3e2 - -4.3 * sin(π)".encode("utf-8")).readline))
-#    In [52]: tokens
-#    Out[52]:
-#    [TokenInfo(type=65 (ENCODING), string='utf-8', start=(0, 0), end=(0, 0), line=''),
-#    TokenInfo(type=55 (OP), string='-', start=(1, 0), end=(1, 1), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=2 (NUMBER), string='3e2', start=(1, 1), end=(1, 4), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=55 (OP), string='-', start=(1, 5), end=(1, 6), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=55 (OP), string='-', start=(1, 7), end=(1, 8), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=2 (NUMBER), string='4.3', start=(1, 8), end=(1, 11), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=55 (OP), string='*', start=(1, 12), end=(1, 13), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=1 (NAME), string='sin', start=(1, 14), end=(1, 17), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=55 (OP), string='(', start=(1, 17), end=(1, 18), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=1 (NAME), string='π', start=(1, 18), end=(1, 19), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=55 (OP), string=')', start=(1, 19), end=(1, 20), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=4 (NEWLINE), string='', start=(1, 20), end=(1, 21), line='-3e2 - -4.3 * sin(π)'),
-#    TokenInfo(type=0 (ENDMARKER), string='', start=(2, 0), end=(2, 0), line='')]
+#    In [51]: list(scan("-3e2 - -4.3 * sin(π)"))
+#    Out[51]:
+#    [Token(OP, '-', 0:1),
+#     Token(FLOAT, '3e2', 1:4),
+#     Token(OP, '-', 5:6),
+#     Token(OP, '-', 7:8),
+#     Token(FLOAT, '4.3', 8:11),
+#     Token(OP, '*', 12:13),
+#     Token(NAME, 'sin', 14:17),
+#     Token(OP, '(', 17:18),
+#     Token(NAME, 'π', 18:19),
+#     Token(OP, ')', 19:20)]
+#
+# Tokens are spans (start, end) of the input, rather than copies of its text, so parse
+# errors can say where they happened (see ParseError.position).
+#
+# (This used to go through the stdlib tokenize.tokenize, which meant encoding the input,
+# wrapping it in a BytesIO, and running the whole Python-source tokenizer over it.)
 """
 
-from io import BytesIO
-from token import ENCODING, NEWLINE, ENDMARKER
-from tokenize import tokenize as builtin_tokenize
-from typing import Iterator
+import re
+from enum import Enum
+from typing import Iterable, Iterator, NamedTuple
 
-from entities import get_entity, Special, Operator, neg, subtract
+from entities import ParseError, get_entity, Special, Operator, Variable, neg, subtract
 
 
 # =========================
@@ -40,21 +42,191 @@ from entities import get_entity, Special, Operator, neg, subtract
 # =========================
 
 
+class TokenKind(Enum):
+    INT = "int"
+    FLOAT = "float"
+    NAME = "name"  # functions, named constants (pi, π)
+    OP = "op"  # operators, parens, and commas
+
+
+class Token(NamedTuple):
+    """
+    A span of the input: source[start:end]. Every Token shares the one source string,
+    so scanning doesn't copy anything out of it; the text is only sliced out if asked for.
+    """
+
+    kind: TokenKind
+    start: int
+    end: int
+    source: str
+
+    @property
+    def text(self) -> str:
+        return self.source[self.start : self.end]
+
+    def __repr__(self):
+        # not the source: it could be megabytes
+        return f"Token({self.kind.name}, {self.text!r}, {self.start}:{self.end})"
+
+
+# One alternation over the whole grammar; which group matched tells us the kind.
+# Order matters: floats have to be tried before ints so "3e2" and "2.5" aren't split up.
+# Whitespace never matches, and anything else non-blank lands in the last (error) group.
+_number_grammar = r"""
+    ((?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+)  # float
+    |(\d+)  # int
+"""
+_grammar = (
+    _number_grammar
+    + r"""
+    |([^\W\d]\w*)  # name
+    |([-+*/^%÷×(),~])  # op
+"""
+)
+_token_pattern = re.compile(_grammar + r"|(\S)  # anything else is an error", re.VERBOSE)
+# match.lastindex -> the kind of token that group matches
+_group_kinds = (None, TokenKind.FLOAT, TokenKind.INT, TokenKind.NAME, TokenKind.OP, None)
+_UNEXPECTED = 5
+
+# The same, for documents of many expressions: a newline or ; ends each one
+_document_pattern = re.compile(
+    _grammar
+    + r"""
+    |([;\n])  # end of an expression
+    |(\S)
+    """,
+    re.VERBOSE,
+)
+_SEPARATOR = 5  # (and 6 is the error group)
+
+# NamedTuple.__new__ is a python-level function; calling tuple.__new__ directly
+# builds the same Token without that overhead, which matters at one call per token.
+_new_token = tuple.__new__
+
+# Everything up to and including the last character no token can continue past:
+# whitespace, or an operator (but not a + or - after an e, which could be in 1e+5).
+# Backtracks from the end of a chunk, so it's only as slow as the last token is long.
+_last_boundary = re.compile(r".*(?:\s|[*/^%÷×(),~]|(?<![eE])[-+])", re.DOTALL)
+
+
+def scan(input: str) -> Iterator[Token]:
+    """
+    Single pass over the input, yielding typed Tokens (spans of it).
+    Unlike the stdlib tokenizer, this only knows about the expression grammar:
+    numbers, names, operators (including ÷ and ×), parens, and commas.
+    """
+    # finditer finds one match at a time, so however long the input, nothing piles up
+    for match in _token_pattern.finditer(input):
+        group = match.lastindex
+        if group == _UNEXPECTED:
+            raise ParseError(f"Unexpected character {match.group()!r}", match.start())
+        yield _new_token(Token, (_group_kinds[group], match.start(), match.end(), input))
+
+
+def scan_chunks(chunks: Iterable[str]) -> Iterator[Token]:
+    """
+    scan(), over input that arrives in pieces, e.g. iter(partial(file.read, 1 << 16), "").
+    Tokens can be split across chunks; only the unfinished end of the input read so far
+    is kept around. Each Token spans the piece of input it was scanned from, not the whole;
+    ParseError positions are into the whole input.
+    """
+    scanner = ChunkScanner()
+    for chunk in chunks:
+        yield from scanner.feed(chunk)
+    yield from scanner.close()
+
+
+class ChunkScanner:
+    """
+    scan_chunks, for input that's pushed rather than pulled: feed() each chunk as it arrives,
+    and get back the Tokens it finished; close() at the end gets the rest.
+    """
+
+    def __init__(self):
+        self.pending = []  # input since the last boundary
+        self.previous = ""  # the last two characters fed, for the lookbehind
+        self.offset = 0  # where the pending input starts, in the whole input
+
+    def feed(self, chunk: str) -> Iterator[Token]:
+        if not chunk:
+            return iter(())
+        context = self.previous + chunk
+        self.previous = context[-2:]
+        boundary = _last_boundary.match(context)
+        # (a boundary before the chunk is one we already had the chance to cut at)
+        cut = -1 if boundary is None else boundary.end() - (len(context) - len(chunk))
+        if cut < 0:
+            self.pending.append(chunk)
+            return iter(())
+        self.pending.append(chunk[:cut])
+        piece = "".join(self.pending)
+        self.pending = [chunk[cut:]]
+        offset = self.offset
+        self.offset += len(piece)
+        return _scan_piece(piece, offset)
+
+    def close(self) -> Iterator[Token]:
+        piece = "".join(self.pending)
+        self.pending = []
+        return _scan_piece(piece, self.offset)
+
+
+def _scan_piece(piece: str, offset: int) -> Iterator[Token]:
+    try:
+        yield from scan(piece)
+    except ParseError as e:
+        raise ParseError(e.message, e.position + offset) from None
+
+
+def scan_document(input: str) -> Iterator[tuple[int, list[Token] | ParseError]]:
+    """
+    Scan a document of many expressions, one per line or separated by `;`, in one pass.
+    Yields (line number, Tokens) for each non-empty expression; Tokens span the whole
+    document. An expression with a character that doesn't scan is yielded as
+    (line number, ParseError) instead, and scanning carries on with the next one.
+    """
+    line = 1
+    start_line = 1  # the line the current expression started on
+    tokens = []
+    error = None
+    for match in _document_pattern.finditer(input):
+        group = match.lastindex
+        if group < _SEPARATOR:
+            tokens.append(
+                _new_token(Token, (_group_kinds[group], match.start(), match.end(), input))
+            )
+        elif group == _SEPARATOR:
+            if error is not None:
+                yield start_line, error
+            elif tokens:
+                yield start_line, tokens
+            tokens = []
+            error = None
+            if match.group() == "\n":
+                line += 1
+            start_line = line
+        elif error is None:
+            error = ParseError(f"Unexpected character {match.group()!r}", match.start())
+    if error is not None:
+        yield start_line, error
+    elif tokens:
+        yield start_line, tokens
+
+
 def tokenize(input: str) -> Iterator[str]:
     """
-    Use the builtin tokenize.tokenize to get a stream of tokens
-    Tokens have a type, exact_type, and a string field.
+    Split the input into a stream of string tokens.
+    Use scan() instead if you want to keep the token kinds (and positions) around.
     """
-    # the builtin tokenize.tokenize reads from the readline method of
-    # an input stream instance.  Super weird to use in this way :)
-    token_stream = builtin_tokenize(BytesIO(input.encode("utf-8")).readline)
-    for token in token_stream:
-        if token.type in {ENCODING, NEWLINE, ENDMARKER}:
-            continue
-        # I don't love that this throws away the
-        # tokenizer's knowledge that this token is a number or MINUS,
-        # but I'm deliberately yielding only strings from this.
-        yield token.string
+    for token in scan(input):
+        yield token.text
+
+
+def classify(token: str) -> Token:
+    """Figure out the kind of a single pre-split string token"""
+    for scanned in scan(token):
+        return scanned
+    raise ValueError(f"Empty token: {token!r}")
 
 
 # =========================
@@ -62,9 +234,10 @@ def tokenize(input: str) -> Iterator[str]:
 ## =========================
 
 
-def enrich(tokens: Iterator[str]) -> Iterator:
+def enrich(tokens: Iterable[Token | str]) -> Iterator:
     """
-    Given a sequence of string tokens, replace them with Useful Shit
+    Given a sequence of Tokens (or string tokens), replace them with Useful Shit,
+    one entity per token (so the i-th entity came from the i-th Token's span)
     - numbers
     - math operators -> functions
     - math functions -> functions
@@ -79,47 +252,52 @@ def enrich(tokens: Iterator[str]) -> Iterator:
     but instead I can just pass `neg` on to the calculation and leave it be.
     """
     last_non_minus = None  # the last non-minus entity we've seen.
+    last_was_minus = False  # "3--5": the second minus can only be a negation
 
     for index, token in enumerate(tokens):
-        try:
-            number = int(token)  # todo: handle floats or ints
-            last_non_minus = number
-            yield number
-            continue
-        except ValueError:
-            pass
+        if type(token) is str:
+            # plain strings (e.g. from tokenize()) don't know their kind yet
+            token = classify(token)
+        kind, start, end, source = token
+        # the only place token text gets materialized, and only to resolve it;
+        # operators are one character, and indexing that doesn't allocate a new string
+        text = source[start] if kind is TokenKind.OP else source[start:end]
 
-        try:
-            number = float(token)
+        if kind is TokenKind.INT or kind is TokenKind.FLOAT:
+            number = int(text) if kind is TokenKind.INT else float(text)
             last_non_minus = number
+            last_was_minus = False
             yield number
             continue
-        except ValueError:
-            pass
 
-        if token == "-":
+        if text == "-":
             if (
                 index == 0  # first token
+                or last_was_minus
                 or last_non_minus is None  # nth minus in a row since start
                 or last_non_minus == Special.PAREN_LEFT
+                or last_non_minus == Special.COMMA  # atan2(1, -2)
                 or (type(last_non_minus) is Operator and last_non_minus != neg)
             ):
                 entity = neg
 
             elif (
-                # - we follow a number or a closed paren
+                # - we follow a number, a variable, or a closed paren
                 type(last_non_minus) is int
                 or type(last_non_minus) is float
+                or type(last_non_minus) is Variable
                 or last_non_minus == Special.PAREN_RIGHT
             ):
                 entity = subtract
             else:
-                raise Exception(f"Unexpected Minus, prev non-minus: {last_non_minus}")
+                raise ParseError(f"Unexpected Minus, prev non-minus: {last_non_minus}", start)
+            last_was_minus = True
             yield entity
             continue
 
-        # Otherwise, we have a function, named constant, operator, or Paren
-        entity = get_entity(token)
+        # Otherwise, we have a function, named constant, variable, operator, or Paren
+        entity = get_entity(text)
 
         last_non_minus = entity
+        last_was_minus = False
         yield entity
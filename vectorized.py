@@ -0,0 +1,171 @@
+"""
+# vectorized.py
+#
+# Evaluate one RPN program against whole NumPy arrays of variable bindings,
+# so that each RPN step is a single ufunc call instead of a python loop per row.
+#
+#    In [1]: expr = compile("2 * x + y")
+#    In [2]: eval_rpn_vectorized(expr.rpn, {"x": np.arange(3), "y": 1})
+#    Out[2]: array([1, 3, 5])
+#
+# NumPy is optional: everything else in this package works without it.
+"""
+
+import math
+import operator
+import warnings
+from functools import reduce
+from typing import Iterable, Mapping
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from entities import (
+    Callable,
+    Entity,
+    Load,
+    Store,
+    Variable,
+    div,
+    _fsum,
+    _max,
+    _min,
+    _neg,
+    _prod,
+    render,
+    unwrap,
+)
+
+
+class VectorizationFallbackWarning(UserWarning):
+    """A function had no ufunc equivalent, so it is being applied one element at a time"""
+
+
+def _build_ufunc_mapping() -> dict:
+    mapping = {
+        operator.add: np.add,
+        operator.sub: np.subtract,
+        operator.mul: np.multiply,
+        div: np.true_divide,
+        operator.mod: np.mod,
+        operator.pow: np.power,
+        _neg: np.negative,
+        operator.abs: np.absolute,
+        abs: np.absolute,
+        max: np.maximum,
+        min: np.minimum,
+        # variadic: reduced over however many arguments a call has (see get_vectorized)
+        _max: np.maximum,
+        _min: np.minimum,
+        _fsum: np.add,
+        _prod: np.multiply,
+    }
+    # math functions that share a name (and meaning) with a numpy ufunc
+    for name in [
+        "sqrt", "exp", "expm1", "log", "log2", "log10", "log1p",
+        "sin", "cos", "tan", "sinh", "cosh", "tanh",
+        "floor", "ceil", "trunc", "fabs", "hypot", "copysign", "fmod", "isnan", "isinf",
+    ]:  # fmt: skip
+        mapping[getattr(math, name)] = getattr(np, name)
+    for name, ufunc_name in [
+        ("asin", "arcsin"), ("acos", "arccos"), ("atan", "arctan"), ("atan2", "arctan2"),
+        ("asinh", "arcsinh"), ("acosh", "arccosh"), ("atanh", "arctanh"),
+        ("degrees", "degrees"), ("radians", "radians"), ("pow", "float_power"),
+    ]:  # fmt: skip
+        mapping[getattr(math, name)] = getattr(np, ufunc_name)
+    return mapping
+
+
+ufunc_mapping = {} if np is None else _build_ufunc_mapping()
+# variadic functions called with one argument, which isn't just that argument (as reducing
+# over it would give): hypot(x) is abs(x), and both it and fsum(x) are floats
+one_argument_mapping = {}
+if np is not None:
+    one_argument_mapping[math.hypot] = lambda x: np.hypot(x, 0)
+    one_argument_mapping[_fsum] = lambda x: np.add(x, 0.0)
+
+
+def _power(base, exponent):
+    # np.power on ints wraps around past int64, and refuses negative exponents, where
+    # python's ** gives a big int, or a float: for those, ** it is, element by element
+    base, exponent = np.asarray(base), np.asarray(exponent)
+    if base.dtype.kind in "iu" and exponent.dtype.kind in "iu" and exponent.size:
+        magnitude = np.float_power(np.abs(base), np.maximum(exponent, 0))
+        if exponent.min() < 0 or magnitude.max() >= 2.0**62:
+            return np.vectorize(operator.pow, otypes=[object])(base, exponent)
+    return np.power(base, exponent)
+
+
+def get_vectorized(token: Callable):
+    """
+    Get an array-at-a-time version of an Operator or Function:
+    its ufunc if we know one, otherwise np.vectorize (with a warning, since that's a python loop)
+    """
+    function = unwrap(token.function)
+    if function is operator.pow:
+        return _power
+    ufunc = ufunc_mapping.get(function)
+    if ufunc is not None and ufunc.nin == token.arity:
+        return ufunc
+    if ufunc is not None and ufunc.nin == 2:
+        if token.arity == 0:
+            # nothing to vectorize: e.g. fsum() is 0.0, whatever the bindings
+            return function
+        if token.arity == 1 and function in one_argument_mapping:
+            return one_argument_mapping[function]
+        # a variadic call, e.g. max(x, y, z) -> np.maximum(np.maximum(x, y), z)
+        return lambda *args: reduce(ufunc, args)
+    # (a ufunc that takes a different number of arguments, e.g. np.log for log(x, base),
+    # would take the extra one as its `out`)
+    warnings.warn(
+        f"{render(token)} has no numpy ufunc equivalent; falling back to a per-element loop",
+        VectorizationFallbackWarning,
+        stacklevel=3,
+    )
+    return np.vectorize(function, otypes=[object])
+
+
+def eval_rpn_vectorized(input_rpn_tokens: Iterable[Entity], variables: Mapping):
+    """
+    Like shunting_yard.eval_rpn, but variables are bound to arrays (or anything numpy
+    can broadcast), and every Operator/Function is applied to whole arrays at once.
+
+    The result is broadcast to the common shape of the bindings.
+    """
+    if np is None:
+        raise ImportError("eval_rpn_vectorized requires numpy")
+
+    arrays = {name: np.asarray(value) for name, value in variables.items()}
+    stack = []
+    temps = {}
+    for token in input_rpn_tokens:
+        if type(token) in [int, float]:
+            stack.append(token)
+        elif type(token) is Variable:
+            if token.name not in arrays:
+                raise NameError(f"Unbound variable {token.name!r}")
+            stack.append(arrays[token.name])
+        elif isinstance(token, Callable):
+            arity = token.arity
+            if len(stack) < arity:
+                raise ValueError(f"Not enough operands for {render(token)}")
+            args = stack[len(stack) - arity :]
+            del stack[len(stack) - arity :]
+            stack.append(get_vectorized(token)(*args))
+        elif type(token) is Store:
+            temps[token.slot] = stack[-1]
+        elif type(token) is Load:
+            stack.append(temps[token.slot])
+        else:
+            raise ValueError(f"Unexpected token in RPN: {token!r}")
+
+    if len(stack) != 1:
+        raise ValueError(f"Malformed RPN: {len(stack)} values left on the stack")
+    result = np.asarray(stack[0])
+    shape = np.broadcast_shapes(*(array.shape for array in arrays.values()))
+    if result.shape != shape:
+        # e.g. "2 * 3" or "x * 0 + 1" with a scalar x: one value per row
+        result = np.broadcast_to(result, shape).copy()
+    return result
@@ -0,0 +1,172 @@
+"""
+# workbook.py
+#
+# Spreadsheet-style named formulas that reference each other, and a few inputs.
+# Each formula is compiled once; the variables in its RPN are the cells it depends on.
+# When an input (or a formula) changes, only the cells downstream of it are recomputed,
+# in topological order, and every other cell keeps its cached value.
+#
+#    In [1]: book = Workbook()
+#    In [2]: book.set_input("price", 10)
+#    In [3]: book.define("tax", "price * 0.2")
+#    In [4]: book.define("total", "price + tax")
+#    In [5]: book["total"]
+#    Out[5]: 12.0
+#    In [6]: book.set_input("price", 20)  # recomputes tax, then total
+#    Out[6]: ['tax', 'total']
+"""
+
+from collections import deque
+from typing import Iterable, Mapping
+
+import compiler
+from compiler import CompiledExpression
+
+
+class CycleError(ValueError):
+    """A formula would (indirectly) depend on itself"""
+
+
+class Workbook:
+    def __init__(self):
+        self.inputs: dict[str, int | float] = {}
+        self.formulas: dict[str, CompiledExpression] = {}
+        # current value of every cell (inputs and formulas) that has one
+        self.values: dict[str, int | float] = {}
+        # formula name -> the exception it raised, for formulas that failed
+        self.errors: dict[str, Exception] = {}
+        # name -> names of the formulas that reference it (which may not be defined yet)
+        self.dependents: dict[str, set[str]] = {}
+        self.evaluations = 0  # how many times a formula has been evaluated, over all time
+
+    # -------------
+    # Defining cells
+    # -------------
+
+    def set_input(self, name: str, value: int | float) -> list[str]:
+        """Set one input; returns the names of the formulas that were recomputed"""
+        return self.set_inputs({name: value})
+
+    def set_inputs(self, inputs: Mapping[str, int | float]) -> list[str]:
+        """
+        Set several inputs at once, so that a formula depending on more than one of them
+        is only recomputed once. Returns the names of the recomputed formulas, in order.
+        """
+        for name, value in inputs.items():
+            if name in self.formulas:
+                raise ValueError(f"{name!r} is a formula, not an input")
+            self.inputs[name] = value
+            self.values[name] = value
+        return self._recompute(inputs)
+
+    def define(self, name: str, source: str) -> list[str]:
+        """
+        Define (or redefine) a formula. Its dependencies don't have to exist yet.
+        Raises CycleError, leaving the workbook unchanged, if this would create a cycle.
+        Returns the names of the recomputed formulas: this one, then its dependents.
+        """
+        if name in self.inputs:
+            raise ValueError(f"{name!r} is an input, not a formula")
+        expression = compiler.compile(source)
+        self._check_for_cycle(name, expression.variables)
+
+        previous = self.formulas.get(name)
+        if previous is not None:
+            for dependency in previous.variables:
+                self.dependents[dependency].discard(name)
+        for dependency in expression.variables:
+            self.dependents.setdefault(dependency, set()).add(name)
+        self.formulas[name] = expression
+        return self._recompute([name], include_changed=True)
+
+    def remove(self, name: str) -> list[str]:
+        """Remove an input or formula; the formulas depending on it are recomputed (and fail)"""
+        if name in self.formulas:
+            for dependency in self.formulas.pop(name).variables:
+                self.dependents[dependency].discard(name)
+        elif name in self.inputs:
+            del self.inputs[name]
+        else:
+            raise KeyError(name)
+        self.values.pop(name, None)
+        self.errors.pop(name, None)
+        return self._recompute([name])
+
+    def __getitem__(self, name: str) -> int | float:
+        if name in self.errors:
+            raise self.errors[name]
+        return self.values[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.inputs or name in self.formulas
+
+    # -------------
+    # Dependency graph
+    # -------------
+
+    def dependencies(self, name: str) -> tuple[str, ...]:
+        """Names that the formula `name` references directly"""
+        return self.formulas[name].variables if name in self.formulas else ()
+
+    def _check_for_cycle(self, name: str, dependencies: Iterable[str]):
+        """Would `name` be reachable from its own dependencies?"""
+        pending = list(dependencies)
+        seen = set()
+        while pending:
+            current = pending.pop()
+            if current == name:
+                raise CycleError(f"Defining {name!r} would create a cycle")
+            if current in seen:
+                continue
+            seen.add(current)
+            pending.extend(self.dependencies(current))
+
+    def affected(self, changed: Iterable[str]) -> list[str]:
+        """
+        Formulas downstream of the `changed` names, in topological order
+        (every formula comes after the formulas it depends on).
+        """
+        # everything reachable through dependents
+        affected = set()
+        pending = [dependent for name in changed for dependent in self.dependents.get(name, ())]
+        while pending:
+            current = pending.pop()
+            if current in affected or current not in self.formulas:
+                continue
+            affected.add(current)
+            pending.extend(self.dependents.get(current, ()))
+
+        # Kahn's algorithm, over just the affected part of the graph
+        waiting_on = {
+            name: sum(1 for dependency in set(self.dependencies(name)) if dependency in affected)
+            for name in affected
+        }
+        ready = deque(name for name, count in waiting_on.items() if count == 0)
+        order = []
+        while ready:
+            current = ready.popleft()
+            order.append(current)
+            for dependent in self.dependents.get(current, ()):
+                if dependent in waiting_on:
+                    waiting_on[dependent] -= 1
+                    if waiting_on[dependent] == 0:
+                        ready.append(dependent)
+        return order
+
+    def _recompute(self, changed: Iterable[str], include_changed: bool = False) -> list[str]:
+        changed = list(changed)
+        order = self.affected(changed)
+        if include_changed:
+            # a (re)defined formula goes first: nothing it depends on has changed
+            order = [name for name in changed if name in self.formulas] + order
+        for name in order:
+            self.evaluations += 1
+            try:
+                self.values[name] = self.formulas[name].evaluate(self.values)
+            except Exception as e:
+                # e.g. a dependency that isn't defined yet, or one that failed itself
+                self.values.pop(name, None)
+                self.errors[name] = e
+            else:
+                self.errors.pop(name, None)
+        return order